@@ -1,26 +1,63 @@
-from .serializers import GameSerializer, PortfolioSerializer, HoldingSerializer, OptionSerializer
-from trade_simulation.models import Game, Portfolio, Holding, Option
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .pagination import keyset_page
+from .serializers import (
+    GameSerializer,
+    GameSummarySerializer,
+    LeaderboardEntrySerializer,
+    PortfolioSerializer,
+    HoldingSerializer,
+    OptionSerializer,
+    RestingOrderSerializer,
+    QueuedTradeSerializer,
+)
+from trade_simulation.models import (
+    Game, Portfolio, Holding, Option, RestingOrder, QueuedTrade, compute_total_values, to_cents, to_decimal,
+)
+from trade_simulation.orderbook import order_book
+from trade_simulation.leaderboard import leaderboards
+from trade_simulation.history import value_series
+from trade_simulation.orders import Order, ORDER_FILLED, execute_orders
+from trade_simulation.quotes import get_quotes
+from trade_simulation.tradequeue import enqueue_trade, parse_trade
+from trade_simulation.standings import refresh_standings
 from .utils import find_game_by_title, find_portfolio, find_holding, find_option, find_user_by_username
 
+# Keyset orderings of the paginated endpoints; each ends in a field unique within the listing
+GAME_LIST_ORDERING = ("-created_on", "-uid")
+LEADERBOARD_ORDERING = ("game_rank", "title")
+# Execution modes of batch orders: all orders or none, or every order that can be executed
+BATCH_MODE_ALL_OR_NOTHING = "all"
+BATCH_MODE_BEST_EFFORT = "best_effort"
+DEFAULT_TRADE_BATCH_MAX_ORDERS = 100
+# Related rows serialized with every game, loaded with one query each instead of one per row
+STANDINGS_PREFETCH = (
+    "portfolio_set__owner",
+    "portfolio_set__holding_set",
+    "portfolio_set__option_set",
+)
 
-def _get_game_standings_helper():
+
+def _get_game_standings_helper(refresh=False):
     """
-    Helper function to fetch portfolio rankings for each game
+    Helper function to fetch portfolio rankings for each game. Standings are served as stored,
+    only games ranked longer than GAME_STANDINGS_MAX_AGE ago (or all games if refresh) are revalued.
     Returns: Game objects with winners set
     """
     games = Game.objects.all()
-    if len(games) <= 0:
+    if not games.exists():
         return None
-    for game in games:
-        game.rank_portfolios()
-    serializer = GameSerializer(games, many=True)
+    refresh_standings(games, max_age=0 if refresh else None)
+    serializer = GameSerializer(games.prefetch_related(*STANDINGS_PREFETCH), many=True)
     print(f"Returning game standings: {serializer.data}.")
     return serializer.data
 
 
-def _get_game_helper(game_title):
+def _get_game_helper(game_title, refresh=False):
     """
-    Helper function to find and return game
+    Helper function to find and return game, revaluing its standings only when they are
+    older than GAME_STANDINGS_MAX_AGE or refresh is requested
     Returns: game with title game_title or error
     """
     game = find_game_by_title(game_title)
@@ -28,7 +65,9 @@ def _get_game_helper(game_title):
         error = f"Could not find game with title {game_title}."
         print(error)
         raise ValueError(error)
-    game.rank_portfolios()
+    # Ranked through refresh_standings, like every other ranking, so that it records the value history
+    refresh_standings(Game.objects.filter(pk=game.pk), max_age=0 if refresh else None)
+    game.refresh_from_db(fields=["ranked_on"])
     try:
         serializer = GameSerializer(game, many=False)
         print(f"Returning game standings: {serializer.data}.")
@@ -39,6 +78,41 @@ def _get_game_helper(game_title):
         raise RuntimeError(error)
 
 
+def _get_game_list_helper(cursor=None, limit=None):
+    """
+    Helper function to fetch one page of games, newest first, without their portfolios
+    Returns: dict with the games of the page and the cursor of the next page
+    """
+    games, next_cursor = keyset_page(Game.objects.all(), GAME_LIST_ORDERING, cursor, limit)
+    return {"results": GameSummarySerializer(games, many=True).data, "next": next_cursor}
+
+
+def _get_leaderboard_helper(game_title, cursor=None, limit=None, refresh=False):
+    """
+    Helper function to fetch one page of a game's portfolios ordered by rank. Stale standings
+    are revalued only when the first page is requested, so that later pages stay consistent.
+    Returns: dict with the portfolios of the page, the cursor of the next page and the time
+    the standings were computed
+    """
+    game = find_game_by_title(game_title)
+    if not game:
+        error = f"Could not find game with title {game_title}."
+        print(error)
+        raise ValueError(error)
+    if not cursor:
+        # Ranked through refresh_standings, like every other ranking, so that it records the value history
+        refresh_standings(Game.objects.filter(pk=game.pk), max_age=0 if refresh else None)
+        game.refresh_from_db(fields=["ranked_on"])
+    portfolios, next_cursor = keyset_page(
+        Portfolio.objects.filter(game=game).select_related("owner"), LEADERBOARD_ORDERING, cursor, limit
+    )
+    return {
+        "results": LeaderboardEntrySerializer(portfolios, many=True).data,
+        "next": next_cursor,
+        "ranked_on": game.ranked_on,
+    }
+
+
 def _create_game_helper(title, rules, starting_balance):
     """
     Helper function to create a new game
@@ -87,10 +161,11 @@ def _get_portfolios_helper():
     Returns: portfolio objects
     """
     try:
-        portfolios = Portfolio.objects.all()
+        # Compute total values together to make sure portfolio objects are up to date
+        portfolios = compute_total_values(Portfolio.objects.all(), Holding.objects.all(), Option.objects.all())
+        Portfolio.objects.bulk_update(portfolios, ["total_value"])
         for portfolio in portfolios:
-            # Compute total value to make sure portfolio object is up to date
-            portfolio.compute_total_value()
+            leaderboards.update(portfolio)
         serializer = PortfolioSerializer(portfolios, many=True)
         print(f"Successfully fetched all portfolios: {serializer.data}.")
         return serializer.data
@@ -112,7 +187,9 @@ def _get_portfolio_helper(title, game_title):
         raise ValueError(error)
     try:
         # Compute total value to make sure portfolio object is up to date
-        portfolio.compute_total_value()
+        portfolio.compute_total_value(get_quotes(portfolio.held_tickers()))
+        # Rank against the rest of the game without re-ranking it
+        portfolio.game_rank = portfolio.current_rank() or portfolio.game_rank
         serializer = PortfolioSerializer(portfolio, many=False)
         print(f"Fetched portfolio with id={portfolio.uid}: {serializer.data}")
         return serializer.data
@@ -122,6 +199,49 @@ def _get_portfolio_helper(title, game_title):
         raise RuntimeError(error)
 
 
+def _parse_history_time(value):
+    """
+    Reads an optional ISO 8601 time bound of a history query
+    """
+    if not value:
+        return None
+    try:
+        moment = parse_datetime(value)
+    except ValueError:
+        moment = None
+    if moment is None:
+        error = f"Invalid time {value}."
+        print(error)
+        raise ValueError(error)
+    return moment
+
+
+def _get_portfolio_history_helper(title, game_title, start=None, end=None, points=None):
+    """
+    Helper function to return the value history of a specific portfolio, downsampled for charting
+    Returns: dict with the list of times and total values
+    """
+    portfolio = find_portfolio(title, game_title)
+    if not portfolio:
+        error = f"Could not find portfolio with title {title} in game {game_title}."
+        print(error)
+        raise ValueError(error)
+    if points not in (None, ""):
+        try:
+            points = int(points)
+        except ValueError:
+            points = 0
+        if points <= 0:
+            error = f"Number of points must be a positive integer, got {points}."
+            print(error)
+            raise ValueError(error)
+    series = value_series(portfolio, _parse_history_time(start), _parse_history_time(end), points or None)
+    return {
+        "portfolio": portfolio.uid,
+        "history": [{"taken_on": taken_on, "total_value": round(value, 2)} for taken_on, value in series],
+    }
+
+
 def _delete_portfolio_helper(title, game_title):
     """
     Helper function to delete specific portfolio in specific game
@@ -226,6 +346,153 @@ def _trade_option_helper(title, game_title, contract, quantity):
         print(f"Portfolio {title} sold {-quantity} options of {contract}.")
 
 
+def _parse_order(data):
+    """
+    Reads one order of a batch in the format of a single trade request
+    """
+    security_type = data.get("securityType")
+    if security_type == "option":
+        symbol, quantity = data.get("contract"), data.get("quantity")
+    else:
+        symbol, quantity = data.get("ticker"), data.get("shares")
+    try:
+        quantity = float(quantity)
+    except (TypeError, ValueError):
+        quantity = None
+    order = Order(security_type, symbol, quantity)
+    if data.get("exercise"):
+        order.reject("Options can only be exercised with single trades.")
+    return order
+
+
+def _trade_batch_helper(title, game_title, orders, mode=None):
+    """
+    Helper function to buy or sell several stocks and options at once
+    Returns: dict with whether any order was executed and the result of every order
+    """
+    mode = mode or BATCH_MODE_ALL_OR_NOTHING
+    if mode not in (BATCH_MODE_ALL_OR_NOTHING, BATCH_MODE_BEST_EFFORT):
+        error = f"Batch mode {mode} is not supported."
+        print(error)
+        raise ValueError(error)
+    max_orders = getattr(settings, "TRADE_BATCH_MAX_ORDERS", DEFAULT_TRADE_BATCH_MAX_ORDERS)
+    if not isinstance(orders, list) or not 0 < len(orders) <= max_orders:
+        error = f"A batch must list between 1 and {max_orders} orders."
+        print(error)
+        raise ValueError(error)
+    portfolio = find_portfolio(title, game_title)
+    if not portfolio:
+        error = f"Cannot find portfolio {title} in game {game_title}."
+        print(error)
+        raise ValueError(error)
+    orders = execute_orders(
+        portfolio,
+        [_parse_order(order if isinstance(order, dict) else {}) for order in orders],
+        all_or_nothing=mode == BATCH_MODE_ALL_OR_NOTHING,
+    )
+    filled = sum(order.status == ORDER_FILLED for order in orders)
+    print(f"Portfolio {title} executed {filled} of {len(orders)} orders.")
+    return {"executed": filled > 0, "results": [order.to_result() for order in orders]}
+
+
+def _queue_trade_helper(title, game_title, data, idempotency_key=None):
+    """
+    Helper function to queue a stock or option trade for the trade workers, without waiting for
+    prices. Retrying with the same idempotency key returns the trade queued the first time.
+    Returns: tuple of (the queued trade, whether it was queued by this call)
+    """
+    order = parse_trade(data)
+    portfolio = find_portfolio(title, game_title)
+    if not portfolio:
+        error = f"Cannot find portfolio {title} in game {game_title}."
+        print(error)
+        raise ValueError(error)
+    queued, created = enqueue_trade(portfolio, order, idempotency_key=idempotency_key)
+    if created:
+        print(f"Portfolio {title} queued trade {queued.uid}.")
+    return QueuedTradeSerializer(queued, many=False).data, created
+
+
+def _get_queued_trade_helper(uid):
+    """
+    Helper function to fetch the status of a queued trade
+    Returns: the queued trade
+    """
+    queued = QueuedTrade.objects.filter(uid=uid).first()
+    if queued is None:
+        error = f"Cannot find queued trade {uid}."
+        print(error)
+        raise ValueError(error)
+    return QueuedTradeSerializer(queued, many=False).data
+
+
+def _place_order_helper(title, game_title, ticker, shares, order_type, trigger_price):
+    """
+    Helper function to place a limit or stop order that rests until its trigger price is crossed
+    Returns: the order
+    """
+    portfolio = find_portfolio(title, game_title)
+    if not portfolio:
+        error = f"Cannot find portfolio {title} in game {game_title}."
+        print(error)
+        raise ValueError(error)
+    order_type = str(order_type).upper()
+    if order_type not in (RestingOrder.ORDER_TYPE_LIMIT, RestingOrder.ORDER_TYPE_STOP):
+        error = f"Order type {order_type} is not supported."
+        print(error)
+        raise ValueError(error)
+    try:
+        shares = float(shares)
+        trigger_price = float(trigger_price)
+    except (TypeError, ValueError):
+        shares = trigger_price = 0
+    if not ticker or shares == 0 or trigger_price <= 0:
+        error = "An order needs a ticker, a nonzero number of shares and a positive trigger price."
+        print(error)
+        raise ValueError(error)
+    order = RestingOrder.objects.create(
+        portfolio=portfolio,
+        ticker=ticker,
+        order_type=order_type,
+        shares=to_decimal(shares),
+        trigger_price=to_cents(trigger_price),
+    )
+    # The refresher's order book picks the order up from the database on its next sync
+    print(f"Portfolio {title} placed order {order}.")
+    return RestingOrderSerializer(order, many=False).data
+
+
+def _get_orders_helper(title, game_title):
+    """
+    Helper function to list the open limit and stop orders of a portfolio
+    Returns: list of orders
+    """
+    portfolio = find_portfolio(title, game_title)
+    if not portfolio:
+        error = f"Cannot find portfolio {title} in game {game_title}."
+        print(error)
+        raise ValueError(error)
+    orders = RestingOrder.objects.filter(portfolio=portfolio, status=RestingOrder.STATUS_OPEN)
+    return RestingOrderSerializer(orders, many=True).data
+
+
+def _cancel_order_helper(uid):
+    """
+    Helper function to cancel an open limit or stop order
+    Returns: N/A or error
+    """
+    cancelled = RestingOrder.objects.filter(uid=uid, status=RestingOrder.STATUS_OPEN).update(
+        status=RestingOrder.STATUS_CANCELLED, closed_on=timezone.now()
+    )
+    if not cancelled:
+        error = f"Order {uid} is not open."
+        print(error)
+        raise ValueError(error)
+    # Frees the entry when the refresher runs in this process; other books skip the order when filling
+    order_book.remove(uid)
+    print(f"Cancelled order {uid}.")
+
+
 def _get_holding_helper(portfolio_title, game_title, ticker):
     """
     Helper function to fetch a particular holding in a portfolio
@@ -0,0 +1,85 @@
+import base64
+import json
+from django.conf import settings
+from django.db.models import Q
+
+DEFAULT_API_PAGE_SIZE = 50
+DEFAULT_API_MAX_PAGE_SIZE = 200
+
+
+def page_size(limit):
+    """
+    page_size validates the requested page size, bounded by API_MAX_PAGE_SIZE
+    Returns: int or ValueError if limit is not a positive integer
+    """
+    if limit in (None, ""):
+        return getattr(settings, "API_PAGE_SIZE", DEFAULT_API_PAGE_SIZE)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        limit = 0
+    if limit <= 0:
+        error = f"Page size must be a positive integer, got {limit}."
+        print(error)
+        raise ValueError(error)
+    return min(limit, getattr(settings, "API_MAX_PAGE_SIZE", DEFAULT_API_MAX_PAGE_SIZE))
+
+
+def encode_cursor(values):
+    """
+    encode_cursor turns the ordering values of the last row of a page into an opaque cursor
+    Returns: str
+    """
+    # str keeps full microsecond precision of timestamps, unlike DjangoJSONEncoder
+    raw = json.dumps(values, default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor, length):
+    """
+    decode_cursor reads back the ordering values stored in a cursor
+    Returns: list of values or ValueError if the cursor is malformed
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        values = None
+    if not isinstance(values, list) or len(values) != length:
+        error = f"Invalid cursor {cursor}."
+        print(error)
+        raise ValueError(error)
+    return values
+
+
+def _after(ordering, values):
+    """
+    _after builds the keyset condition selecting rows that sort after values in ordering
+    """
+    condition = Q()
+    for i, field in enumerate(ordering):
+        name = field.lstrip("-")
+        lookup = "lt" if field.startswith("-") else "gt"
+        step = Q(**{f"{name}__{lookup}": values[i]})
+        for previous, value in zip(ordering[:i], values[:i]):
+            step &= Q(**{previous.lstrip("-"): value})
+        condition |= step
+    return condition
+
+
+def keyset_page(queryset, ordering, cursor=None, limit=None):
+    """
+    keyset_page reads one page of queryset in the given ordering, which must end in a unique field.
+    Pages start right after the row the cursor points to, so each page costs one indexed query
+    however deep it is, and rows inserted meanwhile never shift or repeat later pages.
+    Returns: tuple of (list of rows, cursor of the next page or None if this is the last page)
+    """
+    limit = page_size(limit)
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        queryset = queryset.filter(_after(ordering, decode_cursor(cursor, len(ordering))))
+    rows = list(queryset[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor([getattr(last, field.lstrip("-")) for field in ordering])
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from trade_simulation.models import Game, Portfolio, Holding, Option, Transaction
+from trade_simulation.models import Game, Portfolio, Holding, Option, Transaction, RestingOrder, QueuedTrade
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -29,6 +29,26 @@ class GameSerializer(serializers.ModelSerializer):
         return serializer.data
 
 
+class GameSummarySerializer(serializers.ModelSerializer):
+    """
+    Game Summary Serializer serializes the fields of a Game without its portfolios.
+    """
+    class Meta:
+        model = Game
+        fields = "__all__"
+
+
+class LeaderboardEntrySerializer(serializers.ModelSerializer):
+    """
+    Leaderboard Entry Serializer serializes the standing of one Portfolio without its holdings and options.
+    """
+    owner = serializers.SlugRelatedField(slug_field="username", read_only=True)
+
+    class Meta:
+        model = Portfolio
+        fields = ["uid", "title", "owner", "game_rank", "total_value", "cash_balance"]
+
+
 class HoldingSerializer(serializers.ModelSerializer):
     """
     Holding Serializer serializers all the fields in Holding to a useable object.
@@ -79,3 +99,21 @@ class TransactionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Transaction
         fields = "__all__"
+
+
+class RestingOrderSerializer(serializers.ModelSerializer):
+    """
+    Resting Order Serializer serializers all the fields in RestingOrder to a useable object.
+    """
+    class Meta:
+        model = RestingOrder
+        fields = "__all__"
+
+
+class QueuedTradeSerializer(serializers.ModelSerializer):
+    """
+    Queued Trade Serializer serializers all the fields in QueuedTrade to a useable object.
+    """
+    class Meta:
+        model = QueuedTrade
+        fields = "__all__"
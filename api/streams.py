@@ -0,0 +1,109 @@
+import asyncio
+import re
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from trade_simulation.broker import get_broker
+from trade_simulation.models import Game
+
+DEFAULT_STREAM_HEARTBEAT = 15
+DEFAULT_STREAM_QUEUE_SIZE = 100
+# Server-Sent Events stream of a game's standings changes
+STREAM_PATH = re.compile(r"^/api/game/(?P<game_title>[^/]+)/stream/?$")
+STREAM_HEADERS = [
+    (b"content-type", b"text/event-stream"),
+    (b"cache-control", b"no-cache"),
+    # Keep reverse proxies from buffering the stream
+    (b"x-accel-buffering", b"no"),
+]
+RESYNC = object()
+
+
+def sse_event(event, data):
+    """
+    sse_event formats one Server-Sent Event
+    Returns: bytes
+    """
+    lines = "".join(f"data: {line}\n" for line in data.splitlines() or [""])
+    return f"event: {event}\n{lines}\n".encode()
+
+
+@sync_to_async
+def _find_game(title):
+    return Game.objects.filter(title=title).first()
+
+
+def _offer(queue, message):
+    # Runs on the event loop; a client too slow to keep up is told to refetch the leaderboard
+    if queue.full():
+        while not queue.empty():
+            queue.get_nowait()
+        message = RESYNC
+    queue.put_nowait(message)
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def leaderboard_stream(scope, receive, send, game_title):
+    """
+    leaderboard_stream is the ASGI handler streaming the standings changes of one game. Clients first
+    read the leaderboard endpoint, then apply the "standings" events, each listing the portfolios
+    whose rank or value changed. A "resync" event asks the client to read the leaderboard again.
+    Returns: N/A
+    """
+    game = await _find_game(game_title)
+    if game is None:
+        await send({"type": "http.response.start", "status": 404, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": f"Could not find game with title {game_title}.".encode()})
+        return
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=getattr(settings, "STREAM_QUEUE_SIZE", DEFAULT_STREAM_QUEUE_SIZE))
+    heartbeat = getattr(settings, "STREAM_HEARTBEAT", DEFAULT_STREAM_HEARTBEAT)
+    # Messages are published from worker threads and handed over to this connection's event loop
+    unsubscribe = get_broker().subscribe(
+        game.title, lambda message: loop.call_soon_threadsafe(_offer, queue, message)
+    )
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        await send({"type": "http.response.start", "status": 200, "headers": STREAM_HEADERS})
+        ranked_on = game.ranked_on.isoformat() if game.ranked_on else ""
+        await send({"type": "http.response.body", "body": sse_event("ready", ranked_on), "more_body": True})
+        while not disconnected.done():
+            next_message = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait(
+                {next_message, disconnected}, timeout=heartbeat, return_when=asyncio.FIRST_COMPLETED
+            )
+            if next_message not in done:
+                next_message.cancel()
+                if not done:
+                    await send({"type": "http.response.body", "body": b": keepalive\n\n", "more_body": True})
+                continue
+            message = next_message.result()
+            if message is RESYNC:
+                body = sse_event("resync", "")
+            else:
+                body = sse_event("standings", message)
+            await send({"type": "http.response.body", "body": body, "more_body": True})
+    finally:
+        unsubscribe()
+        disconnected.cancel()
+
+
+def with_streams(django_application):
+    """
+    with_streams wraps the Django ASGI application, serving standings streams directly so that
+    each open stream costs a coroutine rather than a worker thread
+    Returns: ASGI application
+    """
+    async def application(scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "GET":
+            match = STREAM_PATH.match(scope["path"])
+            if match:
+                await leaderboard_stream(scope, receive, send, match.group("game_title"))
+                return
+        await django_application(scope, receive, send)
+    return application
@@ -1,18 +1,29 @@
+import asyncio
+from asgiref.sync import async_to_sync
 from django.test import TestCase, RequestFactory
 import unittest.mock as mock
-from trade_simulation.models import Game, Portfolio, Holding, Transaction
+from trade_simulation.models import Game, Portfolio, Holding, Transaction, ValueSnapshot
 from django.contrib.auth.models import User
 from api.helpers import (
     _get_game_standings_helper,
     _get_game_helper,
+    _get_game_list_helper,
+    _get_leaderboard_helper,
     _create_game_helper,
     _delete_game_helper,
     _get_portfolios_helper,
     _get_portfolio_helper,
+    _get_portfolio_history_helper,
     _delete_portfolio_helper,
     _post_portfolio_helper,
     _trade_stock_helper,
     _trade_option_helper,
+    _trade_batch_helper,
+    _place_order_helper,
+    _get_orders_helper,
+    _cancel_order_helper,
+    _queue_trade_helper,
+    _get_queued_trade_helper,
     _get_holding_helper,
     _get_option_helper,
 )
@@ -20,9 +31,17 @@ from api.views import (
     get_routes,
     handle_games,
     handle_game,
+    handle_game_list,
+    handle_leaderboard,
     handle_portfolios,
     handle_portfolio,
+    handle_portfolio_history,
     trade,
+    trade_batch,
+    handle_orders,
+    handle_order,
+    queue_trade,
+    handle_queued_trade,
     handle_holdings,
     handle_holding,
     handle_options,
@@ -30,6 +49,10 @@ from api.views import (
     handle_transactions,
     handle_transaction,
 )
+from .streams import with_streams
+from trade_simulation.broker import get_broker
+from trade_simulation.orderbook import order_book
+from trade_simulation.standings import refresh_standings
 from .utils import find_game_by_title, find_portfolio, find_holding, find_option
 
 TEST_GAME_TITLE = "Game Title"
@@ -104,6 +127,173 @@ class HelperTestCase(TestCase):
         # THEN
         assert len(actual) == 3
 
+    def test_get_game_standings_helper_serves_stored(self):
+        """
+        Test that fresh standings are served as stored and only revalued on request
+        """
+        # GIVEN
+        _create_game_helper(TEST_GAME_TITLE, TEST_RULES, TEST_STARTING_BALANCE)
+        _get_game_standings_helper()
+        # WHEN
+        with mock.patch("trade_simulation.models.Game.rank_portfolios") as mock_rank:
+            actual = _get_game_standings_helper()
+            _get_game_helper(TEST_GAME_TITLE)
+            mock_rank.assert_not_called()
+            _get_game_standings_helper(refresh=True)
+        # THEN
+        self.assertIsNotNone(actual[0]["ranked_on"])
+        mock_rank.assert_called_once()
+
+    def test_get_game_helpers_record_history(self):
+        """
+        Test that standings revalued when a game or its leaderboard is read are recorded in the value history
+        """
+        # GIVEN
+        _create_game_helper(TEST_GAME_TITLE, TEST_RULES, TEST_STARTING_BALANCE)
+        game = find_game_by_title(TEST_GAME_TITLE)
+        Portfolio.objects.create(title=TEST_PORTFOLIO_TITLE, game=game, cash_balance=100)
+        # WHEN
+        actual = _get_game_helper(TEST_GAME_TITLE, refresh=True)
+        with mock.patch("trade_simulation.standings.record_snapshots") as mock_record:
+            leaderboard = _get_leaderboard_helper(TEST_GAME_TITLE, refresh=True)
+        # THEN
+        self.assertIsNotNone(actual["ranked_on"])
+        self.assertEqual(ValueSnapshot.objects.filter(game=game).count(), 1)
+        self.assertEqual([snapshot.game for snapshot in mock_record.call_args[0][0]], [game])
+        self.assertEqual(leaderboard["ranked_on"], Game.objects.get(pk=game.pk).ranked_on)
+
+    def test_get_game_list_helper_pages(self):
+        """
+        Test that the game list is paged newest first with cursors that neither skip nor repeat games
+        """
+        # GIVEN
+        for i in range(5):
+            _create_game_helper(f"{TEST_GAME_TITLE} {i}", TEST_RULES, TEST_STARTING_BALANCE)
+        titles = []
+        cursor = None
+        # WHEN
+        for _ in range(3):
+            page = _get_game_list_helper(cursor=cursor, limit=2)
+            titles += [game["title"] for game in page["results"]]
+            cursor = page["next"]
+        # THEN
+        self.assertIsNone(cursor)
+        self.assertEqual(titles, [f"{TEST_GAME_TITLE} {i}" for i in reversed(range(5))])
+        self.assertNotIn("portfolios", page["results"][0])
+        with self.assertRaises(ValueError):
+            _get_game_list_helper(cursor="not a cursor")
+        with self.assertRaises(ValueError):
+            _get_game_list_helper(limit="0")
+
+    def test_get_leaderboard_helper_pages(self):
+        """
+        Test that a game's leaderboard is paged in rank order
+        """
+        # GIVEN
+        _create_game_helper(TEST_GAME_TITLE, TEST_RULES, TEST_STARTING_BALANCE)
+        game = find_game_by_title(TEST_GAME_TITLE)
+        for i in range(3):
+            Portfolio.objects.create(title=f"{TEST_PORTFOLIO_TITLE} {i}", game=game, cash_balance=i)
+        # WHEN
+        first = _get_leaderboard_helper(TEST_GAME_TITLE, limit=2)
+        second = _get_leaderboard_helper(TEST_GAME_TITLE, cursor=first["next"], limit=2)
+        # THEN
+        self.assertEqual([p["game_rank"] for p in first["results"] + second["results"]], [1, 2, 3])
+        self.assertEqual(first["results"][0]["title"], f"{TEST_PORTFOLIO_TITLE} 2")
+        self.assertIsNotNone(first["ranked_on"])
+        self.assertIsNone(second["next"])
+
+    def test_get_portfolio_history_helper(self):
+        """
+        Test that a portfolio's value history is recorded by ranking and read back in time order
+        """
+        # GIVEN
+        _create_game_helper(TEST_GAME_TITLE, TEST_RULES, TEST_STARTING_BALANCE)
+        game = find_game_by_title(TEST_GAME_TITLE)
+        portfolio = Portfolio.objects.create(title=TEST_PORTFOLIO_TITLE, game=game, cash_balance=500)
+        refresh_standings(max_age=0)
+        # WHEN
+        actual = _get_portfolio_history_helper(TEST_PORTFOLIO_TITLE, TEST_GAME_TITLE)
+        # THEN
+        self.assertEqual(actual["portfolio"], portfolio.uid)
+        self.assertEqual([point["total_value"] for point in actual["history"]], [500.0])
+        self.assertRaises(ValueError, _get_portfolio_history_helper, TEST_PORTFOLIO_TITLE, TEST_GAME_TITLE, "x")
+        self.assertRaises(
+            ValueError, _get_portfolio_history_helper, TEST_PORTFOLIO_TITLE, TEST_GAME_TITLE, points="0"
+        )
+
+    @mock.patch("trade_simulation.orders.get_quotes", return_value={"AAPL": {"bid": 10.0, "ask": 11.0}})
+    def test_trade_batch_helper(self, mock_get_quotes):
+        """
+        Test that a batch of orders is executed and every order gets a result
+        """
+        # GIVEN
+        _create_game_helper(TEST_GAME_TITLE, TEST_RULES, TEST_STARTING_BALANCE)
+        game = find_game_by_title(TEST_GAME_TITLE)
+        Portfolio.objects.create(title=TEST_PORTFOLIO_TITLE, game=game, cash_balance=100)
+        orders = [
+            {"securityType": "stock", "ticker": "AAPL", "shares": "2"},
+            {"securityType": "stock", "ticker": "AAPL", "shares": "x"},
+        ]
+        # WHEN
+        actual = _trade_batch_helper(TEST_PORTFOLIO_TITLE, TEST_GAME_TITLE, orders, mode="best_effort")
+        # THEN
+        self.assertTrue(actual["executed"])
+        self.assertEqual([r["status"] for r in actual["results"]], ["filled", "rejected"])
+        self.assertEqual(find_holding(TEST_PORTFOLIO_TITLE, TEST_GAME_TITLE, "AAPL").shares, 2)
+        self.assertRaises(ValueError, _trade_batch_helper, TEST_PORTFOLIO_TITLE, TEST_GAME_TITLE, orders, "some")
+        self.assertRaises(ValueError, _trade_batch_helper, TEST_PORTFOLIO_TITLE, TEST_GAME_TITLE, [])
+
+    def test_resting_order_helpers(self):
+        """
+        Test that limit and stop orders can be placed, listed and cancelled
+        """
+        # GIVEN
+        _create_game_helper(TEST_GAME_TITLE, TEST_RULES, TEST_STARTING_BALANCE)
+        game = find_game_by_title(TEST_GAME_TITLE)
+        Portfolio.objects.create(title=TEST_PORTFOLIO_TITLE, game=game)
+        # WHEN
+        booked = len(order_book)
+        limit = _place_order_helper(TEST_PORTFOLIO_TITLE, TEST_GAME_TITLE, "AAPL", "10", "limit", "150.5")
+        stop = _place_order_helper(TEST_PORTFOLIO_TITLE, TEST_GAME_TITLE, "AAPL", "-10", "stop", "120")
+        _cancel_order_helper(stop["uid"])
+        # THEN
+        orders = _get_orders_helper(TEST_PORTFOLIO_TITLE, TEST_GAME_TITLE)
+        self.assertEqual([order["uid"] for order in orders], [limit["uid"]])
+        self.assertEqual(orders[0]["order_type"], "LIMIT")
+        # Only the refresher's book holds orders, loaded from the database
+        self.assertEqual(len(order_book), booked)
+        self.assertRaises(ValueError, _cancel_order_helper, stop["uid"])
+        self.assertRaises(
+            ValueError, _place_order_helper, TEST_PORTFOLIO_TITLE, TEST_GAME_TITLE, "AAPL", "1", "market", "1"
+        )
+        self.assertRaises(
+            ValueError, _place_order_helper, TEST_PORTFOLIO_TITLE, TEST_GAME_TITLE, "AAPL", "1", "limit", "-1"
+        )
+
+    def test_queue_trade_helper(self):
+        """
+        Test that a trade is queued without being priced, and that a retry with its idempotency key
+        returns the same queued trade
+        """
+        # GIVEN
+        _create_game_helper(TEST_GAME_TITLE, TEST_RULES, TEST_STARTING_BALANCE)
+        game = find_game_by_title(TEST_GAME_TITLE)
+        Portfolio.objects.create(title=TEST_PORTFOLIO_TITLE, game=game)
+        data = {"securityType": "stock", "ticker": "AAPL", "shares": "3"}
+        # WHEN
+        with mock.patch("trade_simulation.models.Holding.ask_price") as mock_ask_price:
+            queued, created = _queue_trade_helper(TEST_PORTFOLIO_TITLE, TEST_GAME_TITLE, data, "key-1")
+            retried, retried_created = _queue_trade_helper(TEST_PORTFOLIO_TITLE, TEST_GAME_TITLE, data, "key-1")
+        # THEN
+        mock_ask_price.assert_not_called()
+        self.assertTrue(created)
+        self.assertFalse(retried_created)
+        self.assertEqual(retried["uid"], queued["uid"])
+        self.assertEqual(queued["status"], "PENDING")
+        self.assertEqual(_get_queued_trade_helper(queued["uid"])["order"]["shares"], 3.0)
+        self.assertRaises(ValueError, _queue_trade_helper, "missing", TEST_GAME_TITLE, data)
+
     def test_get_game_standings_helper_no_games(self):
         """
         Test that helper returns None when no games
@@ -523,6 +713,95 @@ class ViewTestCase(TestCase):
         # WHEN / THEN
         self.assertEqual(handle_games(request).status_code, 200)
 
+    def test_handle_game_list_and_leaderboard(self):
+        """
+        Test that the paginated game list and leaderboard can be fetched
+        """
+        # GIVEN
+        _create_game_helper(TEST_GAME_TITLE, TEST_RULES, TEST_STARTING_BALANCE)
+        request = self.factory.get('/games/page', {"limit": 1})
+        # WHEN / THEN
+        self.assertEqual(handle_game_list(request).status_code, 200)
+        self.assertEqual(handle_leaderboard(request, TEST_GAME_TITLE).status_code, 200)
+        self.assertEqual(handle_leaderboard(request, "missing").status_code, 500)
+
+    def test_handle_trade_batch_fail(self):
+        """
+        Test that a batch for a portfolio that does not exist fails
+        """
+        # GIVEN
+        request = self.factory.post(
+            TRADE_URL + "/batch",
+            {"portfolioTitle": "missing", "gameTitle": TEST_GAME_TITLE, "orders": [{"securityType": "stock"}]},
+            content_type="application/json",
+        )
+        # WHEN / THEN
+        self.assertEqual(trade_batch(request).status_code, 500)
+
+    def test_handle_orders(self):
+        """
+        Test that orders of a portfolio can be listed and placed, and that unknown orders cannot be cancelled
+        """
+        # GIVEN
+        _create_game_helper(TEST_GAME_TITLE, TEST_RULES, TEST_STARTING_BALANCE)
+        game = find_game_by_title(TEST_GAME_TITLE)
+        Portfolio.objects.create(title=TEST_PORTFOLIO_TITLE, game=game)
+        post = self.factory.post(
+            PORTFOLIO_URL,
+            {"ticker": "AAPL", "shares": 1, "orderType": "limit", "triggerPrice": 100},
+            content_type="application/json",
+        )
+        # WHEN / THEN
+        self.assertEqual(handle_orders(post, TEST_GAME_TITLE, TEST_PORTFOLIO_TITLE).status_code, 200)
+        response = handle_orders(self.factory.get(PORTFOLIO_URL), TEST_GAME_TITLE, TEST_PORTFOLIO_TITLE)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(handle_order(self.factory.delete("/order/"), "missing").status_code, 500)
+
+    def test_queue_trade(self):
+        """
+        Test that queueing a trade answers 202 with its uid, 200 when retried with the same Idempotency-Key
+        header, and that its status can be fetched
+        """
+        # GIVEN
+        _create_game_helper(TEST_GAME_TITLE, TEST_RULES, TEST_STARTING_BALANCE)
+        game = find_game_by_title(TEST_GAME_TITLE)
+        Portfolio.objects.create(title=TEST_PORTFOLIO_TITLE, game=game)
+        body = {
+            "portfolioTitle": TEST_PORTFOLIO_TITLE,
+            "gameTitle": TEST_GAME_TITLE,
+            "securityType": "stock",
+            "ticker": "AAPL",
+            "shares": 1,
+        }
+
+        def post():
+            return self.factory.post(
+                TRADE_URL + "/queue", body, content_type="application/json", HTTP_IDEMPOTENCY_KEY="key-1"
+            )
+        # WHEN
+        first = queue_trade(post())
+        retried = queue_trade(post())
+        # THEN
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(retried.status_code, 200)
+        self.assertEqual(retried.data["uid"], first.data["uid"])
+        response = handle_queued_trade(self.factory.get(TRADE_URL + "/queue/"), first.data["uid"])
+        self.assertEqual(response.data["status"], "PENDING")
+        self.assertEqual(handle_queued_trade(self.factory.get(TRADE_URL + "/queue/"), "missing").status_code, 500)
+
+    def test_handle_portfolio_history(self):
+        """
+        Test that a portfolio's value history can be fetched
+        """
+        # GIVEN
+        _create_game_helper(TEST_GAME_TITLE, TEST_RULES, TEST_STARTING_BALANCE)
+        game = find_game_by_title(TEST_GAME_TITLE)
+        Portfolio.objects.create(title=TEST_PORTFOLIO_TITLE, game=game)
+        request = self.factory.get(PORTFOLIO_URL, {"points": 10})
+        # WHEN / THEN
+        self.assertEqual(handle_portfolio_history(request, TEST_GAME_TITLE, TEST_PORTFOLIO_TITLE).status_code, 200)
+        self.assertEqual(handle_portfolio_history(request, TEST_GAME_TITLE, "missing").status_code, 500)
+
     def test_handle_game_get(self):
         """
         Test that we can get a game successfully
@@ -950,3 +1229,68 @@ class ViewTestCase(TestCase):
         _trade_stock_helper(portfolio_title, game_title, ticker, shares)
         # WHEN / THEN
         self.assertEqual(handle_transaction(request, "c971b071-7d59-4d96-be9b-710a463xxxxx").status_code, 500)
+
+
+class StreamTestCase(TestCase):
+
+    def _stream(self, path, publish=None):
+        """
+        Run a streaming request until the first standings event (or the end of the response)
+        and return the response messages sent
+        """
+        async def django_application(scope, receive, send):
+            raise AssertionError("Stream requests must not reach Django")
+
+        async def run():
+            sent = []
+            got_event = asyncio.Event()
+            disconnect = asyncio.Event()
+
+            async def receive():
+                await disconnect.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                sent.append(message)
+                if b"event: ready" in message.get("body", b"") and publish:
+                    publish()
+                if b"event: standings" in message.get("body", b""):
+                    got_event.set()
+
+            application = with_streams(django_application)
+            task = asyncio.ensure_future(
+                application({"type": "http", "method": "GET", "path": path}, receive, send)
+            )
+            if publish:
+                await asyncio.wait_for(got_event.wait(), timeout=5)
+            disconnect.set()
+            await asyncio.wait_for(task, timeout=5)
+            return sent
+
+        return async_to_sync(run)()
+
+    def test_stream_pushes_standings(self):
+        """
+        Test that a client streaming a game receives the standings changes published for it
+        """
+        # GIVEN
+        _create_game_helper(TEST_GAME_TITLE, TEST_RULES, TEST_STARTING_BALANCE)
+        # WHEN
+        sent = self._stream(
+            f"/api/game/{TEST_GAME_TITLE}/stream",
+            publish=lambda: get_broker().publish(TEST_GAME_TITLE, '{"changes": []}'),
+        )
+        # THEN
+        self.assertEqual(sent[0]["status"], 200)
+        self.assertIn((b"content-type", b"text/event-stream"), sent[0]["headers"])
+        self.assertEqual(sent[-1]["body"], b'event: standings\ndata: {"changes": []}\n\n')
+        self.assertFalse(get_broker().has_subscribers(TEST_GAME_TITLE))
+
+    def test_stream_unknown_game(self):
+        """
+        Test that streaming a game that does not exist is refused
+        """
+        # WHEN
+        sent = self._stream("/api/game/missing/stream")
+        # THEN
+        self.assertEqual(sent[0]["status"], 404)
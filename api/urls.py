@@ -5,11 +5,18 @@ from . import views
 urlpatterns = [
     path("", views.get_routes),
     path("games/", views.handle_games),
+    path("games/page", views.handle_game_list),
     path("users/", views.handle_users),
     path("game/<str:game_title>", views.handle_game),
+    path("game/<str:game_title>/leaderboard", views.handle_leaderboard),
     path("portfolios", views.handle_portfolios),
     path("portfolio/<str:game_title>/<str:port_title>/", views.handle_portfolio),
+    path("portfolio/<str:game_title>/<str:port_title>/history", views.handle_portfolio_history),
+    path("portfolio/<str:game_title>/<str:port_title>/orders", views.handle_orders),
     path("portfolio/trade", views.trade),
+    path("portfolio/trade/batch", views.trade_batch),
+    path("portfolio/trade/queue", views.queue_trade),
+    path("portfolio/trade/queue/<str:pk>", views.handle_queued_trade),
     path("holdings/", views.handle_holdings),
     path(
         "holding/<str:port_title>/<str:game_title>/<str:ticker>", views.handle_holding
@@ -20,4 +27,5 @@ urlpatterns = [
     ),
     path("transactions/", views.handle_transactions),
     path("transaction/<str:pk>", views.handle_transaction),
+    path("order/<str:pk>", views.handle_order),
 ]
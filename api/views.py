@@ -8,14 +8,23 @@ from trade_simulation.models import Game, Portfolio, Holding, Option, Transactio
 from .helpers import (
     _get_game_standings_helper,
     _get_game_helper,
+    _get_game_list_helper,
+    _get_leaderboard_helper,
     _create_game_helper,
     _delete_game_helper,
     _get_portfolios_helper,
     _get_portfolio_helper,
+    _get_portfolio_history_helper,
     _post_portfolio_helper,
     _delete_portfolio_helper,
     _trade_stock_helper,
     _trade_option_helper,
+    _trade_batch_helper,
+    _place_order_helper,
+    _get_orders_helper,
+    _cancel_order_helper,
+    _queue_trade_helper,
+    _get_queued_trade_helper,
     _get_holding_helper,
     _get_option_helper,
 )
@@ -28,6 +37,13 @@ GAME_URL = "/api/game/game_title"
 PORTFOLIO_URL = "/api/portfolio/game_title/port_title"
 
 
+def _wants_refresh(request):
+    """
+    Whether a GET asks for standings to be revalued now instead of served as stored
+    """
+    return request.query_params.get("refresh", "").lower() in ("1", "true")
+
+
 @api_view(["GET"])
 def get_routes(request):
     """
@@ -35,7 +51,10 @@ def get_routes(request):
     """
     routes = [
         {"GET": "/api/games"},
+        {"GET": "/api/games/page?limit=&cursor="},
         {"GET": GAME_URL},
+        {"GET": GAME_URL + "/leaderboard?limit=&cursor="},
+        {"GET": GAME_URL + "/stream"},
         {"POST": GAME_URL},
         {"DELETE": GAME_URL},
         {"GET": "/api/users"},
@@ -44,7 +63,14 @@ def get_routes(request):
         {"GET": PORTFOLIO_URL},
         {"POST": PORTFOLIO_URL},
         {"DELETE": PORTFOLIO_URL},
+        {"GET": PORTFOLIO_URL + "/history?start=&end=&points="},
         {"POST": "/api/portfolio/trade"},
+        {"POST": "/api/portfolio/trade/batch"},
+        {"POST": "/api/portfolio/trade/queue"},
+        {"GET": "/api/portfolio/trade/queue/uid"},
+        {"GET": PORTFOLIO_URL + "/orders"},
+        {"POST": PORTFOLIO_URL + "/orders"},
+        {"DELETE": "/api/order/uid"},
         {"GET": "/api/holdings"},
         {"GET": "/api/holding/port_title/game_title/ticker"},
         {"GET": "/api/options"},
@@ -75,13 +101,45 @@ def handle_users(request):
 @api_view(["GET"])
 def handle_games(request):
     """
-    Function that handles getting all created games
+    Function that handles getting all created games, with standings as of each game's ranked_on;
+    ?refresh=true revalues every game first
     """
-    games = _get_game_standings_helper()
+    games = _get_game_standings_helper(refresh=_wants_refresh(request))
     resp = Response(games)
     return resp
 
 
+@api_view(["GET"])
+def handle_game_list(request):
+    """
+    Function that handles getting one page of games without their portfolios
+    """
+    try:
+        data = _get_game_list_helper(
+            cursor=request.query_params.get("cursor"), limit=request.query_params.get("limit")
+        )
+        return Response(data)
+    except Exception as e:
+        return Response(status=500, data=str(e))
+
+
+@api_view(["GET"])
+def handle_leaderboard(request, game_title):
+    """
+    Function that handles getting one page of a game's portfolios ordered by rank
+    """
+    try:
+        data = _get_leaderboard_helper(
+            game_title,
+            cursor=request.query_params.get("cursor"),
+            limit=request.query_params.get("limit"),
+            refresh=_wants_refresh(request),
+        )
+        return Response(data)
+    except Exception as e:
+        return Response(status=500, data=str(e))
+
+
 @api_view(["GET", "POST", "DELETE"])
 def handle_game(request, game_title):
     """
@@ -90,7 +148,7 @@ def handle_game(request, game_title):
     # On a GET request show the requested game or throw an error
     if request.method == GET_METHOD:
         try:
-            data = _get_game_helper(game_title)
+            data = _get_game_helper(game_title, refresh=_wants_refresh(request))
             return Response(data)
         except Exception as e:
             return Response(status=500, data=str(e))
@@ -161,6 +219,24 @@ def handle_portfolio(request, game_title, port_title):
             return Response(status=500, data=str(e))
 
 
+@api_view(["GET"])
+def handle_portfolio_history(request, game_title, port_title):
+    """
+    Function that handles getting the value history of one portfolio for charting
+    """
+    try:
+        data = _get_portfolio_history_helper(
+            port_title,
+            game_title,
+            start=request.query_params.get("start"),
+            end=request.query_params.get("end"),
+            points=request.query_params.get("points"),
+        )
+        return Response(data)
+    except Exception as e:
+        return Response(status=500, data=str(e))
+
+
 @api_view(["POST"])
 def trade(request):
     """
@@ -201,6 +277,93 @@ def trade(request):
         return Response(status=500, data=str(error))
 
 
+@api_view(["POST"])
+def trade_batch(request):
+    """
+    Function that handles buying or selling several stocks and options at once. The body lists
+    "orders" in the format of single trades and a "mode": "all" (default) executes all orders or
+    none, "best_effort" executes every order that can be.
+    """
+    try:
+        data = _trade_batch_helper(
+            request.data.get("portfolioTitle"),
+            request.data.get("gameTitle"),
+            request.data.get("orders"),
+            mode=request.data.get("mode"),
+        )
+        return Response(data)
+    except Exception as e:
+        return Response(status=500, data=str(e))
+
+
+@api_view(["POST"])
+def queue_trade(request):
+    """
+    Function that handles queueing a stock or option trade, in the format of a single trade, for the
+    trade workers. It answers at once with the queued trade, whose uid gives its status later. An
+    "Idempotency-Key" header (or "idempotencyKey" field) makes retries return the same trade.
+    """
+    idempotency_key = request.headers.get("Idempotency-Key") or request.data.get("idempotencyKey")
+    try:
+        data, created = _queue_trade_helper(
+            request.data.get("portfolioTitle"),
+            request.data.get("gameTitle"),
+            request.data,
+            idempotency_key=idempotency_key,
+        )
+        return Response(data, status=202 if created else 200)
+    except Exception as e:
+        return Response(status=500, data=str(e))
+
+
+@api_view(["GET"])
+def handle_queued_trade(request, pk):
+    """
+    Function that handles getting the status, and once finished the outcome, of a queued trade.
+    """
+    try:
+        return Response(_get_queued_trade_helper(pk))
+    except Exception as e:
+        return Response(status=500, data=str(e))
+
+
+@api_view(["GET", "POST"])
+def handle_orders(request, game_title, port_title):
+    """
+    Function that handles listing the open limit and stop orders of a portfolio, or placing one.
+    A positive number of shares buys, a negative one sells.
+    """
+    if request.method == GET_METHOD:
+        try:
+            return Response(_get_orders_helper(port_title, game_title))
+        except Exception as e:
+            return Response(status=500, data=str(e))
+    try:
+        data = _place_order_helper(
+            port_title,
+            game_title,
+            request.data.get("ticker"),
+            request.data.get("shares"),
+            request.data.get("orderType"),
+            request.data.get("triggerPrice"),
+        )
+        return Response(data)
+    except Exception as e:
+        return Response(status=500, data=str(e))
+
+
+@api_view(["DELETE"])
+def handle_order(request, pk):
+    """
+    Function that handles cancelling one open limit or stop order.
+    """
+    try:
+        _cancel_order_helper(pk)
+        return Response()
+    except Exception as e:
+        return Response(status=500, data=str(e))
+
+
 @api_view(["GET"])
 def handle_holdings(request):
     """
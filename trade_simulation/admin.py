@@ -1,10 +1,18 @@
 from django.contrib import admin
 
 # Register your models here.
-from .models import Holding, Option, Portfolio, Transaction, Game
+from .models import (
+    Holding, Option, Portfolio, Transaction, Game, QuoteSnapshot, ValueRoster, ValueSnapshot, RestingOrder,
+    QueuedTrade,
+)
 
 admin.site.register(Portfolio)
 admin.site.register(Holding)
 admin.site.register(Option)
 admin.site.register(Transaction)
 admin.site.register(Game)
+admin.site.register(QuoteSnapshot)
+admin.site.register(ValueRoster)
+admin.site.register(ValueSnapshot)
+admin.site.register(RestingOrder)
+admin.site.register(QueuedTrade)
@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class TradeSimulationConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "trade_simulation"
+
+    def ready(self):
+        from .leaderboard import connect_signals
+        from . import checks  # noqa: F401
+        connect_signals()
+        # Single-process deployments can keep prices warm without a separate refresh_quotes worker
+        if getattr(settings, "QUOTE_REFRESHER_IN_PROCESS", False):
+            from .refresher import QuoteRefresher
+            QuoteRefresher().start()
@@ -0,0 +1,131 @@
+import json
+from abc import ABC, abstractmethod
+from threading import Lock
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+DEFAULT_LEADERBOARD_BROKER = "trade_simulation.broker.LocalBroker"
+
+
+class LeaderboardBroker(ABC):
+    """
+    LeaderboardBroker fans out standings changes of a game to everyone watching it. A change is
+    computed and encoded once, however many subscribers receive it.
+    """
+
+    @abstractmethod
+    def subscribe(self, key, callback):
+        """
+        subscribe calls callback(message) for every message later published under key.
+        callback runs on the publishing thread and must not block.
+        Returns: function that cancels the subscription
+        """
+
+    @abstractmethod
+    def publish(self, key, message):
+        """
+        publish delivers message (a JSON string) to every subscriber of key
+        Returns: N/A
+        """
+
+    def has_subscribers(self, key):
+        """
+        has_subscribers tells whether anyone may be watching key, so that publishers can skip
+        computing changes nobody will receive. Brokers spanning several nodes cannot know.
+        Returns: bool
+        """
+        return True
+
+
+class LocalBroker(LeaderboardBroker):
+    """
+    LocalBroker delivers messages to subscribers in the same process, for single-node
+    deployments and tests
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = Lock()
+
+    def subscribe(self, key, callback):
+        with self._lock:
+            self._subscribers.setdefault(key, set()).add(callback)
+
+        def unsubscribe():
+            with self._lock:
+                callbacks = self._subscribers.get(key)
+                if callbacks is not None:
+                    callbacks.discard(callback)
+                    if not callbacks:
+                        del self._subscribers[key]
+        return unsubscribe
+
+    def publish(self, key, message):
+        with self._lock:
+            callbacks = list(self._subscribers.get(key, ()))
+        for callback in callbacks:
+            try:
+                callback(message)
+            except Exception as e:
+                # One broken subscriber must not keep the others from being notified
+                print(f"Error occurs when notifying a subscriber of {key}: {e}")
+
+    def has_subscribers(self, key):
+        with self._lock:
+            return bool(self._subscribers.get(key))
+
+
+_broker = None
+_broker_lock = Lock()
+
+
+def get_broker():
+    """
+    get_broker builds the broker selected by the LEADERBOARD_BROKER setting
+    Returns: LeaderboardBroker shared by the whole process
+    """
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(getattr(settings, "LEADERBOARD_BROKER", DEFAULT_LEADERBOARD_BROKER))()
+        return _broker
+
+
+@receiver(setting_changed)
+def _reset_broker(setting, **kwargs):
+    """
+    Rebuild the broker on next use when its setting is overridden (e.g. in tests)
+    """
+    global _broker
+    if setting == "LEADERBOARD_BROKER":
+        with _broker_lock:
+            _broker = None
+
+
+def publish_standings(game, portfolios):
+    """
+    publish_standings tells everyone watching game the new rank and value of the given portfolios
+    Returns: N/A
+    """
+    broker = get_broker()
+    if not portfolios or not broker.has_subscribers(game.title):
+        return
+    message = json.dumps(
+        {
+            "game": game.title,
+            "ranked_on": game.ranked_on.isoformat() if game.ranked_on else None,
+            "changes": [
+                {
+                    "uid": p.uid,
+                    "title": p.title,
+                    "game_rank": p.game_rank,
+                    "total_value": float(p.total_value),
+                }
+                for p in portfolios
+            ],
+        },
+        default=str,
+    )
+    broker.publish(game.title, message)
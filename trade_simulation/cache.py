@@ -0,0 +1,202 @@
+from collections import OrderedDict
+from threading import Event, Lock
+import time
+
+
+class _Call:
+    """
+    _Call is one in-flight fetch that other threads can wait on
+    """
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    SingleFlight coalesces concurrent fetches of the same key: the first caller runs the fetch
+    and every caller arriving while it is in flight waits for and shares its result
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = Lock()
+
+    def in_flight(self):
+        """
+        in_flight counts the keys currently being fetched
+        Returns: int
+        """
+        return len(self._calls)
+
+    def do(self, key, fetch):
+        """
+        do runs fetch() for key unless a fetch of key is already in flight
+        Returns: result of the shared fetch, or the exception it raised
+        """
+        return self.do_many([key], lambda keys: {key: fetch()})[key]
+
+    def do_many(self, keys, fetch):
+        """
+        do_many runs fetch(owned) once for the keys nobody else is fetching, and waits on the
+        in-flight fetches of the remaining keys. fetch must return a dict keyed by key.
+        Returns: dict mapping key to result (None if fetch left it out), or the exception
+        raised by any fetch this call depends on
+        """
+        owned = []
+        waiting = {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                call = self._calls.get(key)
+                if call is None:
+                    self._calls[key] = _Call()
+                    owned.append(key)
+                else:
+                    waiting[key] = call
+        results = {}
+        if owned:
+            fetched, error = {}, None
+            try:
+                fetched = fetch(owned)
+            except BaseException as e:
+                # Waiters must always be released, whatever the fetch raised
+                error = e
+            with self._lock:
+                for key in owned:
+                    call = self._calls.pop(key)
+                    call.result = fetched.get(key)
+                    call.error = error
+                    call.done.set()
+            if error is not None:
+                raise error
+            results.update((key, fetched.get(key)) for key in owned)
+        for key, call in waiting.items():
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            results[key] = call.result
+        return results
+
+
+class TTLCache:
+    """
+    TTLCache is a thread-safe, size-bounded cache whose entries are fresh for ttl seconds.
+    Expired entries are kept for up to stale_ttl more seconds so callers that accept
+    stale data can still read them. Once full, the least recently used entry is evicted.
+    """
+
+    def __init__(self, ttl, maxsize, stale_ttl=0):
+        self.ttl = float(ttl)
+        self.stale_ttl = float(stale_ttl)
+        self.maxsize = int(maxsize)
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+        # Coalesces concurrent fills of the same missing key
+        self.flight = SingleFlight()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def _lookup(self, key, max_stale, count):
+        # Must be called with the lock held
+        entry = self._data.get(key)
+        if entry is None:
+            if count:
+                self.misses += 1
+            return None, False
+        age = time.monotonic() - entry[1]
+        if age >= self.ttl + self.stale_ttl:
+            del self._data[key]
+            if count:
+                self.misses += 1
+            return None, False
+        fresh = age < self.ttl
+        if not fresh and age >= self.ttl + max_stale:
+            if count:
+                self.misses += 1
+            return None, False
+        self._data.move_to_end(key)
+        if count:
+            if fresh:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+        return entry[0], fresh
+
+    def get(self, key, count=True):
+        """
+        get looks up a fresh value for key in the cache and marks it as recently used
+        Returns: cached value, or None if key is missing or has expired
+        """
+        with self._lock:
+            return self._lookup(key, 0, count)[0]
+
+    def get_stale(self, key, max_stale, count=True):
+        """
+        get_stale looks up key, accepting a value that expired at most max_stale seconds ago
+        (bounded by stale_ttl)
+        Returns: tuple of (cached value or None, whether the value is fresh)
+        """
+        with self._lock:
+            return self._lookup(key, min(float(max_stale), self.stale_ttl), count)
+
+    def set(self, key, value, age=0):
+        """
+        set stores value under key as fetched age seconds ago, evicting least recently used
+        entries if the cache is full
+        Returns: N/A
+        """
+        with self._lock:
+            self._data[key] = (value, time.monotonic() - age)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_fetch(self, key, fetch):
+        """
+        get_or_fetch returns the cached value for key, calling fetch() to fill the cache on a miss.
+        Concurrent misses on the same key share a single fetch() call.
+        Returns: cached or freshly fetched value
+        """
+        value = self.get(key)
+        if value is None:
+            value = self.flight.do(key, lambda: self._fill(key, fetch))
+        return value
+
+    def _fill(self, key, fetch):
+        value = fetch()
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        """
+        clear drops every entry and resets the hit/miss counters
+        Returns: N/A
+        """
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.stale_hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        stats reports the current usage of the cache
+        Returns: dict with hits, stale hits, misses, size and maxsize
+        """
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
@@ -0,0 +1,101 @@
+import numpy as np
+
+CONTRACT_SYMBOL = "contractSymbol"
+
+
+class ChainSide:
+    """
+    ChainSide holds one side (calls or puts) of a downloaded option chain as columnar
+    NumPy arrays, with an index from contract symbol to row for O(1) lookups
+    """
+
+    def __init__(self, frame):
+        symbols = frame[CONTRACT_SYMBOL].tolist() if CONTRACT_SYMBOL in frame else []
+        self.index = {symbol: row for row, symbol in enumerate(symbols)}
+        # Only numeric columns are kept, which is all that pricing needs
+        numeric = frame.select_dtypes(include="number")
+        self.columns = {
+            name: numeric[name].to_numpy(dtype=np.float64) for name in numeric.columns
+        }
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, contract):
+        return contract in self.index
+
+    def get(self, contract):
+        """
+        get reads one contract's row out of the chain
+        Returns: dict of column name to value, or None if contract is not in the chain
+        """
+        row = self.index.get(contract)
+        if row is None:
+            return None
+        return {name: values[row].item() for name, values in self.columns.items()}
+
+    def bid_prices(self, contracts):
+        """
+        bid_prices reads the bid of many contracts at once, falling back to the last price where
+        the bid is 0 (outside market hours), like Option.bid_price
+        Returns: NumPy array of per-share prices, 0 for contracts not in the chain
+        """
+        rows = np.array([self.index.get(contract, -1) for contract in contracts], dtype=np.intp)
+        prices = np.zeros(len(rows), dtype=np.float64)
+        found = rows >= 0
+        if not found.any() or "bid" not in self.columns:
+            return prices
+        bid = self.columns["bid"][rows[found]]
+        last = self.columns.get("lastPrice", np.zeros(len(self.index)))[rows[found]]
+        prices[found] = np.where(bid == 0, last, bid)
+        return np.nan_to_num(prices)
+
+
+class OptionChain:
+    """
+    OptionChain is the compact, indexed form of an option chain for one underlying
+    and expiration date, built once per download
+    """
+
+    def __init__(self, calls, puts):
+        self.calls = ChainSide(calls)
+        self.puts = ChainSide(puts)
+
+    @classmethod
+    def from_yfinance(cls, chain):
+        """
+        from_yfinance builds an OptionChain from the result of yfinance's Ticker.option_chain
+        Returns: OptionChain
+        """
+        return cls(chain.calls, chain.puts)
+
+    def side(self, option_type):
+        """
+        side picks the calls or puts of the chain by option type
+        Returns: ChainSide, or None if option_type is not 'C' or 'P'
+        """
+        if option_type == 'C':
+            return self.calls
+        if option_type == 'P':
+            return self.puts
+        return None
+
+    def get(self, contract, option_type):
+        """
+        get looks up a contract on the calls or puts side of the chain
+        Returns: dict with info on option contract or None if not found
+        """
+        side = self.side(option_type)
+        if side is None:
+            return None
+        return side.get(contract)
+
+    def bid_prices(self, contracts, option_type):
+        """
+        bid_prices reads the bid of many contracts of one type on the chain at once
+        Returns: NumPy array of per-share prices, 0 for contracts not found
+        """
+        side = self.side(option_type)
+        if side is None:
+            return np.zeros(len(contracts), dtype=np.float64)
+        return side.bid_prices(contracts)
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+from .broker import DEFAULT_LEADERBOARD_BROKER
+
+LOCAL_BROKER = "trade_simulation.broker.LocalBroker"
+
+
+@register(deploy=True)
+def check_stream_broker(app_configs, **kwargs):
+    """
+    check_stream_broker warns when standings streams cannot receive price refreshes: LocalBroker only
+    reaches clients of the process that publishes, so the refresher must run in the web process
+    Returns: list of warnings
+    """
+    broker = getattr(settings, "LEADERBOARD_BROKER", DEFAULT_LEADERBOARD_BROKER)
+    if broker == LOCAL_BROKER and not getattr(settings, "QUOTE_REFRESHER_IN_PROCESS", False):
+        return [
+            Warning(
+                "Standings streams will not receive price refreshes: LocalBroker only reaches clients "
+                "of the process that ranks games, and the quote refresher runs in another process.",
+                hint="Set QUOTE_REFRESHER_IN_PROCESS in the web process serving zappa.asgi, or use a "
+                "broker spanning processes.",
+                id="trade_simulation.W001",
+            )
+        ]
+    return []
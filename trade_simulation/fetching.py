@@ -0,0 +1,180 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from threading import Lock
+import time
+from django.conf import settings
+
+DEFAULT_QUOTE_FETCH_MAX_WORKERS = 16
+DEFAULT_QUOTE_FETCH_CONCURRENCY = 8
+DEFAULT_QUOTE_FETCH_TIMEOUT = 10
+
+_executor = None
+_executor_lock = Lock()
+
+
+class FetchError(Exception):
+    """
+    FetchError is raised when some keys of a concurrent fetch failed or timed out.
+    It carries the results of the keys that did succeed.
+    """
+
+    def __init__(self, errors, results):
+        self.errors = errors
+        self.results = results
+        super().__init__(
+            f"Could not fetch {', '.join(str(key) for key in errors)}: "
+            f"{next(iter(errors.values()))}"
+        )
+
+
+def get_executor():
+    """
+    get_executor returns the thread pool shared by all market data fetches of the process,
+    sized by QUOTE_FETCH_MAX_WORKERS
+    Returns: ThreadPoolExecutor
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "QUOTE_FETCH_MAX_WORKERS", DEFAULT_QUOTE_FETCH_MAX_WORKERS),
+                thread_name_prefix="quote-fetch",
+            )
+        return _executor
+
+
+def fetch_concurrently(fetch, keys, concurrency=None, timeout=None):
+    """
+    fetch_concurrently calls fetch(key) for every key on the shared thread pool, keeping at most
+    concurrency calls of this request in flight, and gathers the results. Calls still running
+    after timeout seconds are reported as failed. fetch must not touch the database.
+    Returns: dict mapping key to result, or FetchError if any key failed
+    """
+    if concurrency is None:
+        concurrency = getattr(settings, "QUOTE_FETCH_CONCURRENCY", DEFAULT_QUOTE_FETCH_CONCURRENCY)
+    if timeout is None:
+        timeout = getattr(settings, "QUOTE_FETCH_TIMEOUT", DEFAULT_QUOTE_FETCH_TIMEOUT)
+    deadline = time.monotonic() + timeout
+    executor = get_executor()
+    pending = list(keys)
+    running = {}
+    results = {}
+    errors = {}
+    while pending or running:
+        while pending and len(running) < max(1, concurrency):
+            key = pending.pop(0)
+            running[executor.submit(fetch, key)] = key
+        remaining = deadline - time.monotonic()
+        done, _ = wait(running, timeout=max(0.0, remaining), return_when=FIRST_COMPLETED)
+        if not done:
+            # Deadline reached: give up on everything not finished yet
+            for key in list(running.values()) + pending:
+                errors[key] = TimeoutError(f"Timed out after {timeout} seconds.")
+            break
+        for future in done:
+            key = running.pop(future)
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                errors[key] = e
+    if errors:
+        raise FetchError(errors, results)
+    return results
+
+
+class CircuitOpenError(Exception):
+    """
+    CircuitOpenError is raised instead of calling a provider that has been failing
+    """
+
+
+class CircuitBreaker:
+    """
+    CircuitBreaker stops calls to a failing provider. After failure_threshold consecutive
+    failures the circuit opens and calls fail immediately for reset_timeout seconds; then a
+    single trial call is let through, which closes the circuit again if it succeeds.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = int(failure_threshold)
+        self.reset_timeout = float(reset_timeout)
+        self.failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        # Must be called with the lock held
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        """
+        allow reserves a call through the breaker
+        Returns: N/A or CircuitOpenError if the provider must not be called now
+        """
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return
+        raise CircuitOpenError("Market data provider is unavailable, not calling it.")
+
+    def record_success(self):
+        """
+        record_success closes the circuit after a successful call
+        Returns: N/A
+        """
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def reset(self):
+        """
+        reset closes the circuit and forgets past failures
+        Returns: N/A
+        """
+        self.record_success()
+
+    def record_failure(self):
+        """
+        record_failure counts a failed call, opening the circuit once the threshold is reached
+        Returns: N/A
+        """
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self.failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    def call(self, fetch, ignore=()):
+        """
+        call runs fetch() through the breaker. Exceptions of the types in ignore are
+        treated as answers from a healthy provider rather than failures.
+        Returns: result of fetch() or CircuitOpenError if the circuit is open
+        """
+        self.allow()
+        try:
+            result = fetch()
+        except ignore:
+            self.record_success()
+            raise
+        except BaseException:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
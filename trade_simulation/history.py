@@ -0,0 +1,173 @@
+import hashlib
+import struct
+from datetime import datetime, timedelta, timezone as dt_timezone
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from .models import ValueRoster, ValueSnapshot
+
+# (resolution, retention) tiers, finest first, in seconds: snapshots older than the retention of
+# their tier are rolled up into the next one; the last tier is kept forever when its retention is None
+DEFAULT_VALUE_HISTORY_TIERS = [(300, 2 * 86400), (3600, 60 * 86400), (86400, None)]
+DEFAULT_VALUE_HISTORY_POINTS = 200
+VALUE_HISTORY_MAX_POINTS = 2000
+UID_SIZE = 16
+VALUE_FORMAT = "<d"
+VALUE_SIZE = struct.calcsize(VALUE_FORMAT)
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def history_tiers():
+    """
+    history_tiers reads the resolution and retention tiers of value history
+    Returns: list of (resolution, retention or None) tuples in seconds, finest first
+    """
+    return getattr(settings, "VALUE_HISTORY_TIERS", DEFAULT_VALUE_HISTORY_TIERS)
+
+
+def bucket_start(moment, resolution):
+    """
+    bucket_start finds the start of the resolution-second bucket moment falls in
+    Returns: datetime
+    """
+    seconds = int((moment - EPOCH).total_seconds())
+    return EPOCH + timedelta(seconds=seconds - seconds % resolution)
+
+
+def pack_values(values):
+    """
+    pack_values packs total values into the compact storage format of snapshots
+    Returns: bytes
+    """
+    return np.asarray(values, dtype=VALUE_FORMAT).tobytes()
+
+
+def get_roster(game, uids):
+    """
+    get_roster finds or stores the roster of game listing the portfolio uids in order
+    Returns: ValueRoster
+    """
+    portfolio_ids = b"".join(uid.bytes for uid in uids)
+    digest = hashlib.sha256(game.pk.bytes + portfolio_ids).hexdigest()
+    roster, _ = ValueRoster.objects.get_or_create(
+        digest=digest, defaults={"game": game, "portfolio_ids": portfolio_ids}
+    )
+    return roster
+
+
+def snapshot_values(game, portfolios, taken_on=None):
+    """
+    snapshot_values builds the finest-resolution snapshot of the current total values of portfolios
+    Returns: unsaved ValueSnapshot
+    """
+    resolution = history_tiers()[0][0]
+    portfolios = sorted(portfolios, key=lambda p: p.pk)
+    return ValueSnapshot(
+        game=game,
+        roster=get_roster(game, [p.pk for p in portfolios]),
+        resolution=resolution,
+        taken_on=bucket_start(taken_on or timezone.now(), resolution),
+        total_values=pack_values([float(p.total_value) for p in portfolios]),
+    )
+
+
+def record_snapshots(snapshots):
+    """
+    record_snapshots stores snapshots with one bulk insert. A game already snapshotted in the same
+    bucket keeps its first snapshot.
+    Returns: N/A
+    """
+    ValueSnapshot.objects.bulk_create(snapshots, ignore_conflicts=True)
+
+
+def roll_up_history(now=None):
+    """
+    roll_up_history applies the retention policy: snapshots older than the retention of their tier
+    are replaced by the last snapshot of each bucket of the next coarser tier, and snapshots older
+    than the retention of the last tier are deleted
+    Returns: number of snapshots removed
+    """
+    now = now or timezone.now()
+    tiers = history_tiers()
+    removed = 0
+    for i, (resolution, retention) in enumerate(tiers):
+        if retention is None:
+            continue
+        old = ValueSnapshot.objects.filter(
+            resolution=resolution, taken_on__lt=now - timedelta(seconds=retention)
+        )
+        if i + 1 < len(tiers):
+            coarser = tiers[i + 1][0]
+            # Only buckets that finished before the cutoff, so that a bucket is never rolled up twice
+            old = old.filter(taken_on__lt=bucket_start(now - timedelta(seconds=retention), coarser))
+            record_snapshots(_roll_up(old, coarser))
+        removed += old.delete()[0]
+    return removed
+
+
+def _roll_up(snapshots, resolution):
+    """
+    _roll_up keeps the last of snapshots in each resolution-second bucket of each game
+    """
+    rolled = {}
+    for snapshot in snapshots.order_by("game_id", "taken_on").iterator():
+        key = (snapshot.game_id, bucket_start(snapshot.taken_on, resolution))
+        rolled[key] = ValueSnapshot(
+            game_id=snapshot.game_id,
+            roster_id=snapshot.roster_id,
+            resolution=resolution,
+            taken_on=key[1],
+            total_values=snapshot.total_values,
+        )
+    return list(rolled.values())
+
+
+def _roster_positions(roster_ids, uid):
+    """
+    _roster_positions finds where uid is stored in each roster
+    """
+    positions = {}
+    for pk, portfolio_ids in ValueRoster.objects.filter(pk__in=roster_ids).values_list("pk", "portfolio_ids"):
+        portfolio_ids = bytes(portfolio_ids)
+        offset = portfolio_ids.find(uid.bytes)
+        # A match must be aligned on a uid, not span two of them
+        while offset != -1 and offset % UID_SIZE:
+            offset = portfolio_ids.find(uid.bytes, offset + 1)
+        if offset != -1:
+            positions[pk] = offset // UID_SIZE
+    return positions
+
+
+def value_series(portfolio, start=None, end=None, points=None):
+    """
+    value_series reads the value history of portfolio between start and end, downsampled to at most
+    points values by keeping the last snapshot of each of points equal time buckets. Only the chosen
+    snapshots are read in full, so the cost depends on points rather than on the length of history.
+    Returns: list of (time, total value) tuples in time order
+    """
+    points = min(points or DEFAULT_VALUE_HISTORY_POINTS, VALUE_HISTORY_MAX_POINTS)
+    snapshots = ValueSnapshot.objects.filter(game_id=portfolio.game_id)
+    if start is not None:
+        snapshots = snapshots.filter(taken_on__gte=start)
+    if end is not None:
+        snapshots = snapshots.filter(taken_on__lte=end)
+    index = list(snapshots.order_by("taken_on", "resolution").values_list("pk", "taken_on"))
+    if not index:
+        return []
+    if len(index) > points:
+        seconds = np.array([(taken_on - EPOCH).total_seconds() for _, taken_on in index])
+        span = max(seconds[-1] - seconds[0], 1.0)
+        buckets = np.minimum(((seconds - seconds[0]) / span * points).astype(np.intp), points - 1)
+        # The last snapshot of each bucket is the one followed by a different bucket
+        last = np.flatnonzero(np.append(buckets[1:] != buckets[:-1], True))
+        index = [index[i] for i in last]
+    rows = ValueSnapshot.objects.filter(pk__in=[pk for pk, _ in index]).order_by("taken_on", "resolution")
+    rows = list(rows.values_list("taken_on", "roster_id", "total_values"))
+    positions = _roster_positions({roster_id for _, roster_id, _ in rows}, portfolio.pk)
+    series = []
+    for taken_on, roster_id, total_values in rows:
+        position = positions.get(roster_id)
+        if position is not None:
+            (value,) = struct.unpack_from(VALUE_FORMAT, total_values, position * VALUE_SIZE)
+            series.append((taken_on, value))
+    return series
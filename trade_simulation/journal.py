@@ -0,0 +1,130 @@
+import time
+from contextlib import contextmanager
+from threading import local
+from django.conf import settings
+from django.db import transaction
+
+# Records written per INSERT statement, and buffered before a batch writes them early
+DEFAULT_JOURNAL_BATCH_SIZE = 500
+# Seconds a batch stays open before it asks to be committed
+DEFAULT_JOURNAL_MAX_DELAY = 0.2
+
+
+class JournalBatch:
+    """
+    JournalBatch holds the records appended during one database transaction; the first written of
+    them are in the database, the others are still buffered
+    """
+
+    def __init__(self, size, max_delay):
+        self.size = size
+        self.max_delay = max_delay
+        self.records = []
+        self.written = 0
+        self.opened = time.monotonic()
+
+    def due(self):
+        """
+        Whether the batch reached its size or age threshold and should be committed
+        """
+        return len(self.records) >= self.size or time.monotonic() - self.opened >= self.max_delay
+
+
+class Journal:
+    """
+    Journal is the append-only writer of trade records such as transactions. Outside a batch, records
+    are written right away with one bulk insert. Inside batch(), they are buffered and written with bulk
+    inserts when the buffer is full and just before the batch commits, so they are durable exactly when
+    the trades that produced them are: both commit, or roll back, together.
+    """
+
+    def __init__(self):
+        self._local = local()
+
+    def _batch(self):
+        return getattr(self._local, "batch", None)
+
+    def _write(self, records, batch_size):
+        # One bulk insert per model, in the order the records were appended
+        by_model = {}
+        for record in records:
+            by_model.setdefault(type(record), []).append(record)
+        for model, rows in by_model.items():
+            model.objects.bulk_create(rows, batch_size=batch_size)
+
+    def record(self, records):
+        """
+        record appends records to the journal
+        Returns: N/A
+        """
+        records = list(records)
+        if not records:
+            return
+        batch = self._batch()
+        if batch is None:
+            self._write(records, getattr(settings, "JOURNAL_BATCH_SIZE", DEFAULT_JOURNAL_BATCH_SIZE))
+            return
+        batch.records += records
+        if len(batch.records) - batch.written >= batch.size:
+            self.flush()
+
+    def flush(self):
+        """
+        flush writes the records buffered by the current batch, within its database transaction
+        Returns: number of records written
+        """
+        batch = self._batch()
+        if batch is None or batch.written == len(batch.records):
+            return 0
+        records = batch.records[batch.written:]
+        self._write(records, batch.size)
+        batch.written = len(batch.records)
+        return len(records)
+
+    @contextmanager
+    def atomic(self):
+        """
+        atomic runs a block in a database transaction, or a savepoint within one, and forgets the records
+        buffered by the block when it fails, as the database forgets its rows
+        Returns: context manager
+        """
+        batch = self._batch()
+        if batch is not None:
+            start, written = len(batch.records), batch.written
+        try:
+            with transaction.atomic():
+                yield
+        except BaseException:
+            if batch is not None:
+                # Rows written within the block are rolled back with its savepoint, including those of
+                # earlier records flushed with them, which are buffered again
+                del batch.records[start:]
+                batch.written = written
+            raise
+
+    @contextmanager
+    def batch(self):
+        """
+        batch opens a database transaction whose records are buffered and written just before it commits.
+        A batch opened within another one joins it.
+        Returns: context manager yielding the JournalBatch
+        """
+        batch = self._batch()
+        if batch is not None:
+            yield batch
+            return
+        batch = JournalBatch(
+            getattr(settings, "JOURNAL_BATCH_SIZE", DEFAULT_JOURNAL_BATCH_SIZE),
+            getattr(settings, "JOURNAL_MAX_DELAY", DEFAULT_JOURNAL_MAX_DELAY),
+        )
+        self._local.batch = batch
+        try:
+            with transaction.atomic():
+                yield batch
+                self.flush()
+        finally:
+            self._local.batch = None
+
+
+# Journal shared by every thread of this process; each thread has its own batch
+journal = Journal()
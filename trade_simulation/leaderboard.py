@@ -0,0 +1,337 @@
+import random
+from threading import Lock
+from django.db.models.signals import post_delete, post_save
+
+# Enough levels for O(log n) operations on games of up to about 2**MAX_LEVEL portfolios
+MAX_LEVEL = 32
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        # width[i] is how many positions next[i] skips ahead
+        self.width = [1] * level
+
+
+class IndexableSkipList:
+    """
+    IndexableSkipList keeps unique keys sorted. Every link records how many positions it skips,
+    so inserts, removals, positional lookups and rank (bisect) queries all take O(log n).
+    """
+
+    def __init__(self):
+        self._head = _Node(None, MAX_LEVEL)
+        self._head.width = [0] * MAX_LEVEL
+        self._level = 1
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _random_level(self):
+        level = 1
+        while level < MAX_LEVEL and random.random() < 0.5:
+            level += 1
+        return level
+
+    def bisect_left(self, key):
+        """
+        bisect_left counts the keys smaller than key
+        Returns: int
+        """
+        node, position = self._head, 0
+        for i in reversed(range(self._level)):
+            while node.next[i] is not None and node.next[i].key < key:
+                position += node.width[i]
+                node = node.next[i]
+        return position
+
+    def insert(self, key):
+        """
+        insert adds key in sorted position
+        Returns: N/A
+        """
+        update = [self._head] * MAX_LEVEL
+        positions = [0] * MAX_LEVEL
+        node, position = self._head, 0
+        for i in reversed(range(self._level)):
+            while node.next[i] is not None and node.next[i].key < key:
+                position += node.width[i]
+                node = node.next[i]
+            update[i], positions[i] = node, position
+        level = self._random_level()
+        if level > self._level:
+            for i in range(self._level, level):
+                # Links at new levels start at the head and span the whole list
+                update[i], positions[i] = self._head, 0
+                self._head.width[i] = self._size
+            self._level = level
+        new = _Node(key, level)
+        for i in range(level):
+            new.next[i] = update[i].next[i]
+            update[i].next[i] = new
+            skipped = position - positions[i]
+            new.width[i] = update[i].width[i] - skipped
+            update[i].width[i] = skipped + 1
+        for i in range(level, self._level):
+            update[i].width[i] += 1
+        self._size += 1
+
+    def remove(self, key):
+        """
+        remove deletes key
+        Returns: N/A or KeyError if key is not in the list
+        """
+        update = [self._head] * MAX_LEVEL
+        node = self._head
+        for i in reversed(range(self._level)):
+            while node.next[i] is not None and node.next[i].key < key:
+                node = node.next[i]
+            update[i] = node
+        target = node.next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        for i in range(self._level):
+            if update[i].next[i] is target:
+                update[i].next[i] = target.next[i]
+                update[i].width[i] += target.width[i] - 1
+            else:
+                update[i].width[i] -= 1
+        self._size -= 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+        node, remaining = self._head, index + 1
+        for i in reversed(range(self._level)):
+            while node.next[i] is not None and node.width[i] <= remaining:
+                remaining -= node.width[i]
+                node = node.next[i]
+        return node.key
+
+    def islice(self, start, stop):
+        """
+        islice walks the keys at positions start to stop - 1
+        Returns: generator of keys
+        """
+        stop = min(stop, self._size)
+        if start >= stop:
+            return
+        node, remaining = self._head, start + 1
+        for i in reversed(range(self._level)):
+            while node.next[i] is not None and node.width[i] <= remaining:
+                remaining -= node.width[i]
+                node = node.next[i]
+        for _ in range(stop - start):
+            yield node.key
+            node = node.next[0]
+
+
+class GameLeaderboard:
+    """
+    GameLeaderboard is the in-memory ranking of one game's portfolios by total value. Portfolios
+    with equal values share the rank of the first of them, like the stored game_rank.
+    """
+
+    def __init__(self, values=()):
+        self._entries = IndexableSkipList()
+        self._values = {}
+        self._lock = Lock()
+        for uid, value in values:
+            self._set(uid, value)
+
+    def __len__(self):
+        return len(self._values)
+
+    @staticmethod
+    def _key(uid, value):
+        # Ascending keys put the highest value first; the uid keeps keys unique
+        return (-float(value), str(uid))
+
+    def _set(self, uid, value):
+        old = self._values.get(uid)
+        if old is not None:
+            self._entries.remove(self._key(uid, old))
+        self._values[uid] = float(value)
+        self._entries.insert(self._key(uid, value))
+
+    def update(self, uid, value):
+        """
+        update records the new total value of a portfolio, adding it if it is new
+        Returns: N/A
+        """
+        with self._lock:
+            self._set(uid, value)
+
+    def remove(self, uid):
+        """
+        remove drops a portfolio from the leaderboard
+        Returns: N/A
+        """
+        with self._lock:
+            value = self._values.pop(uid, None)
+            if value is not None:
+                self._entries.remove(self._key(uid, value))
+
+    def value(self, uid):
+        """
+        value reads the total value the leaderboard holds for a portfolio
+        Returns: float or None if the portfolio is not on the leaderboard
+        """
+        return self._values.get(uid)
+
+    def rank(self, uid):
+        """
+        rank finds the rank of a portfolio: 1 + the number of portfolios worth strictly more
+        Returns: int or None if the portfolio is not on the leaderboard
+        """
+        with self._lock:
+            value = self._values.get(uid)
+            if value is None:
+                return None
+            # "" sorts before every uid, so this counts the keys with a strictly higher value
+            return self._entries.bisect_left((-value, "")) + 1
+
+    def range(self, start, stop):
+        """
+        range lists the portfolios at 0-based positions start to stop - 1 of the leaderboard
+        Returns: list of (uid, total value, rank) tuples
+        """
+        with self._lock:
+            entries = []
+            for negative_value, uid in self._entries.islice(start, stop):
+                rank = self._entries.bisect_left((negative_value, "")) + 1
+                entries.append((uid, -negative_value, rank))
+            return entries
+
+    def between(self, low, high):
+        """
+        between lists the portfolios worth from low to high, both included, best first
+        Returns: list of (uid, total value, rank) tuples
+        """
+        with self._lock:
+            entries = []
+            start = self._entries.bisect_left((-float(high), ""))
+            for negative_value, uid in self._entries.islice(start, len(self._entries)):
+                if -negative_value < float(low):
+                    break
+                rank = self._entries.bisect_left((negative_value, "")) + 1
+                entries.append((uid, -negative_value, rank))
+            return entries
+
+    def top(self, k):
+        """
+        top lists the k best portfolios
+        Returns: list of (uid, total value, rank) tuples
+        """
+        return self.range(0, k)
+
+
+class LeaderboardRegistry:
+    """
+    LeaderboardRegistry holds the in-memory leaderboard of every game used by this process.
+    Each is built from the Portfolio table on first use, and rebuilt when another process
+    ranked the game since.
+    """
+
+    def __init__(self):
+        self._boards = {}
+        self._lock = Lock()
+
+    def get(self, game):
+        """
+        get returns the leaderboard of game, building it from stored total values if needed
+        Returns: GameLeaderboard
+        """
+        with self._lock:
+            entry = self._boards.get(game.pk)
+        if entry is not None:
+            board, synced_on = entry
+            if game.ranked_on is None or (synced_on is not None and game.ranked_on <= synced_on):
+                return board
+        return self.rebuild(game)
+
+    def rebuild(self, game):
+        """
+        rebuild reloads the leaderboard of game from the Portfolio table
+        Returns: GameLeaderboard
+        """
+        from .models import Portfolio
+        board = GameLeaderboard(Portfolio.objects.filter(game=game).values_list("uid", "total_value"))
+        with self._lock:
+            self._boards[game.pk] = (board, game.ranked_on)
+        return board
+
+    def loaded(self, game_id):
+        """
+        loaded returns the leaderboard of a game if this process has built it
+        Returns: GameLeaderboard or None
+        """
+        with self._lock:
+            entry = self._boards.get(game_id)
+        return entry[0] if entry is not None else None
+
+    def synced(self, game):
+        """
+        synced records that the leaderboard of game reflects its ranking at game.ranked_on
+        Returns: N/A
+        """
+        with self._lock:
+            entry = self._boards.get(game.pk)
+            if entry is not None:
+                self._boards[game.pk] = (entry[0], game.ranked_on)
+
+    def update(self, portfolio, value=None):
+        """
+        update records value, or else the total value of portfolio, if its game's leaderboard is loaded
+        Returns: N/A
+        """
+        board = self.loaded(portfolio.game_id)
+        if board is not None:
+            board.update(portfolio.pk, portfolio.total_value if value is None else value)
+
+    def remove(self, portfolio):
+        """
+        remove drops portfolio from its game's leaderboard, if loaded
+        Returns: N/A
+        """
+        board = self.loaded(portfolio.game_id)
+        if board is not None:
+            board.remove(portfolio.pk)
+
+    def clear(self):
+        """
+        clear forgets every leaderboard, so they are rebuilt on next use
+        Returns: N/A
+        """
+        with self._lock:
+            self._boards.clear()
+
+
+# Process-wide leaderboards keyed by game
+leaderboards = LeaderboardRegistry()
+
+
+def _portfolio_saved(sender, instance, **kwargs):
+    # Values set through F() expressions are not known here; their writer updates the leaderboard
+    if isinstance(instance.total_value, (int, float)) or hasattr(instance.total_value, "as_tuple"):
+        leaderboards.update(instance)
+
+
+def _portfolio_deleted(sender, instance, **kwargs):
+    leaderboards.remove(instance)
+
+
+def connect_signals():
+    """
+    connect_signals keeps loaded leaderboards in step with portfolios saved or deleted one by one
+    Returns: N/A
+    """
+    from .models import Portfolio
+    post_save.connect(_portfolio_saved, sender=Portfolio, dispatch_uid="leaderboard_portfolio_saved")
+    post_delete.connect(_portfolio_deleted, sender=Portfolio, dispatch_uid="leaderboard_portfolio_deleted")
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from trade_simulation.tradequeue import TradeWorker, run_workers
+
+
+class Command(BaseCommand):
+    """
+    Long-lived pool of workers executing the trades queued through the API
+    """
+
+    help = "Execute queued trades with a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Number of worker processes (defaults to TRADE_QUEUE_WORKERS).",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=None,
+            help="Seconds between polls of an empty queue (defaults to TRADE_QUEUE_POLL_INTERVAL).",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Execute the queued trades in this process and exit.",
+        )
+
+    def handle(self, *args, **options):
+        if options["once"]:
+            processed = TradeWorker(poll_interval=options["interval"]).run_once()
+            self.stdout.write(f"Processed {processed} queued trades.")
+            return
+        self.stdout.write("Processing queued trades.")
+        run_workers(workers=options["workers"], poll_interval=options["interval"])
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from trade_simulation.standings import refresh_standings
+
+
+class Command(BaseCommand):
+    """
+    Batch job that recomputes stored game standings; meant to run from a scheduler
+    """
+
+    help = "Recompute portfolio values and ranks of games whose standings are stale."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-age",
+            type=float,
+            default=None,
+            help="Rank games whose standings are older than this many seconds (defaults to GAME_STANDINGS_MAX_AGE).",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Rank every game regardless of how recent its standings are.",
+        )
+
+    def handle(self, *args, **options):
+        games = refresh_standings(max_age=0 if options["all"] else options["max_age"])
+        self.stdout.write(f"Ranked {games} games.")
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from trade_simulation.broker import LocalBroker, get_broker
+from trade_simulation.refresher import QuoteRefresher
+
+
+class Command(BaseCommand):
+    """
+    Long-lived worker that keeps the prices of every held ticker and option chain warm
+    """
+
+    help = "Periodically refresh prices of all held tickers and option contracts in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=None,
+            help="Seconds between refreshes (defaults to QUOTE_REFRESH_INTERVAL).",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Refresh a single time and exit.",
+        )
+
+    def handle(self, *args, **options):
+        refresher = QuoteRefresher(interval=options["interval"])
+        if options["once"]:
+            tickers, chains = refresher.refresh_once()
+            self.stdout.write(f"Refreshed {tickers} tickers and {chains} option chains.")
+            return
+        if isinstance(get_broker(), LocalBroker):
+            # Standings published here only reach streams served by this process, i.e. none
+            self.stderr.write(
+                "LocalBroker cannot push standings to streams from a separate worker; "
+                "run the refresher in the web process with QUOTE_REFRESHER_IN_PROCESS instead."
+            )
+        self.stdout.write(f"Refreshing quotes every {refresher.interval} seconds.")
+        try:
+            refresher.run()
+        except KeyboardInterrupt:
+            refresher.stop()
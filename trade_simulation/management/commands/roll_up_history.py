@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from trade_simulation.history import roll_up_history
+
+
+class Command(BaseCommand):
+    """
+    Batch job that applies the value history retention policy; meant to run from a scheduler
+    """
+
+    help = "Roll up old portfolio value snapshots into coarser ones and delete expired ones."
+
+    def handle(self, *args, **options):
+        removed = roll_up_history()
+        self.stdout.write(f"Rolled up {removed} value snapshots.")
@@ -0,0 +1,27 @@
+from datetime import date
+from django.core.management.base import BaseCommand
+from trade_simulation.settlement import settle_expired_options
+
+
+class Command(BaseCommand):
+    """
+    Batch job that settles and removes every expired option; meant to run daily from a scheduler
+    """
+
+    help = "Cash-settle in-the-money expired options and remove all expired options."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--date",
+            type=date.fromisoformat,
+            default=None,
+            help="Settle options that expired before this date (YYYY-MM-DD, defaults to today).",
+        )
+
+    def handle(self, *args, **options):
+        in_the_money, worthless, unpriced = settle_expired_options(as_of=options["date"])
+        self.stdout.write(
+            f"Settled {in_the_money} in-the-money and {worthless} worthless options."
+        )
+        if unpriced:
+            self.stdout.write(f"Left {unpriced} options unsettled: no price for their underlying.")
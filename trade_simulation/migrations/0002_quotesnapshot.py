@@ -0,0 +1,28 @@
+# Generated by Django 3.2.9 on 2026-10-18 10:01
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trade_simulation', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuoteSnapshot',
+            fields=[
+                ('symbol', models.TextField(max_length=25, unique=True)),
+                ('bid', models.DecimalField(blank=True, decimal_places=4, max_digits=14, null=True)),
+                ('ask', models.DecimalField(blank=True, decimal_places=4, max_digits=14, null=True)),
+                ('regular_market_price', models.DecimalField(blank=True, decimal_places=4, max_digits=14, null=True)),
+                ('fetched_on', models.DateTimeField(db_index=True)),
+                ('uid', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, unique=True)),
+            ],
+            options={
+                'ordering': ['symbol'],
+            },
+        ),
+    ]
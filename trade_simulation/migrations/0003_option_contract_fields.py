@@ -0,0 +1,74 @@
+# Generated by Django 3.2.9 on 2026-10-18 10:09
+
+from datetime import date
+from decimal import Decimal
+import re
+from django.db import migrations, models
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def parse_contract(contract):
+    # Frozen copy of trade_simulation.models.parse_contract
+    parts = re.split(r'(\d+)', contract or "")
+    underlying = parts[0]
+    expiration_date = None
+    if len(parts) > 1:
+        exp = parts[1]
+        try:
+            expiration_date = date(2000 + int(exp[0:2]), int(exp[2:4]), int(exp[4:6]))
+        except ValueError:
+            expiration_date = None
+    option_type = parts[2] if len(parts) > 2 else ""
+    strike = Decimal(parts[3]) / 1000 if len(parts) > 3 and parts[3] else None
+    return underlying, expiration_date, option_type, strike
+
+
+def backfill_contract_fields(apps, schema_editor):
+    Option = apps.get_model('trade_simulation', 'Option')
+    batch = []
+    for option in Option.objects.only('uid', 'contract').iterator(chunk_size=BACKFILL_BATCH_SIZE):
+        option.underlying, option.expiration_date, option.contract_type, option.strike = (
+            parse_contract(option.contract)
+        )
+        batch.append(option)
+        if len(batch) >= BACKFILL_BATCH_SIZE:
+            Option.objects.bulk_update(batch, ['underlying', 'expiration_date', 'contract_type', 'strike'])
+            batch = []
+    if batch:
+        Option.objects.bulk_update(batch, ['underlying', 'expiration_date', 'contract_type', 'strike'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trade_simulation', '0002_quotesnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='option',
+            name='contract_type',
+            field=models.TextField(blank=True, default='', max_length=1),
+        ),
+        migrations.AddField(
+            model_name='option',
+            name='expiration_date',
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='option',
+            name='strike',
+            field=models.DecimalField(blank=True, decimal_places=3, max_digits=15, null=True),
+        ),
+        migrations.AddField(
+            model_name='option',
+            name='underlying',
+            field=models.TextField(blank=True, default='', max_length=25),
+        ),
+        migrations.RunPython(backfill_contract_fields, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='option',
+            index=models.Index(fields=['underlying', 'expiration_date'], name='trade_simul_underly_f91037_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trade_simulation', '0003_option_contract_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='ranked_on',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.9 on 2026-10-18 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trade_simulation', '0004_game_ranked_on'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['created_on', 'uid'], name='trade_simul_created_f3b515_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='portfolio',
+            index=models.Index(fields=['game', 'game_rank', 'title'], name='trade_simul_game_id_604568_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.2.9 on 2026-10-18 10:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trade_simulation', '0005_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ValueRoster',
+            fields=[
+                ('portfolio_ids', models.BinaryField()),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('uid', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, unique=True)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='trade_simulation.game')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ValueSnapshot',
+            fields=[
+                ('resolution', models.PositiveIntegerField()),
+                ('taken_on', models.DateTimeField()),
+                ('total_values', models.BinaryField()),
+                ('uid', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, unique=True)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='trade_simulation.game')),
+                ('roster', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='trade_simulation.valueroster')),
+            ],
+            options={
+                'ordering': ['taken_on'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='valuesnapshot',
+            index=models.Index(fields=['game', 'taken_on'], name='trade_simul_game_id_b47f7e_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='valuesnapshot',
+            constraint=models.UniqueConstraint(fields=('resolution', 'taken_on', 'game'), name='unique_value_snapshot'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.2.9 on 2026-10-18 10:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trade_simulation', '0006_value_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RestingOrder',
+            fields=[
+                ('ticker', models.TextField(max_length=5)),
+                ('order_type', models.TextField(max_length=5)),
+                ('shares', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('trigger_price', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('status', models.TextField(default='OPEN', max_length=9)),
+                ('fill_price', models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_on', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('closed_on', models.DateTimeField(blank=True, null=True)),
+                ('uid', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, unique=True)),
+                ('portfolio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='trade_simulation.portfolio')),
+            ],
+            options={
+                'ordering': ['created_on'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='restingorder',
+            index=models.Index(fields=['status', 'created_on'], name='trade_simul_status_3d840d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='restingorder',
+            index=models.Index(fields=['portfolio', 'status'], name='trade_simul_portfol_b3c099_idx'),
+        ),
+    ]
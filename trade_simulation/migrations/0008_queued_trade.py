@@ -0,0 +1,46 @@
+# Generated by Django 3.2.9 on 2026-10-18 10:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trade_simulation', '0007_resting_order'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedTrade',
+            fields=[
+                ('idempotency_key', models.CharField(blank=True, max_length=255, null=True)),
+                ('order', models.JSONField()),
+                ('status', models.TextField(default='PENDING', max_length=7)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('started_on', models.DateTimeField(blank=True, null=True)),
+                ('finished_on', models.DateTimeField(blank=True, null=True)),
+                ('uid', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, unique=True)),
+                ('portfolio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='trade_simulation.portfolio')),
+            ],
+            options={
+                'ordering': ['created_on', 'uid'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='queuedtrade',
+            index=models.Index(fields=['status', 'created_on'], name='trade_simul_status_38a929_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queuedtrade',
+            index=models.Index(fields=['portfolio', 'status', 'created_on'], name='trade_simul_portfol_1b1c11_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='queuedtrade',
+            constraint=models.UniqueConstraint(fields=('portfolio', 'idempotency_key'), name='unique_trade_idempotency_key'),
+        ),
+    ]
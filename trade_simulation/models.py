@@ -1,16 +1,151 @@
-from django.db import models
+from django.db import models, connection, transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
+from django.utils import timezone
 import uuid
 import re
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from decimal import Decimal
-from yfinance import Ticker
+from .quotes import get_quote, get_quotes, get_option_chain, get_option_chains
+from .valuation import PortfolioValuation
+from .broker import publish_standings
+from .leaderboard import leaderboards
+from .journal import journal
 
 TRANSACTION_TYPE_BUY = "BUY"
 TRANSACTION_TYPE_SELL = "SELL"
 OPTION_TYPE_CALL = " CALL"
 OPTION_TYPE_PUT = " PUT"
 REGULAR_SHARES = 100.0
+CENTS = Decimal("0.01")
+# Columns of the option rows read by PortfolioValuation
+OPTION_POSITION_FIELDS = ("portfolio_id", "contract", "underlying", "expiration_date", "contract_type", "quantity")
+# Rows written per INSERT statement when upserting quote snapshots
+QUOTE_SNAPSHOT_BATCH_SIZE = 500
+
+
+def quote_ask_price(stock_info):
+    """
+    quote_ask_price reads the immediate buy price out of a stock info dict
+    Returns: price of stock or None if not traded
+    """
+    if stock_info.get("ask") is None:
+        return None
+    # Based on yfinance API restrictions to market hours, we return regularMarketPrice if after market hours
+    if stock_info.get("ask") == 0:
+        return stock_info.get("regularMarketPrice")
+    return stock_info.get("ask")
+
+
+def to_decimal(value):
+    """
+    to_decimal converts a float amount to the Decimal stored in the database, without picking up
+    binary floating point noise
+    Returns: Decimal
+    """
+    return Decimal(str(value))
+
+
+def to_cents(value):
+    """
+    to_cents converts a float amount of money to a Decimal rounded to cents
+    Returns: Decimal
+    """
+    return to_decimal(value).quantize(CENTS)
+
+
+def live_options(options):
+    """
+    live_options narrows options to the positions that can still be priced from a chain; expired
+    ones are left to settlement
+    Returns: QuerySet of options
+    """
+    return options.filter(quantity__gt=0, expiration_date__gte=timezone.localdate())
+
+
+def compute_total_values(portfolios, holdings, options=None):
+    """
+    compute_total_values values many portfolios at once: their holdings and options are loaded with
+    one query each, every distinct ticker is priced with one batched quote lookup and every option
+    chain involved is downloaded once, all cache misses together. total_value is set on each
+    portfolio but not saved.
+    Returns: list of portfolios
+    """
+    option_rows = ()
+    if options is not None:
+        option_rows = live_options(options).order_by().values_list(*OPTION_POSITION_FIELDS)
+    valuation = PortfolioValuation(
+        portfolios,
+        holdings.order_by().values_list("portfolio_id", "ticker", "shares"),
+        option_rows,
+        contract_size=REGULAR_SHARES,
+    )
+    quotes = get_quotes(valuation.tickers)
+    prices = {ticker: quote_bid_price(quotes.get(ticker, {})) for ticker in valuation.tickers}
+    chains = get_option_chains(valuation.chain_keys()) if len(valuation.contracts) else None
+    for portfolio, total_value in zip(valuation.portfolios, valuation.total_values(prices, chains)):
+        # Rounded to cents as stored, so that equal stored values rank as ties
+        portfolio.total_value = round(float(total_value), 2)
+    return valuation.portfolios
+
+
+def parse_contract(contract):
+    """
+    parse_contract splits an option contract symbol (e.g. AAPL211223C00148000) into its parts
+    Returns: tuple of (underlying ticker, expiration date or None, option type, strike price or None)
+    """
+    parts = re.split(r'(\d+)', contract or "")
+    underlying = parts[0]
+    expiration_date = None
+    if len(parts) > 1:
+        exp = parts[1]
+        try:
+            expiration_date = date(2000 + int(exp[0:2]), int(exp[2:4]), int(exp[4:6]))
+        except ValueError:
+            expiration_date = None
+    option_type = parts[2] if len(parts) > 2 else ""
+    strike = Decimal(parts[3]) / 1000 if len(parts) > 3 and parts[3] else None
+    return underlying, expiration_date, option_type, strike
+
+
+def quote_bid_price(stock_info):
+    """
+    quote_bid_price reads the immediate sell price out of a stock info dict
+    Returns: price of stock or None if not traded
+    """
+    if stock_info.get("bid") is None:
+        return None
+    # Based on yfinance API restrictions to market hours, we return regularMarketPrice if after market hours
+    if stock_info.get("bid") == 0:
+        return stock_info.get("regularMarketPrice")
+    return stock_info.get("bid")
+
+
+def contract_ask_price(contract_info):
+    """
+    contract_ask_price reads the immediate buy price of one contract out of an option chain row
+    Returns: price of contract (1 regular option is REGULAR_SHARES shares) or None if not available
+    """
+    if not contract_info:
+        return None
+    # Based on yfinance API restrictions to market hours, we return lastPrice if after market hours
+    if float(contract_info.get("ask")) == 0:
+        return float(contract_info.get("lastPrice")) * REGULAR_SHARES
+    return float(contract_info.get("ask")) * REGULAR_SHARES
+
+
+def contract_bid_price(contract_info):
+    """
+    contract_bid_price reads the immediate sell price of one contract out of an option chain row
+    Returns: price of contract (1 regular option is REGULAR_SHARES shares) or None if not available
+    """
+    if not contract_info:
+        return None
+    # Based on yfinance API restrictions to market hours, we return lastPrice if after market hours
+    if float(contract_info.get("bid")) == 0:
+        return float(contract_info.get("lastPrice")) * REGULAR_SHARES
+    return float(contract_info.get("bid")) * REGULAR_SHARES
 
 
 class Game(models.Model):
@@ -27,6 +162,8 @@ class Game(models.Model):
     rules = models.TextField(max_length=200, null=True, blank=True)
     # Winner is set once a user has won the game at the conclusion of the game
     winner = models.CharField(max_length=200, null=True, blank=True)
+    # When the total values and ranks of the game's portfolios were last computed
+    ranked_on = models.DateTimeField(null=True, blank=True)
     created_on = models.DateTimeField(auto_now_add=True)
     uid = models.UUIDField(
         default=uuid.uuid4, unique=True, primary_key=True, editable=False
@@ -34,6 +171,10 @@ class Game(models.Model):
 
     class Meta:
         ordering = ['-created_on']
+        indexes = [
+            # Serves pages of the game list, which are read newest first
+            models.Index(fields=['created_on', 'uid']),
+        ]
 
     def __str__(self):
         """
@@ -43,13 +184,17 @@ class Game(models.Model):
 
     def rank_portfolios(self):
         """
-        rank_portfolios iterates through all portfolios in the game to
-        compute their total value and ranks the portfolios based on this value
+        rank_portfolios computes the total value of all portfolios in the game and ranks the
+        portfolios based on this value, writing only the portfolios whose value or rank changed
+        with a single bulk update and publishing them to clients watching the game
         Returns: list of portfolios ordered by ranking
         """
-        portfolios = Portfolio.objects.filter(game=self)
-        for portfolio in portfolios:
-            portfolio.compute_total_value()
+        portfolios = list(Portfolio.objects.filter(game=self))
+        previous = {p.pk: (Decimal(p.total_value), p.game_rank) for p in portfolios}
+        # Value every portfolio of the game together, pricing each held ticker and option chain once
+        compute_total_values(
+            portfolios, Holding.objects.filter(portfolio__game=self), Option.objects.filter(portfolio__game=self)
+        )
 
         leaderboard = sorted(portfolios, key=lambda p: p.total_value, reverse=True)
         for i in range(len(leaderboard)):
@@ -59,9 +204,29 @@ class Game(models.Model):
                 leaderboard[i].game_rank = leaderboard[i - 1].game_rank
             else:
                 leaderboard[i].game_rank = i + 1
-            leaderboard[i].save()
+        changed = [
+            p for p in leaderboard
+            if previous[p.pk] != (Decimal(str(p.total_value)), p.game_rank)
+        ]
+        if changed:
+            Portfolio.objects.bulk_update(changed, ["total_value", "game_rank"])
+        self.ranked_on = timezone.now()
+        Game.objects.filter(pk=self.pk).update(ranked_on=self.ranked_on)
+        # bulk_update sends no save signals, so the in-memory leaderboard is updated here
+        for portfolio in changed:
+            leaderboards.update(portfolio)
+        leaderboards.synced(self)
+        # Clients streaming the game receive only the portfolios that moved
+        publish_standings(self, changed)
         return leaderboard
 
+    def standings_are_stale(self, max_age):
+        """
+        standings_are_stale checks whether the stored values and ranks are older than max_age seconds
+        Returns: bool
+        """
+        return self.ranked_on is None or self.ranked_on < timezone.now() - timedelta(seconds=max_age)
+
 
 class Portfolio(models.Model):
     """
@@ -86,6 +251,10 @@ class Portfolio(models.Model):
     class Meta:
         unique_together = ("title", "game")
         ordering = ['-created_on']
+        indexes = [
+            # Serves leaderboard pages, which are read in (game_rank, title) order
+            models.Index(fields=['game', 'game_rank', 'title']),
+        ]
 
     def __str__(self):
         """
@@ -93,37 +262,105 @@ class Portfolio(models.Model):
         """
         return self.title
 
-    def equity_value(self):
+    def current_rank(self):
+        """
+        current_rank looks the portfolio up in the in-memory leaderboard of its game, which costs
+        O(log n) in the size of the game
+        Returns: rank of the portfolio or None if it is not in a game
+        """
+        if self.game_id is None:
+            return None
+        return leaderboards.get(self.game).rank(self.pk)
+
+    def held_tickers(self):
+        """
+        held_tickers finds every distinct ticker held by the portfolio
+        Returns: list of tickers
         """
-        equity_value computes the combined value of all holdings owned by the portfolio
+        return list(self.holding_set.order_by().values_list("ticker", flat=True).distinct())
+
+    def equity_value(self, quotes=None):
+        """
+        equity_value computes the combined value of all holdings owned by the portfolio,
+        pricing them from the quotes snapshot when one is given. Otherwise all uncached
+        prices are fetched together before valuation.
         Returns: double value
         """
+        if quotes is None:
+            quotes = get_quotes(self.held_tickers())
         value = 0.0
-        holdings = Holding.objects.filter(portfolio=self)
-        for holding in holdings:
-            value += holding.market_value()
+        for holding in self.holding_set.all():
+            value += holding.market_value(quotes)
         return value
 
-    def compute_total_value(self):
+    def option_value(self, chains=None):
+        """
+        option_value computes the combined value of the unexpired options owned by the portfolio,
+        pricing them from the given chains, or else from every chain involved fetched together
+        Returns: double value
+        """
+        options = live_options(self.option_set.all()).order_by().values_list(*OPTION_POSITION_FIELDS)
+        valuation = PortfolioValuation([self], (), options, contract_size=REGULAR_SHARES)
+        if not len(valuation.contracts):
+            return 0.0
+        if chains is None:
+            chains = get_option_chains(valuation.chain_keys())
+        return float(valuation.option_values(chains)[0])
+
+    def compute_total_value(self, quotes=None):
         """
-        compute_total_value computes the total value of the portfolio (cash + equities)
+        compute_total_value computes the total value of the portfolio (cash + equities + options)
         Returns: N/A
         """
-        self.total_value = self.equity_value() + float(self.cash_balance)
-        self.save()
+        self.total_value = self.equity_value(quotes) + self.option_value() + float(self.cash_balance)
+        # Only the total value, so that a trade committed while prices were fetched keeps its cash balance
+        self.save(update_fields=["total_value"])
 
     def add_transaction(self, ticker, shares, price, transaction_type):
         """
-        add_transaction creates a transaction record for a transaction that has occurred
+        add_transaction appends the record of a transaction that has occurred to the journal
+        Returns: N/A
+        """
+        journal.record([Transaction(
+            portfolio=self,
+            ticker=ticker,
+            trade_type=transaction_type,
+            shares=shares,
+            bought_price=price,
+        )])
+
+    def lock(self):
+        """
+        lock locks the portfolio row until the end of the current database transaction, so that
+        trades on the portfolio run one at a time, and reads the balances the lock guards
+        Returns: Portfolio with the current cash_balance and total_value
+        """
+        return Portfolio.objects.select_for_update().only("cash_balance", "total_value").get(pk=self.pk)
+
+    def apply_trade(self, locked, cash_change, value_change=0):
+        """
+        apply_trade adds cash_change to the cash balance and value_change to the total value of the
+        locked portfolio with a single UPDATE, and mirrors the result on this instance. Once committed,
+        the new value is recorded on the leaderboard and, if it changed, published to the game's streams.
         Returns: N/A
         """
-        transaction = Transaction.objects.create()
-        transaction.portfolio = self
-        transaction.ticker = ticker
-        transaction.trade_type = transaction_type
-        transaction.shares = shares
-        transaction.bought_price = price
-        transaction.save()
+        cash_change = to_cents(cash_change)
+        value_change = to_cents(value_change)
+        Portfolio.objects.filter(pk=self.pk).update(
+            cash_balance=F("cash_balance") + cash_change,
+            total_value=F("total_value") + value_change,
+        )
+        self.cash_balance = locked.cash_balance + cash_change
+        self.total_value = locked.total_value + value_change
+        # update() sends no save signal. The leaderboard is shared by the whole process, so it only
+        # learns the new value once the trade is committed.
+        previous, total_value = locked.total_value, self.total_value
+        transaction.on_commit(lambda: leaderboards.update(self, total_value))
+        if value_change:
+            # Imported here because the standings module imports this one
+            from .standings import publish_trade
+            # Trades at market price leave the value, and so the standings, as they are
+            transaction.on_commit(lambda: publish_trade(self, previous, total_value))
 
     def validate_exercise(self, ticker, shares, price, contract, option_type):
         """
@@ -166,49 +403,68 @@ class Portfolio(models.Model):
             print(warning)
         return option
 
-    def buy_holding(self, ticker, shares, exercise=None):
+    def exercised_value(self, contract, shares):
+        """
+        exercised_value prices the contracts of option contract exercised to buy/sell s shares, as
+        they are counted in the total value of the portfolio
+        Returns: double value
+        """
+        option = live_options(Option.objects.filter(portfolio=self, contract=contract)).first()
+        if option is None:
+            # Options not held, or expired, are not counted and are refused once the lock is taken
+            return 0.0
+        return (option.bid_price() or 0.0) * float(shares) / REGULAR_SHARES
+
+    def buy_holding(self, ticker, shares, exercise=None, price=None):
         """
-        buy_holding allows a user to purchase s shares of ticker t to add to the portfolio
+        buy_holding allows a user to purchase s shares of ticker t to add to the portfolio,
+        as one atomic unit holding the portfolio lock, at price when already known
         Returns: N/A or Exception if user cannot purchase s shares of ticker t
         """
-        holding, created = Holding.objects.get_or_create(portfolio=self, ticker=ticker)
-        price = holding.ask_price()
+        # Priced before locking so no lock is held while waiting on the provider
+        if price is None:
+            price = Holding(portfolio=self, ticker=ticker).ask_price()
         if price is None:
-            if created:
-                holding.delete()
             error = f"Ticker {ticker} is not currently traded."
             print(error)
             raise ValueError(error)
-
-        # If a call option is being exercised, make sure it is valid and compute cost accordingly
-        if exercise:
-            option = self.validate_exercise(ticker, shares, price, exercise, 'C')
-            price = option.strike_price()
-        cost = price * float(shares)
-
-        if float(self.cash_balance) < cost:
-            error = f"Not enough cash to buy ${cost} in {shares} shares of {ticker}."
-            if created:
-                holding.delete()
-            print(error)
-            raise ValueError(error)
-        holding.shares = float(0 if holding.shares is None else holding.shares) + float(
-            shares
-        )
-        holding.save()
-        self.cash_balance = float(self.cash_balance) - cost
-        self.save()
-
-        # If a call option was exercised, deduct shares from that option
-        if exercise and option:
-            option.quantity -= Decimal(shares / REGULAR_SHARES)
-            option.save()
-
-        self.add_transaction(ticker, shares, price, TRANSACTION_TYPE_BUY)
-
-    def sell_holding(self, ticker, shares, exercise=None):
-        """
-        sell_holding allows a user to sell s shares of ticker t currently in their portfolio
+        exercised_value = self.exercised_value(exercise, shares) if exercise else 0.0
+
+        with journal.atomic():
+            locked = self.lock()
+            # If a call option is being exercised, make sure it is valid and compute cost accordingly
+            market_price = price
+            option = None
+            if exercise:
+                option = self.validate_exercise(ticker, shares, price, exercise, 'C')
+                price = option.strike_price()
+            cost = price * float(shares)
+
+            if float(locked.cash_balance) < cost:
+                error = f"Not enough cash to buy ${cost} in {shares} shares of {ticker}."
+                print(error)
+                raise ValueError(error)
+            updated = Holding.objects.filter(portfolio=self, ticker=ticker).update(
+                shares=Coalesce(F("shares"), Decimal(0)) + to_decimal(shares)
+            )
+            if not updated:
+                Holding.objects.create(portfolio=self, ticker=ticker, shares=to_decimal(shares))
+            # Shares bought below market (exercised calls) raise the value by what the exercised
+            # contracts were no longer counted at
+            self.apply_trade(locked, -cost, market_price * float(shares) - cost - exercised_value)
+
+            # If a call option was exercised, deduct shares from that option
+            if option:
+                Option.objects.filter(pk=option.pk).update(
+                    quantity=F("quantity") - to_decimal(shares / REGULAR_SHARES)
+                )
+
+            self.add_transaction(ticker, shares, price, TRANSACTION_TYPE_BUY)
+
+    def sell_holding(self, ticker, shares, exercise=None, price=None):
+        """
+        sell_holding allows a user to sell s shares of ticker t currently in their portfolio,
+        as one atomic unit holding the portfolio lock, at price when already known
         Returns: N/A or Exception if user cannot sell s shares of ticker t
         """
         try:
@@ -217,74 +473,89 @@ class Portfolio(models.Model):
             error = f"Holding {ticker} is not in portfolio."
             print(error)
             raise ValueError(error)
-        price = holding.bid_price()
+        # Priced before locking so no lock is held while waiting on the provider
+        if price is None:
+            price = holding.bid_price()
         if price is None:
             error = f"Ticker {ticker} is not currently traded."
             print(error)
             raise ValueError(error)
+        exercised_value = self.exercised_value(exercise, shares) if exercise else 0.0
+
+        with journal.atomic():
+            locked = self.lock()
+            # Re-read under the lock, as a concurrent trade may have changed it since
+            current_shares = Holding.objects.filter(pk=holding.pk).values_list("shares", flat=True).first()
+
+            # If a put option is being exercised, make sure it is valid and compute cost accordingly
+            market_price = price
+            option = None
+            if exercise:
+                option = self.validate_exercise(ticker, shares, price, exercise, 'P')
+                price = option.strike_price()
+            cost = price * float(shares)
+
+            current_shares = float(0 if current_shares is None else current_shares)
+            if current_shares < float(shares):
+                error = f"Not enough shares of {ticker} to sell {shares} shares."
+                print(error)
+                raise ValueError(error)
+            holdings = Holding.objects.filter(pk=holding.pk)
+            if current_shares == float(shares):
+                holdings.delete()
+            else:
+                holdings.update(shares=F("shares") - to_decimal(shares))
+            # Shares sold above market (exercised puts) raise the value by what the exercised
+            # contracts were no longer counted at
+            self.apply_trade(locked, cost, cost - market_price * float(shares) - exercised_value)
 
-        # If a put option is being exercised, make sure it is valid and compute cost accordingly
-        if exercise:
-            option = self.validate_exercise(ticker, shares, price, exercise, 'P')
-            price = option.strike_price()
-        cost = price * float(shares)
-
-        current_shares = float(0 if holding.shares is None else holding.shares)
-        if current_shares < float(shares):
-            error = f"Not enough shares of {ticker} to sell {shares} shares."
-            print(error)
-            raise ValueError(error)
-        holding.shares = current_shares - float(shares)
-        if holding.shares == 0.0:
-            holding.delete()
-        else:
-            holding.save()
-        self.cash_balance = float(self.cash_balance) + cost
-        self.save()
-
-        # If a put option was exercised, deduct shares from that option
-        if exercise and option:
-            option.quantity -= Decimal(shares / REGULAR_SHARES)
-            option.save()
+            # If a put option was exercised, deduct shares from that option
+            if option:
+                Option.objects.filter(pk=option.pk).update(
+                    quantity=F("quantity") - to_decimal(shares / REGULAR_SHARES)
+                )
 
-        self.add_transaction(ticker, shares, price, TRANSACTION_TYPE_SELL)
+            self.add_transaction(ticker, shares, price, TRANSACTION_TYPE_SELL)
 
-    def buy_option(self, contract, quantity):
+    def buy_option(self, contract, quantity, price=None):
         """
-        buy_option allows a user to purchase <quantity> options of contract name <contract>
+        buy_option allows a user to purchase <quantity> options of contract name <contract>,
+        as one atomic unit holding the portfolio lock, at price when already known
         Returns: N/A or Exception if user cannot purchase specified quantity of said option
         """
-        option, created = Option.objects.get_or_create(portfolio=self, contract=contract)
-        price = option.ask_price()
+        option = Option(portfolio=self, contract=contract)
+        # Priced before locking so no lock is held while waiting on the provider
+        if price is None:
+            price = option.ask_price()
         if price is None:
-            if created:
-                option.delete()
             error = f"Contract {contract} is not currently available."
             print(error)
             raise ValueError(error)
         cost = price * float(quantity)
-        if float(self.cash_balance) < cost:
-            error = f"Not enough cash to buy ${cost} in {quantity} options of {contract}."
-            if created:
-                option.delete()
-            print(error)
-            raise ValueError(error)
-        option.quantity = float(0 if option.quantity is None else option.quantity) + float(
-            quantity
-        )
-        option.save()
 
-        self.cash_balance = float(self.cash_balance) - cost
-        self.save()
-
-        if option.option_type() == 'C':
-            self.add_transaction(contract, quantity, price, TRANSACTION_TYPE_BUY + OPTION_TYPE_CALL)
-        elif option.option_type() == 'P':
-            self.add_transaction(contract, quantity, price, TRANSACTION_TYPE_BUY + OPTION_TYPE_PUT)
-
-    def sell_option(self, contract, quantity):
-        """
-        sell_option allows a user to sell <quantity> options of contract name <contract> from portfolio
+        with journal.atomic():
+            locked = self.lock()
+            if float(locked.cash_balance) < cost:
+                error = f"Not enough cash to buy ${cost} in {quantity} options of {contract}."
+                print(error)
+                raise ValueError(error)
+            updated = Option.objects.filter(portfolio=self, contract=contract).update(
+                quantity=Coalesce(F("quantity"), Decimal(0)) + to_decimal(quantity)
+            )
+            if not updated:
+                option.quantity = to_decimal(quantity)
+                option.save(force_insert=True)
+            self.apply_trade(locked, -cost)
+
+            if option.option_type() == 'C':
+                self.add_transaction(contract, quantity, price, TRANSACTION_TYPE_BUY + OPTION_TYPE_CALL)
+            elif option.option_type() == 'P':
+                self.add_transaction(contract, quantity, price, TRANSACTION_TYPE_BUY + OPTION_TYPE_PUT)
+
+    def sell_option(self, contract, quantity, price=None):
+        """
+        sell_option allows a user to sell <quantity> options of contract name <contract> from portfolio,
+        as one atomic unit holding the portfolio lock, at price when already known
         Returns: N/A or Exception if user cannot sell specified quantity of said option
         """
         try:
@@ -293,29 +564,34 @@ class Portfolio(models.Model):
             error = f"Contract {contract} is not in portfolio."
             print(error)
             raise ValueError(error)
-        price = option.bid_price()
+        # Priced before locking so no lock is held while waiting on the provider
+        if price is None:
+            price = option.bid_price()
         if price is None:
             error = f"Contract {contract} is not currently available."
             print(error)
             raise ValueError(error)
-        current_quantity = float(0 if option.quantity is None else option.quantity)
-        if current_quantity < float(quantity):
-            error = f"Not enough of {contract} in portfolio to sell {quantity} options."
-            print(error)
-            raise ValueError(error)
-        option.quantity = current_quantity - float(quantity)
-        if option.quantity == 0.0:
-            option.delete()
-        else:
-            option.save()
 
-        self.cash_balance = float(self.cash_balance) + (price * float(quantity))
-        self.save()
+        with journal.atomic():
+            locked = self.lock()
+            # Re-read under the lock, as a concurrent trade may have changed it since
+            current_quantity = Option.objects.filter(pk=option.pk).values_list("quantity", flat=True).first()
+            current_quantity = float(current_quantity or 0)
+            if current_quantity < float(quantity):
+                error = f"Not enough of {contract} in portfolio to sell {quantity} options."
+                print(error)
+                raise ValueError(error)
+            options = Option.objects.filter(pk=option.pk)
+            if current_quantity == float(quantity):
+                options.delete()
+            else:
+                options.update(quantity=F("quantity") - to_decimal(quantity))
+            self.apply_trade(locked, price * float(quantity))
 
-        if option.option_type() == 'C':
-            self.add_transaction(contract, quantity, price, TRANSACTION_TYPE_SELL + OPTION_TYPE_CALL)
-        elif option.option_type() == 'P':
-            self.add_transaction(contract, quantity, price, TRANSACTION_TYPE_SELL + OPTION_TYPE_PUT)
+            if option.option_type() == 'C':
+                self.add_transaction(contract, quantity, price, TRANSACTION_TYPE_SELL + OPTION_TYPE_CALL)
+            elif option.option_type() == 'P':
+                self.add_transaction(contract, quantity, price, TRANSACTION_TYPE_SELL + OPTION_TYPE_PUT)
 
 
 class Holding(models.Model):
@@ -347,37 +623,27 @@ class Holding(models.Model):
 
     def ask_price(self):
         """
-        ask_price calls the yfinance API to get the immediate buy price of the equity
+        ask_price reads the shared quote cache to get the immediate buy price of the equity
         Returns: price of stock
         """
-        tick = Ticker(str(self.ticker))
-        stock_info = tick.info
-        if stock_info.get("ask") is None:
-            return None
-        # Based on yfinance API restrictions to market hours, we return regularMarketPrice if after market hours
-        if stock_info.get("ask") == 0:
-            return stock_info.get("regularMarketPrice")
-        return stock_info.get("ask")
+        return quote_ask_price(get_quote(self.ticker))
 
     def bid_price(self):
         """
-        bid_price calls the yfinance API to get the immediate sell price of the equity
+        bid_price reads the shared quote cache to get the immediate sell price of the equity
         Returns: price of stock
         """
-        stock_info = Ticker(str(self.ticker)).info
-        if stock_info.get("bid") is None:
-            return None
-        # Based on yfinance API restrictions to market hours, we return regularMarketPrice if after market hours
-        if stock_info.get("bid") == 0:
-            return stock_info.get("regularMarketPrice")
-        return stock_info.get("bid")
+        return quote_bid_price(get_quote(self.ticker))
 
-    def market_value(self):
+    def market_value(self, quotes=None):
         """
-        market_value computes market value of a holding
+        market_value computes market value of a holding, using the quotes snapshot if given
         Returns: double value
         """
-        price = self.bid_price() or 0.0
+        if quotes is None:
+            price = self.bid_price() or 0.0
+        else:
+            price = quote_bid_price(quotes.get(self.ticker, {})) or 0.0
         return price * float(self.shares)
 
 
@@ -392,6 +658,11 @@ class Option(models.Model):
         Portfolio, null=True, blank=True, on_delete=models.CASCADE
     )
     contract = models.TextField(max_length=25)
+    # Parts of the contract symbol, parsed once when the option is saved
+    underlying = models.TextField(max_length=25, blank=True, default="")
+    expiration_date = models.DateField(null=True, blank=True, db_index=True)
+    contract_type = models.TextField(max_length=1, blank=True, default="")
+    strike = models.DecimalField(max_digits=15, decimal_places=3, null=True, blank=True)
     quantity = models.DecimalField(
         max_digits=12, decimal_places=2, default=0.00, null=True
     )
@@ -402,6 +673,10 @@ class Option(models.Model):
 
     class Meta:
         ordering = ['-created_on']
+        indexes = [
+            # Also serves lookups of every option on an underlying
+            models.Index(fields=['underlying', 'expiration_date']),
+        ]
 
     def __str__(self):
         """
@@ -409,91 +684,82 @@ class Option(models.Model):
         """
         return self.contract
 
-    @property
-    def split(self):
+    def save(self, *args, **kwargs):
+        self.parse_contract()
+        super().save(*args, **kwargs)
+
+    def parse_contract(self):
         """
-        Split option contract symbol into its component parts
+        parse_contract fills the underlying, expiration date, type and strike fields from the contract symbol
+        Returns: N/A
         """
-        return re.split(r'(\d+)', self.contract)
+        self.underlying, self.expiration_date, self.contract_type, self.strike = parse_contract(self.contract)
+
+    def _parsed(self):
+        # Options built in memory and never saved have not been parsed yet
+        if not self.underlying and self.contract:
+            self.parse_contract()
+        return self
 
     def ticker(self):
         """
         Return the stock ticker that this option is for
         """
-        return self.split[0]
+        return self._parsed().underlying
 
     def expiration(self):
         """
         Return the expiration date of this option in datetime format
         """
-        exp = self.split[1]
-        try:
-            return datetime(2000 + int(exp[0:2]), int(exp[2:4]), int(exp[4:6]), 0, 0)
-        except ValueError:
+        exp = self._parsed().expiration_date
+        if exp is None:
             return None
+        return datetime(exp.year, exp.month, exp.day, 0, 0)
 
     def option_type(self):
         """
         Return the type of option: 'C' for call, 'P' for put
         """
-        return self.split[2]
+        return self._parsed().contract_type
 
     def strike_price(self):
         """
         Return the strike price of this option, derived from contract symbol
         """
-        return float(self.split[3]) / 1000.0
+        strike = self._parsed().strike
+        if strike is None:
+            return None
+        return float(strike)
 
     def get_info(self):
         """
-        Calls the yfinance API to get information on a specific option contract
+        Reads the shared option chain cache to get information on a specific option contract
         Returns: dict with info on option contract
         """
-        tick = Ticker(str(self.ticker()))
-        if not self.expiration():
+        if not self.expiration() or self.option_type() not in ('C', 'P'):
             return None
         expdate = str(self.expiration().date())
         try:
-            df = tick.option_chain(date=expdate)
+            chain = get_option_chain(self.ticker(), expdate)
         except ValueError:
             error = f"No contract exists for {str(self.ticker())} with expiration date {expdate}."
             print(error)
             return None
-        if self.option_type() == 'C':
-            options = df.calls.set_index('contractSymbol').T.to_dict()
-        elif self.option_type() == 'P':
-            options = df.puts.set_index('contractSymbol').T.to_dict()
-        else:
-            return None
-        if self.contract not in options:
-            return None
-        return options.get(self.contract)
+        return chain.get(self.contract, self.option_type())
 
     def ask_price(self):
         """
-        ask_price calls the yfinance API to get the immediate buy price of a contract
+        ask_price reads the cached option chain to get the immediate buy price of a contract
         Returns: price of contract (1 regular option is REGULAR_SHARES shares)
         """
-        info = self.get_info()
-        if not info:
-            return None
-        # Based on yfinance API restrictions to market hours, we return lastPrice if after market hours
-        if float(info.get("ask")) == 0:
-            return float(info.get("lastPrice")) * REGULAR_SHARES
-        return float(info.get("ask")) * REGULAR_SHARES
+        return contract_ask_price(self.get_info())
 
     def bid_price(self):
         """
-        bid_price calls the yfinance API to get the immediate sell price of a contract
+        bid_price reads the cached option chain to get the immediate sell price of a contract
         Returns: price of contract (1 regular option is REGULAR_SHARES shares)
         """
-        info = self.get_info()
-        if not info:
-            return None
-        # Based on yfinance API restrictions to market hours, we return lastPrice if after market hours
-        if float(info.get("bid")) == 0:
-            return float(info.get("lastPrice")) * REGULAR_SHARES
-        return float(info.get("bid")) * REGULAR_SHARES
+        return contract_bid_price(self.get_info())
 
 
 class Transaction(models.Model):
@@ -525,3 +791,228 @@ class Transaction(models.Model):
         String representation of transaction
         """
         return self.ticker
+
+
+class QuoteSnapshot(models.Model):
+    """
+    QuoteSnapshot is the last known quote of a symbol, shared by every process through the database
+    """
+
+    symbol = models.TextField(max_length=25, unique=True)
+    bid = models.DecimalField(max_digits=14, decimal_places=4, null=True, blank=True)
+    ask = models.DecimalField(max_digits=14, decimal_places=4, null=True, blank=True)
+    regular_market_price = models.DecimalField(
+        max_digits=14, decimal_places=4, null=True, blank=True
+    )
+    # Time the quote was fetched from the market data provider
+    fetched_on = models.DateTimeField(db_index=True)
+    uid = models.UUIDField(
+        default=uuid.uuid4, unique=True, primary_key=True, editable=False
+    )
+
+    class Meta:
+        ordering = ['symbol']
+
+    def __str__(self):
+        """
+        String representation of quote snapshot
+        """
+        return self.symbol
+
+    def to_info(self):
+        """
+        to_info converts the snapshot back into the stock info format used by the pricing code
+        Returns: dict with bid, ask and regularMarketPrice
+        """
+        info = {
+            "bid": self.bid,
+            "ask": self.ask,
+            "regularMarketPrice": self.regular_market_price,
+        }
+        return {key: float(value) for key, value in info.items() if value is not None}
+
+    @classmethod
+    def bulk_upsert(cls, quotes, fetched_on=None):
+        """
+        bulk_upsert inserts or updates the snapshot of every symbol in quotes with
+        multi-row INSERT ... ON CONFLICT statements
+        Returns: N/A
+        """
+        if not quotes:
+            return
+        fetched_on = fetched_on or timezone.now()
+        fields = [cls._meta.get_field(name) for name in
+                  ("uid", "symbol", "bid", "ask", "regular_market_price", "fetched_on")]
+        qn = connection.ops.quote_name
+        columns = ", ".join(qn(field.column) for field in fields)
+        updates = ", ".join(f"{qn(field.column)} = EXCLUDED.{qn(field.column)}" for field in fields[2:])
+        rows = []
+        for symbol, info in sorted(quotes.items()):
+            values = (uuid.uuid4(), symbol, info.get("bid"), info.get("ask"),
+                      info.get("regularMarketPrice"), fetched_on)
+            rows.append([field.get_db_prep_save(value, connection) for field, value in zip(fields, values)])
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), QUOTE_SNAPSHOT_BATCH_SIZE):
+                batch = rows[start:start + QUOTE_SNAPSHOT_BATCH_SIZE]
+                placeholders = ", ".join(["(" + ", ".join(["%s"] * len(fields)) + ")"] * len(batch))
+                cursor.execute(
+                    f"INSERT INTO {qn(cls._meta.db_table)} ({columns}) VALUES {placeholders} "
+                    f"ON CONFLICT ({qn('symbol')}) DO UPDATE SET {updates}",
+                    [value for row in batch for value in row],
+                )
+
+
+class ValueRoster(models.Model):
+    """
+    ValueRoster is the list of portfolios, in order, that the values of a game's value snapshots
+    refer to. Snapshots share a roster for as long as the game's portfolios stay the same.
+    """
+
+    game = models.ForeignKey(Game, on_delete=models.CASCADE)
+    # Portfolio uids packed as consecutive 16 byte values
+    portfolio_ids = models.BinaryField()
+    # Hash of the game and portfolio uids, so an unchanged roster is found rather than stored again
+    digest = models.CharField(max_length=64, unique=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+    uid = models.UUIDField(
+        default=uuid.uuid4, unique=True, primary_key=True, editable=False
+    )
+
+    def __str__(self):
+        """
+        String representation of value roster
+        """
+        return self.digest
+
+
+class ValueSnapshot(models.Model):
+    """
+    ValueSnapshot holds the total value of every portfolio of a game at one time, as a single row
+    with the values packed in the order of its roster
+    """
+
+    game = models.ForeignKey(Game, on_delete=models.CASCADE)
+    roster = models.ForeignKey(ValueRoster, on_delete=models.CASCADE)
+    # Seconds covered by the snapshot; older snapshots are rolled up into coarser ones
+    resolution = models.PositiveIntegerField()
+    # Start of the time bucket the snapshot stands for
+    taken_on = models.DateTimeField()
+    # Total values packed as consecutive little-endian doubles
+    total_values = models.BinaryField()
+    uid = models.UUIDField(
+        default=uuid.uuid4, unique=True, primary_key=True, editable=False
+    )
+
+    class Meta:
+        ordering = ['taken_on']
+        constraints = [
+            # Also serves the retention scans, which select snapshots by resolution and age
+            models.UniqueConstraint(fields=['resolution', 'taken_on', 'game'], name='unique_value_snapshot'),
+        ]
+        indexes = [
+            # Serves history reads of a game over a time range
+            models.Index(fields=['game', 'taken_on']),
+        ]
+
+    def __str__(self):
+        """
+        String representation of value snapshot
+        """
+        return f"{self.game_id} {self.taken_on}"
+
+
+class RestingOrder(models.Model):
+    """
+    RestingOrder is a limit or stop order on a stock that waits in the order book until the price
+    crosses its trigger price. A limit order fills at its trigger price or better; a stop order
+    becomes a market order once the price reaches its trigger price.
+    """
+
+    ORDER_TYPE_LIMIT = "LIMIT"
+    ORDER_TYPE_STOP = "STOP"
+    STATUS_OPEN = "OPEN"
+    STATUS_FILLED = "FILLED"
+    STATUS_CANCELLED = "CANCELLED"
+    STATUS_REJECTED = "REJECTED"
+
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE)
+    ticker = models.TextField(max_length=5)
+    order_type = models.TextField(max_length=5)
+    # Positive to buy, negative to sell
+    shares = models.DecimalField(max_digits=14, decimal_places=2)
+    trigger_price = models.DecimalField(max_digits=14, decimal_places=2)
+    status = models.TextField(max_length=9, default=STATUS_OPEN)
+    fill_price = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+    # Why the order could not be filled once triggered
+    error = models.TextField(blank=True, default="")
+    created_on = models.DateTimeField(auto_now_add=True, db_index=True)
+    closed_on = models.DateTimeField(null=True, blank=True)
+    uid = models.UUIDField(
+        default=uuid.uuid4, unique=True, primary_key=True, editable=False
+    )
+
+    class Meta:
+        ordering = ['created_on']
+        indexes = [
+            # Serves loading the open orders into the order book and listing a portfolio's orders
+            models.Index(fields=['status', 'created_on']),
+            models.Index(fields=['portfolio', 'status']),
+        ]
+
+    def __str__(self):
+        """
+        String representation of resting order
+        """
+        return f"{self.order_type} {self.shares} {self.ticker} @ {self.trigger_price}"
+
+    def is_buy(self):
+        """
+        Whether the order buys rather than sells
+        """
+        return self.shares > 0
+
+
+class QueuedTrade(models.Model):
+    """
+    QueuedTrade is a stock or option order accepted by the API and waiting in the durable trade queue
+    for a worker to execute it. Trades of one portfolio are executed one at a time, oldest first.
+    """
+
+    STATUS_PENDING = "PENDING"
+    STATUS_RUNNING = "RUNNING"
+    STATUS_DONE = "DONE"
+    STATUS_FAILED = "FAILED"
+
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE)
+    # Chosen by the client so that retrying a request never queues the order twice
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True)
+    # The order in the format of a single trade request
+    order = models.JSONField()
+    status = models.TextField(max_length=7, default=STATUS_PENDING)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default="")
+    attempts = models.PositiveIntegerField(default=0)
+    created_on = models.DateTimeField(auto_now_add=True)
+    started_on = models.DateTimeField(null=True, blank=True)
+    finished_on = models.DateTimeField(null=True, blank=True)
+    uid = models.UUIDField(
+        default=uuid.uuid4, unique=True, primary_key=True, editable=False
+    )
+
+    class Meta:
+        ordering = ['created_on', 'uid']
+        constraints = [
+            models.UniqueConstraint(fields=['portfolio', 'idempotency_key'], name='unique_trade_idempotency_key'),
+        ]
+        indexes = [
+            # Serves workers looking for the oldest pending trades
+            models.Index(fields=['status', 'created_on']),
+            # Serves the check for earlier unfinished trades of the same portfolio
+            models.Index(fields=['portfolio', 'status', 'created_on']),
+        ]
+
+    def __str__(self):
+        """
+        String representation of queued trade
+        """
+        return f"{self.status} {self.order}"
@@ -0,0 +1,216 @@
+import bisect
+from collections import defaultdict
+from datetime import timedelta
+from threading import Lock
+from django.db import transaction
+from django.utils import timezone
+from .models import Holding, Portfolio, RestingOrder, quote_ask_price, quote_bid_price, to_cents
+from .orders import Order, ORDER_FILLED, SECURITY_TYPE_STOCK, Positions, save_positions
+
+# Orders filled per database transaction
+RESTING_ORDER_BATCH_SIZE = 500
+# Orders created this long before the last sync are read again, in case they committed late
+ORDER_BOOK_SYNC_OVERLAP = timedelta(seconds=60)
+# Sorts after every order id, so that a (price, MAX_ID) key follows all keys at that price
+MAX_ID = "~"
+
+
+def _side(is_buy, order_type):
+    """
+    _side tells which way the price must move to trigger an order: buy limits and sell stops
+    trigger when the price falls to their trigger price, sell limits and buy stops when it rises to it
+    """
+    falls = is_buy == (order_type == RestingOrder.ORDER_TYPE_LIMIT)
+    return is_buy, falls
+
+
+class OrderBook:
+    """
+    OrderBook indexes the open resting orders of this process by ticker and trigger price. Each
+    ticker has up to four lists of (trigger price, order id) kept sorted: buy or sell orders, triggered
+    by a falling or a rising price. A new quote takes the crossed orders off one end of each list,
+    costing O(log n) plus the number of crossed orders however many orders are open.
+    """
+
+    def __init__(self):
+        self._books = defaultdict(list)
+        self._orders = {}
+        self._lock = Lock()
+        self._synced_on = None
+
+    def __len__(self):
+        return len(self._orders)
+
+    def add(self, order_id, ticker, is_buy, order_type, trigger_price):
+        """
+        add puts an open order in the book, unless it is already there
+        Returns: N/A
+        """
+        order_id = str(order_id)
+        book = (str(ticker),) + _side(is_buy, order_type)
+        key = (float(trigger_price), order_id)
+        with self._lock:
+            if order_id in self._orders:
+                return
+            self._orders[order_id] = (book, key)
+            bisect.insort(self._books[book], key)
+
+    def remove(self, order_id):
+        """
+        remove takes an order out of the book, e.g. when it is cancelled
+        Returns: N/A
+        """
+        with self._lock:
+            entry = self._orders.pop(str(order_id), None)
+            if entry is None:
+                return
+            book, key = entry
+            keys = self._books[book]
+            i = bisect.bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+
+    def tickers(self):
+        """
+        tickers lists the tickers with open orders in the book
+        Returns: list of tickers
+        """
+        with self._lock:
+            return sorted({book[0] for book, keys in self._books.items() if keys})
+
+    def _take(self, book, price):
+        # Called with the lock held; removes and returns the (id, book, key) of the orders crossed by price
+        keys = self._books.get(book)
+        if not keys or price is None:
+            return []
+        _, _, falls = book
+        if falls:
+            # Triggered when the price is at or below the trigger price: the high end of the list
+            i = bisect.bisect_left(keys, (price,))
+            crossed, keys[i:] = keys[i:], []
+        else:
+            # Triggered when the price is at or above the trigger price: the low end of the list
+            i = bisect.bisect_right(keys, (price, MAX_ID))
+            crossed, keys[:i] = keys[:i], []
+        for _, order_id in crossed:
+            del self._orders[order_id]
+        return [(order_id, book, (trigger, order_id)) for trigger, order_id in crossed]
+
+    def crossed(self, ticker, bid, ask):
+        """
+        crossed takes out of the book every order on ticker triggered by the quote: buy orders
+        compare against the ask, sell orders against the bid
+        Returns: list of (order id, book, key) entries of the orders taken out
+        """
+        ticker = str(ticker)
+        with self._lock:
+            entries = []
+            for falls in (True, False):
+                entries += self._take((ticker, True, falls), ask)
+                entries += self._take((ticker, False, falls), bid)
+            return entries
+
+    def _restore(self, entries):
+        # Puts back orders taken out of the book whose fill did not commit
+        with self._lock:
+            for order_id, book, key in entries:
+                if order_id not in self._orders:
+                    self._orders[order_id] = (book, key)
+                    bisect.insort(self._books[book], key)
+
+    def sync(self):
+        """
+        sync adds the open orders created since the last sync, by any process, to the book;
+        the first sync loads every open order
+        Returns: number of orders added
+        """
+        now = timezone.now()
+        orders = RestingOrder.objects.filter(status=RestingOrder.STATUS_OPEN).order_by()
+        if self._synced_on is not None:
+            orders = orders.filter(created_on__gte=self._synced_on - ORDER_BOOK_SYNC_OVERLAP)
+        before = len(self)
+        for uid, ticker, shares, order_type, trigger_price in orders.values_list(
+            "uid", "ticker", "shares", "order_type", "trigger_price"
+        ):
+            self.add(uid, ticker, shares > 0, order_type, trigger_price)
+        self._synced_on = now
+        return len(self) - before
+
+    def match(self, quotes):
+        """
+        match triggers the orders crossed by a batch of quotes and fills them in bulk; call sync
+        first to pick up orders placed by other processes. The orders of a batch that fails to fill
+        are put back in the book, to trigger again on the next quotes.
+        Returns: tuple of (number of orders filled, number of orders rejected)
+        """
+        prices = {}
+        entries = []
+        for ticker, info in quotes.items():
+            if isinstance(info, dict):
+                prices[str(ticker)] = (quote_bid_price(info), quote_ask_price(info))
+                entries += self.crossed(ticker, *prices[str(ticker)])
+        filled = rejected = 0
+        for i in range(0, len(entries), RESTING_ORDER_BATCH_SIZE):
+            batch = entries[i:i + RESTING_ORDER_BATCH_SIZE]
+            try:
+                batch_filled, batch_rejected = fill_resting_orders([order_id for order_id, _, _ in batch], prices)
+            except Exception as e:
+                print(f"Error occurs when filling resting orders: {e}")
+                self._restore(batch)
+                continue
+            filled += batch_filled
+            rejected += batch_rejected
+        return filled, rejected
+
+
+def fill_resting_orders(order_ids, prices):
+    """
+    fill_resting_orders fills triggered orders at the current market price (ask to buy, bid to sell)
+    in one database transaction: the orders still open and their portfolios are locked, orders are
+    applied oldest first to each portfolio's positions in memory, and everything is written back with
+    bulk statements. Orders the portfolio cannot afford or cover are rejected.
+    Returns: tuple of (number of orders filled, number of orders rejected)
+    """
+    now = timezone.now()
+    filled = rejected = 0
+    with transaction.atomic():
+        orders = list(
+            RestingOrder.objects.select_for_update()
+            .filter(pk__in=order_ids, status=RestingOrder.STATUS_OPEN)
+            .order_by("created_on")
+        )
+        if not orders:
+            return 0, 0
+        portfolio_ids = sorted({order.portfolio_id for order in orders})
+        # Locked in a fixed order so that concurrent batches cannot deadlock
+        portfolios = list(Portfolio.objects.select_for_update().filter(pk__in=portfolio_ids).order_by("pk"))
+        holdings = defaultdict(list)
+        for holding in Holding.objects.filter(portfolio_id__in=portfolio_ids):
+            holdings[holding.portfolio_id].append(holding)
+        positions = {
+            p.pk: Positions(p, p.cash_balance, holdings=holdings[p.pk], options=()) for p in portfolios
+        }
+        for resting in orders:
+            bid, ask = prices[resting.ticker]
+            trade = Order(SECURITY_TYPE_STOCK, resting.ticker, float(resting.shares))
+            trade.price = ask if resting.is_buy() else bid
+            positions[resting.portfolio_id].apply(trade)
+            resting.closed_on = now
+            if trade.status == ORDER_FILLED:
+                resting.status = RestingOrder.STATUS_FILLED
+                resting.fill_price = to_cents(trade.price)
+                filled += 1
+            else:
+                resting.status = RestingOrder.STATUS_REJECTED
+                resting.error = trade.error
+                rejected += 1
+        save_positions(positions.values())
+        for portfolio in portfolios:
+            portfolio.cash_balance = positions[portfolio.pk].cash
+        Portfolio.objects.bulk_update(portfolios, ["cash_balance"])
+        RestingOrder.objects.bulk_update(orders, ["status", "fill_price", "error", "closed_on"])
+    return filled, rejected
+
+
+# Order book of this process
+order_book = OrderBook()
@@ -0,0 +1,247 @@
+from decimal import Decimal
+from .models import (
+    Holding,
+    Option,
+    Transaction,
+    TRANSACTION_TYPE_BUY,
+    TRANSACTION_TYPE_SELL,
+    OPTION_TYPE_CALL,
+    OPTION_TYPE_PUT,
+    CENTS,
+    contract_ask_price,
+    contract_bid_price,
+    parse_contract,
+    quote_ask_price,
+    quote_bid_price,
+    to_decimal,
+)
+from .journal import journal
+from .quotes import QUOTE_MAX_STALE_TRADE, get_quotes, get_option_chains
+
+SECURITY_TYPE_STOCK = "stock"
+SECURITY_TYPE_OPTION = "option"
+ORDER_FILLED = "filled"
+ORDER_REJECTED = "rejected"
+# Orders of an all-or-nothing batch that were not executed because another order was rejected
+ORDER_CANCELLED = "cancelled"
+# Rows written per statement when saving positions
+POSITIONS_BATCH_SIZE = 500
+
+
+class Order:
+    """
+    Order is one stock or option order of a batch: a positive quantity buys, a negative one sells.
+    Executing the batch fills in its status, its price and, when rejected, the error.
+    """
+
+    def __init__(self, security_type, symbol, quantity):
+        self.security_type = security_type
+        self.symbol = symbol
+        self.quantity = quantity
+        self.status = None
+        self.price = None
+        self.error = None
+
+    def is_buy(self):
+        """
+        Whether the order buys rather than sells
+        """
+        return self.quantity > 0
+
+    def reject(self, error):
+        """
+        reject marks the order as rejected for the given reason
+        Returns: N/A
+        """
+        print(error)
+        self.status = ORDER_REJECTED
+        self.error = error
+
+    def to_result(self):
+        """
+        to_result describes the outcome of the order
+        Returns: dict
+        """
+        return {
+            "securityType": self.security_type,
+            "symbol": self.symbol,
+            "quantity": self.quantity,
+            "status": self.status,
+            "price": self.price,
+            "error": self.error,
+        }
+
+
+def _check(order):
+    """
+    _check rejects orders that can never be executed, whatever the prices and positions
+    """
+    if order.security_type not in (SECURITY_TYPE_STOCK, SECURITY_TYPE_OPTION):
+        order.reject(f"Option type {order.security_type} is not supported.")
+    elif not order.symbol:
+        order.reject("Order has no ticker or contract.")
+    elif not isinstance(order.quantity, (int, float)) or order.quantity == 0:
+        order.reject(f"Order for {order.symbol} must have a nonzero quantity.")
+    elif order.security_type == SECURITY_TYPE_OPTION:
+        underlying, expiration_date, option_type, _ = parse_contract(order.symbol)
+        if expiration_date is None or option_type not in ('C', 'P'):
+            order.reject(f"Contract {order.symbol} is not currently available.")
+
+
+def price_orders(orders):
+    """
+    price_orders prices every order at its immediate execution price (ask to buy, bid to sell),
+    with one batched quote lookup for all stocks and one batched download of all option chains
+    Returns: N/A
+    """
+    stocks = [o for o in orders if o.status is None and o.security_type == SECURITY_TYPE_STOCK]
+    options = [o for o in orders if o.status is None and o.security_type == SECURITY_TYPE_OPTION]
+    quotes = get_quotes([o.symbol for o in stocks], max_stale=QUOTE_MAX_STALE_TRADE) if stocks else {}
+    for order in stocks:
+        info = quotes.get(str(order.symbol), {})
+        order.price = quote_ask_price(info) if order.is_buy() else quote_bid_price(info)
+        if order.price is None:
+            order.reject(f"Ticker {order.symbol} is not currently traded.")
+    keys = {}
+    for order in options:
+        underlying, expiration_date, option_type, _ = parse_contract(order.symbol)
+        keys[order] = ((underlying, str(expiration_date)), option_type)
+    chains = {}
+    if options:
+        chains = get_option_chains({key for key, _ in keys.values()}, max_stale=QUOTE_MAX_STALE_TRADE)
+    for order in options:
+        key, option_type = keys[order]
+        chain = chains.get(key)
+        info = chain.get(order.symbol, option_type) if chain is not None else None
+        order.price = contract_ask_price(info) if order.is_buy() else contract_bid_price(info)
+        if order.price is None:
+            order.reject(f"Contract {order.symbol} is not currently available.")
+
+
+class Positions:
+    """
+    Positions holds the stock and option positions of a locked portfolio in memory while orders
+    are applied to them; save_positions writes the result back with a few bulk statements
+    """
+
+    def __init__(self, portfolio, cash, holdings=None, options=None):
+        """
+        holdings and options are the rows of the portfolio when already loaded, else they are read
+        """
+        if holdings is None:
+            holdings = Holding.objects.filter(portfolio=portfolio)
+        if options is None:
+            options = Option.objects.filter(portfolio=portfolio)
+        self.portfolio = portfolio
+        self.cash = cash
+        self.rows = {
+            SECURITY_TYPE_STOCK: {h.ticker: h for h in holdings},
+            SECURITY_TYPE_OPTION: {o.contract: o for o in options},
+        }
+        self.created = set()
+        self.changed = set()
+        self.transactions = []
+
+    def _amount(self, row, security_type):
+        amount = row.shares if security_type == SECURITY_TYPE_STOCK else row.quantity
+        return Decimal(0) if amount is None else Decimal(amount)
+
+    def apply(self, order):
+        """
+        apply executes order against the positions and cash, or rejects it leaving them unchanged
+        Returns: N/A
+        """
+        rows = self.rows[order.security_type]
+        row = rows.get(order.symbol)
+        quantity = to_decimal(abs(order.quantity))
+        cost = (to_decimal(order.price) * quantity).quantize(CENTS)
+        noun = "shares" if order.security_type == SECURITY_TYPE_STOCK else "options"
+        if order.is_buy():
+            if self.cash < cost:
+                order.reject(f"Not enough cash to buy ${cost} in {quantity} {noun} of {order.symbol}.")
+                return
+            if row is None:
+                if order.security_type == SECURITY_TYPE_STOCK:
+                    row = Holding(portfolio=self.portfolio, ticker=order.symbol, shares=0)
+                else:
+                    row = Option(portfolio=self.portfolio, contract=order.symbol, quantity=0)
+                    row.parse_contract()
+                rows[order.symbol] = row
+                self.created.add(row)
+            amount = self._amount(row, order.security_type) + quantity
+            self.cash -= cost
+        else:
+            if row is None or self._amount(row, order.security_type) < quantity:
+                order.reject(f"Not enough {noun} of {order.symbol} to sell {quantity}.")
+                return
+            amount = self._amount(row, order.security_type) - quantity
+            self.cash += cost
+        if order.security_type == SECURITY_TYPE_STOCK:
+            row.shares = amount
+        else:
+            row.quantity = amount
+        self.changed.add(row)
+        order.status = ORDER_FILLED
+        self.transactions.append(Transaction(
+            portfolio=self.portfolio,
+            ticker=order.symbol,
+            trade_type=self._trade_type(order),
+            shares=quantity,
+            bought_price=to_decimal(order.price),
+        ))
+
+    def _trade_type(self, order):
+        trade_type = TRANSACTION_TYPE_BUY if order.is_buy() else TRANSACTION_TYPE_SELL
+        if order.security_type == SECURITY_TYPE_OPTION:
+            trade_type += OPTION_TYPE_CALL if parse_contract(order.symbol)[2] == 'C' else OPTION_TYPE_PUT
+        return trade_type
+
+
+def save_positions(positions, batch_size=POSITIONS_BATCH_SIZE):
+    """
+    save_positions writes every changed position of several Positions, one bulk statement per kind
+    of change and batch of rows, and appends their transactions to the journal
+    Returns: N/A
+    """
+    changed = [row for p in positions for row in p.changed]
+    created = set(row for p in positions for row in p.created)
+    for model, field in ((Holding, "shares"), (Option, "quantity")):
+        rows = [row for row in changed if isinstance(row, model)]
+        emptied = [row.pk for row in rows if getattr(row, field) == 0 and row not in created]
+        new = [row for row in rows if getattr(row, field) != 0 and row in created]
+        kept = [row for row in rows if getattr(row, field) != 0 and row not in created]
+        for i in range(0, len(emptied), batch_size):
+            model.objects.filter(pk__in=emptied[i:i + batch_size]).delete()
+        if new:
+            model.objects.bulk_create(new, batch_size=batch_size)
+        if kept:
+            model.objects.bulk_update(kept, [field], batch_size=batch_size)
+    journal.record(t for p in positions for t in p.transactions)
+
+
+def execute_orders(portfolio, orders, all_or_nothing=True):
+    """
+    execute_orders executes a batch of stock and option orders on portfolio in one database transaction,
+    holding the portfolio lock. All orders are priced up front from one batch of quotes and chains; sells
+    are applied before buys so that their proceeds can fund the buys, and cash is checked across the whole
+    batch. In all-or-nothing mode one rejected order cancels the batch; otherwise the other orders still
+    execute.
+    Returns: list of orders, with their status, price and error filled in
+    """
+    for order in orders:
+        _check(order)
+    price_orders(orders)
+    with journal.atomic():
+        locked = portfolio.lock()
+        positions = Positions(portfolio, locked.cash_balance)
+        for order in sorted(orders, key=lambda o: o.is_buy() if o.status is None else True):
+            if order.status is None:
+                positions.apply(order)
+        if all_or_nothing and any(order.status == ORDER_REJECTED for order in orders):
+            for order in orders:
+                if order.status == ORDER_FILLED:
+                    order.status = ORDER_CANCELLED
+            return orders
+        save_positions([positions])
+        portfolio.apply_trade(locked, positions.cash - locked.cash_balance)
+    return orders
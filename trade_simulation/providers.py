@@ -0,0 +1,212 @@
+import json
+from abc import ABC, abstractmethod
+import os
+import requests
+from threading import Lock
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from pandas import DataFrame
+from yfinance import Ticker
+from yfinance.utils import user_agent_headers
+from .chains import OptionChain
+from .fetching import fetch_concurrently, FetchError
+
+DEFAULT_MARKET_DATA_PROVIDER = "trade_simulation.providers.YFinanceProvider"
+# Yahoo Finance endpoint returning bid/ask/regularMarketPrice for many symbols at once
+QUOTE_BATCH_URL = "https://query2.finance.yahoo.com/v7/finance/quote"
+QUOTE_BATCH_TIMEOUT = 10
+# Maximum number of symbols requested from the quote endpoint in one call
+QUOTE_BATCH_SIZE = 100
+REPLAY_QUOTES_FILE = "quotes.json"
+REPLAY_CHAINS_DIR = "chains"
+
+
+def _merge(dicts):
+    merged = {}
+    for d in dicts:
+        merged.update(d)
+    return merged
+
+
+class MarketDataProvider(ABC):
+    """
+    MarketDataProvider is the interface the models use to get stock quotes and option chains
+    """
+
+    @abstractmethod
+    def get_quote(self, ticker):
+        """
+        get_quote fetches the stock info for one ticker
+        Returns: dict with stock info (empty if ticker is unknown)
+        """
+
+    def get_quotes(self, tickers):
+        """
+        get_quotes fetches the stock info for a batch of tickers, one concurrent lookup per ticker
+        Returns: dict mapping ticker to its stock info, or FetchError if some lookups failed
+        """
+        return fetch_concurrently(self.get_quote, tickers)
+
+    @abstractmethod
+    def get_option_chain(self, ticker, expdate):
+        """
+        get_option_chain fetches the option chain of ticker expiring on expdate (YYYY-MM-DD)
+        Returns: OptionChain or ValueError if no such chain exists
+        """
+
+    def get_option_chains(self, keys):
+        """
+        get_option_chains fetches several option chains, one concurrent download per (ticker, expdate) key
+        Returns: dict mapping key to OptionChain, or FetchError if some downloads failed
+        """
+        return fetch_concurrently(lambda key: self.get_option_chain(*key), keys)
+
+
+class YFinanceProvider(MarketDataProvider):
+    """
+    YFinanceProvider gets live market data from Yahoo Finance
+    """
+
+    def __init__(self, timeout=QUOTE_BATCH_TIMEOUT):
+        self.timeout = timeout
+
+    def get_quote(self, ticker):
+        return Ticker(str(ticker)).info
+
+    def get_quotes(self, tickers):
+        # One HTTP call per QUOTE_BATCH_SIZE tickers instead of one Ticker(...).info per ticker,
+        # with the batches themselves fetched concurrently
+        batches = [tuple(tickers[i:i + QUOTE_BATCH_SIZE]) for i in range(0, len(tickers), QUOTE_BATCH_SIZE)]
+        try:
+            results = fetch_concurrently(self._get_quote_batch, batches)
+        except FetchError as e:
+            errors = {ticker: error for batch, error in e.errors.items() for ticker in batch}
+            raise FetchError(errors, _merge(e.results.values()))
+        return _merge(results.values())
+
+    def _get_quote_batch(self, tickers):
+        response = requests.get(
+            QUOTE_BATCH_URL,
+            params={"symbols": ",".join(tickers)},
+            headers=user_agent_headers,
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        results = response.json().get("quoteResponse", {}).get("result") or []
+        return {info.get("symbol"): info for info in results}
+
+    def get_option_chain(self, ticker, expdate):
+        return OptionChain.from_yfinance(Ticker(str(ticker)).option_chain(date=expdate))
+
+
+class ReplayProvider(MarketDataProvider):
+    """
+    ReplayProvider serves market data recorded to local files, so that trading and ranking
+    can run without network access. The recording directory holds quotes.json, mapping
+    ticker to stock info, and chains/<TICKER>/<YYYY-MM-DD>.json with the calls and puts
+    of each option chain as lists of records.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._quotes = None
+        self._lock = Lock()
+
+    def _quotes_path(self):
+        return os.path.join(self.path, REPLAY_QUOTES_FILE)
+
+    def _chain_path(self, ticker, expdate):
+        return os.path.join(self.path, REPLAY_CHAINS_DIR, str(ticker), f"{expdate}.json")
+
+    def _load_quotes(self):
+        with self._lock:
+            if self._quotes is None:
+                try:
+                    with open(self._quotes_path()) as f:
+                        self._quotes = json.load(f)
+                except FileNotFoundError:
+                    self._quotes = {}
+            return self._quotes
+
+    def get_quote(self, ticker):
+        return dict(self._load_quotes().get(str(ticker), {}))
+
+    def get_option_chain(self, ticker, expdate):
+        try:
+            with open(self._chain_path(ticker, expdate)) as f:
+                chain = json.load(f)
+        except FileNotFoundError:
+            raise ValueError(f"No recorded option chain for {ticker} expiring {expdate}.")
+        return OptionChain(
+            DataFrame.from_records(chain.get("calls", []), columns=chain.get("columns")),
+            DataFrame.from_records(chain.get("puts", []), columns=chain.get("columns")),
+        )
+
+    def record_quotes(self, quotes):
+        """
+        record_quotes adds stock info to the recording, replacing earlier quotes for the same tickers
+        Returns: N/A
+        """
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            try:
+                with open(self._quotes_path()) as f:
+                    recorded = json.load(f)
+            except FileNotFoundError:
+                recorded = {}
+            recorded.update(quotes)
+            with open(self._quotes_path(), "w") as f:
+                json.dump(recorded, f, default=str)
+            self._quotes = recorded
+
+    def record_option_chain(self, ticker, expdate, calls, puts):
+        """
+        record_option_chain writes the calls and puts DataFrames of a yfinance option chain
+        to the recording
+        Returns: N/A
+        """
+        path = self._chain_path(ticker, expdate)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "columns": list(calls.columns),
+                    "calls": calls.to_dict(orient="records"),
+                    "puts": puts.to_dict(orient="records"),
+                },
+                f,
+                default=str,
+            )
+
+
+_provider = None
+_provider_lock = Lock()
+
+
+def get_provider():
+    """
+    get_provider builds the market data provider selected by the MARKET_DATA_PROVIDER setting,
+    passing MARKET_DATA_PROVIDER_OPTIONS as keyword arguments
+    Returns: MarketDataProvider shared by the whole process
+    """
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            provider_class = import_string(
+                getattr(settings, "MARKET_DATA_PROVIDER", DEFAULT_MARKET_DATA_PROVIDER)
+            )
+            _provider = provider_class(**getattr(settings, "MARKET_DATA_PROVIDER_OPTIONS", {}))
+        return _provider
+
+
+@receiver(setting_changed)
+def _reset_provider(setting, **kwargs):
+    """
+    Rebuild the provider on next use when its settings are overridden (e.g. in tests)
+    """
+    global _provider
+    if setting in ("MARKET_DATA_PROVIDER", "MARKET_DATA_PROVIDER_OPTIONS"):
+        with _provider_lock:
+            _provider = None
@@ -0,0 +1,348 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from threading import Lock
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from .cache import TTLCache
+from .fetching import fetch_concurrently, FetchError, CircuitBreaker, CircuitOpenError
+from .providers import get_provider
+
+DEFAULT_QUOTE_CACHE_TTL = 60
+DEFAULT_QUOTE_CACHE_SIZE = 2048
+DEFAULT_OPTION_CHAIN_CACHE_TTL = 300
+DEFAULT_OPTION_CHAIN_CACHE_SIZE = 128
+DEFAULT_QUOTE_MAX_STALE_VALUATION = 900
+DEFAULT_QUOTE_MAX_STALE_TRADE = 15
+DEFAULT_QUOTE_BREAKER_FAILURE_THRESHOLD = 5
+DEFAULT_QUOTE_BREAKER_RESET_TIMEOUT = 30
+# Threads revalidating stale quotes in the background, apart from the fetch pool they submit to
+QUOTE_REVALIDATE_WORKERS = 2
+
+QUOTE_MAX_STALE_VALUATION = getattr(settings, "QUOTE_MAX_STALE_VALUATION", DEFAULT_QUOTE_MAX_STALE_VALUATION)
+QUOTE_MAX_STALE_TRADE = getattr(settings, "QUOTE_MAX_STALE_TRADE", DEFAULT_QUOTE_MAX_STALE_TRADE)
+
+# Process-wide cache of stock info dicts keyed by ticker. Expired quotes are kept long enough
+# to be served to readers that accept stale prices while they are revalidated.
+quote_cache = TTLCache(
+    ttl=getattr(settings, "QUOTE_CACHE_TTL", DEFAULT_QUOTE_CACHE_TTL),
+    maxsize=getattr(settings, "QUOTE_CACHE_SIZE", DEFAULT_QUOTE_CACHE_SIZE),
+    stale_ttl=max(QUOTE_MAX_STALE_VALUATION, QUOTE_MAX_STALE_TRADE),
+)
+
+# Process-wide cache of downloaded option chains keyed by (underlying, expiration date). Expired
+# chains are kept, like quotes, to be served when downloading them again fails.
+chain_cache = TTLCache(
+    ttl=getattr(settings, "OPTION_CHAIN_CACHE_TTL", DEFAULT_OPTION_CHAIN_CACHE_TTL),
+    maxsize=getattr(settings, "OPTION_CHAIN_CACHE_SIZE", DEFAULT_OPTION_CHAIN_CACHE_SIZE),
+    stale_ttl=max(QUOTE_MAX_STALE_VALUATION, QUOTE_MAX_STALE_TRADE),
+)
+
+# Stops calling the market data provider while it keeps failing
+provider_breaker = CircuitBreaker(
+    failure_threshold=getattr(settings, "QUOTE_BREAKER_FAILURE_THRESHOLD", DEFAULT_QUOTE_BREAKER_FAILURE_THRESHOLD),
+    reset_timeout=getattr(settings, "QUOTE_BREAKER_RESET_TIMEOUT", DEFAULT_QUOTE_BREAKER_RESET_TIMEOUT),
+)
+
+_revalidator = None
+_revalidating = set()
+_revalidate_lock = Lock()
+
+
+def _snapshot_model():
+    # Imported lazily because the models module imports this one
+    from .models import QuoteSnapshot
+    return QuoteSnapshot
+
+
+def _load_snapshots(tickers, max_age=None):
+    snapshots = _snapshot_model().objects.filter(symbol__in=list(tickers))
+    now = timezone.now()
+    if max_age is not None:
+        snapshots = snapshots.filter(fetched_on__gte=now - timedelta(seconds=max_age))
+    return {
+        snapshot.symbol: (snapshot.to_info(), max(0.0, (now - snapshot.fetched_on).total_seconds()))
+        for snapshot in snapshots
+    }
+
+
+def load_snapshots(tickers, max_age=None):
+    """
+    load_snapshots reads the last known quotes of tickers from the QuoteSnapshot table,
+    skipping snapshots older than max_age seconds if given
+    Returns: dict mapping ticker to its stock info
+    """
+    return {ticker: info for ticker, (info, _) in _load_snapshots(tickers, max_age).items()}
+
+
+def _fetch_quotes(tickers, fetch):
+    """
+    _fetch_quotes runs the provider call fetch(tickers) through the circuit breaker, records what
+    it got as snapshots and in the quote cache
+    Returns: dict mapping ticker to its stock info, or to the exception its fetch failed with
+    """
+    try:
+        fetched, failed = provider_breaker.call(lambda: fetch(tickers)), {}
+    except FetchError as e:
+        fetched, failed = e.results, e.errors
+    except Exception as e:
+        fetched, failed = {}, {ticker: e for ticker in tickers}
+    # Unknown tickers are cached as empty info, like a single-ticker lookup would return
+    quotes = {ticker: fetched.get(ticker) or {} for ticker in tickers if ticker not in failed}
+    if quotes:
+        _snapshot_model().bulk_upsert(quotes)
+    for ticker, info in quotes.items():
+        quote_cache.set(ticker, info)
+    quotes.update(failed)
+    return quotes
+
+
+def _fetch_single_quotes(tickers):
+    return fetch_concurrently(get_provider().get_quote, tickers)
+
+
+def _fetch_batch_quotes(tickers):
+    return fetch_quotes(tickers)
+
+
+def _refresh(tickers, max_stale, fetch, skip_failed=False):
+    """
+    _refresh fetches tickers, sharing fetches already in flight on other threads. Tickers the
+    provider fails on are served from the cache or their last snapshot if no older than max_stale
+    seconds past the quote TTL.
+    Returns: dict mapping ticker to its stock info, or the exception of a ticker with no fallback;
+    such tickers are left out instead when skip_failed
+    """
+    results = quote_cache.flight.do_many(tickers, lambda owned: _fetch_quotes(owned, fetch))
+    quotes = {ticker: info for ticker, info in results.items() if not isinstance(info, Exception)}
+    failed = {ticker: error for ticker, error in results.items() if isinstance(error, Exception)}
+    if failed:
+        stale = {}
+        for ticker in failed:
+            info, _ = quote_cache.get_stale(ticker, max_stale, count=False)
+            if info is not None:
+                stale[ticker] = info
+        unknown = [ticker for ticker in failed if ticker not in stale]
+        if unknown:
+            stale.update(load_snapshots(unknown, max_age=quote_cache.ttl + max_stale))
+        unpriced = [ticker for ticker in failed if ticker not in stale]
+        if unpriced and not skip_failed:
+            raise failed[unpriced[0]]
+        if stale:
+            print(f"Serving last known quotes for {', '.join(stale)}: {next(iter(failed.values()))}")
+        if unpriced:
+            print(f"Could not price {', '.join(unpriced)}: {failed[unpriced[0]]}")
+        quotes.update(stale)
+    return quotes
+
+
+def _get_quotes(tickers, max_stale, fetch, skip_failed=False):
+    """
+    _get_quotes serves tickers from the quote cache, then from snapshots, accepting prices up to
+    max_stale seconds past the quote TTL. Stale prices are returned right away and revalidated
+    in the background; only tickers with no usable price wait on the provider.
+    Returns: dict mapping ticker to its stock info, leaving out tickers the provider failed on
+    when skip_failed
+    """
+    quotes = {}
+    stale = []
+    missing = []
+    for ticker in tickers:
+        info, fresh = quote_cache.get_stale(ticker, max_stale)
+        if info is None:
+            missing.append(ticker)
+        else:
+            quotes[ticker] = info
+            if not fresh:
+                stale.append(ticker)
+    if missing:
+        for ticker, (info, age) in _load_snapshots(missing, max_age=quote_cache.ttl + max_stale).items():
+            quote_cache.set(ticker, info, age=age)
+            quotes[ticker] = info
+            if age >= quote_cache.ttl:
+                stale.append(ticker)
+        missing = [ticker for ticker in missing if ticker not in quotes]
+    if stale:
+        _revalidate(stale, fetch)
+    if missing:
+        quotes.update(_refresh(missing, max_stale, fetch, skip_failed))
+    return quotes
+
+
+def _revalidate(tickers, fetch):
+    """
+    _revalidate schedules a background refresh of stale tickers, skipping those already scheduled
+    Returns: N/A
+    """
+    global _revalidator
+    with _revalidate_lock:
+        tickers = [ticker for ticker in tickers if ticker not in _revalidating]
+        if not tickers:
+            return
+        _revalidating.update(tickers)
+        if _revalidator is None:
+            # Kept apart from the fetch pool, which revalidations wait on
+            _revalidator = ThreadPoolExecutor(
+                max_workers=QUOTE_REVALIDATE_WORKERS, thread_name_prefix="quote-revalidate"
+            )
+    _revalidator.submit(_run_revalidation, tickers, fetch)
+
+
+def _run_revalidation(tickers, fetch):
+    try:
+        results = quote_cache.flight.do_many(tickers, lambda owned: _fetch_quotes(owned, fetch))
+        failed = [ticker for ticker, info in results.items() if isinstance(info, Exception)]
+        if failed:
+            print(f"Could not revalidate quotes for {', '.join(failed)}: {results[failed[0]]}")
+    except Exception as e:
+        print(f"Error occurs when revalidating quotes: {e}")
+    finally:
+        with _revalidate_lock:
+            _revalidating.difference_update(tickers)
+        # This thread is not managed by Django, so its connections are not closed for it
+        connections.close_all()
+
+
+def get_quote(ticker, max_stale=None):
+    """
+    get_quote returns the stock info for ticker, accepting a price at most max_stale seconds
+    past the quote TTL (QUOTE_MAX_STALE_TRADE by default, as trades execute at this price)
+    Returns: dict with stock info
+    """
+    if max_stale is None:
+        max_stale = QUOTE_MAX_STALE_TRADE
+    ticker = str(ticker)
+    return _get_quotes([ticker], max_stale, _fetch_single_quotes)[ticker]
+
+
+def fetch_quotes(tickers):
+    """
+    fetch_quotes asks the market data provider for a whole batch of tickers in one call
+    Returns: dict mapping ticker to its stock info
+    """
+    if not tickers:
+        return {}
+    return get_provider().get_quotes(tickers)
+
+
+def get_quotes(tickers, max_stale=None, skip_failed=False):
+    """
+    get_quotes returns the stock info for every ticker, accepting prices at most max_stale seconds
+    past the quote TTL (QUOTE_MAX_STALE_VALUATION by default) and fetching all remaining misses
+    in a single batch. A ticker the provider fails on with no usable price raises its error, or is
+    left out when skip_failed.
+    Returns: dict mapping ticker to its stock info
+    """
+    if max_stale is None:
+        max_stale = QUOTE_MAX_STALE_VALUATION
+    return _get_quotes(sorted(set(str(t) for t in tickers)), max_stale, _fetch_batch_quotes, skip_failed)
+
+
+def refresh_quotes(tickers, max_stale=None, skip_failed=False):
+    """
+    refresh_quotes fetches fresh stock info for all tickers in one batch, stores it as snapshots
+    and in the quote cache. Tickers already being fetched by another thread are not fetched
+    again; their in-flight result is shared instead. A ticker the provider fails on with no
+    usable price raises its error, or is left out when skip_failed.
+    Returns: dict mapping ticker to its stock info
+    """
+    if max_stale is None:
+        max_stale = QUOTE_MAX_STALE_VALUATION
+    tickers = sorted(set(str(t) for t in tickers))
+    return _refresh(tickers, max_stale, _fetch_batch_quotes, skip_failed)
+
+
+def get_option_chain(ticker, expdate):
+    """
+    get_option_chain returns the option chain of ticker expiring on expdate (YYYY-MM-DD),
+    downloading it at most once per TTL window for all contracts on that chain. The download
+    is bounded by QUOTE_FETCH_TIMEOUT, like every other market data fetch, and a chain that
+    fails to download is served from the cache if it expired at most QUOTE_MAX_STALE_TRADE ago.
+    Returns: indexed OptionChain or ValueError if no such chain exists
+    """
+    key = (str(ticker), expdate)
+    chain = get_option_chains([key], max_stale=QUOTE_MAX_STALE_TRADE).get(key)
+    if chain is None:
+        raise ValueError(f"No option chain for {ticker} with expiration date {expdate}.")
+    return chain
+
+
+def refresh_option_chains(keys):
+    """
+    refresh_option_chains downloads the option chains for several (ticker, expdate) keys concurrently
+    and stores them in the option chain cache. Chains that do not exist or fail to download are left out.
+    Returns: dict mapping key to indexed OptionChain
+    """
+    keys = sorted(set((str(ticker), expdate) for ticker, expdate in keys))
+    if not keys:
+        return {}
+    # Chains already being downloaded by another thread are shared rather than downloaded again
+    chains = chain_cache.flight.do_many(keys, _fetch_option_chains)
+    return {key: chain for key, chain in chains.items() if chain is not None and not isinstance(chain, Exception)}
+
+
+def _fetch_option_chains(keys):
+    """
+    _fetch_option_chains downloads option chains through the circuit breaker and stores them in the
+    option chain cache
+    Returns: dict mapping key to its OptionChain, or to the exception its download failed with;
+    chains that do not exist are left out
+    """
+    try:
+        provider_breaker.allow()
+    except CircuitOpenError as e:
+        print(f"Could not fetch option chains: {e}")
+        return {key: e for key in keys}
+    errors = {}
+    try:
+        chains = get_provider().get_option_chains(keys)
+        provider_breaker.record_success()
+    except FetchError as e:
+        chains, errors = dict(e.results), e.errors
+        # Missing chains are not provider failures
+        if all(isinstance(error, ValueError) for error in e.errors.values()):
+            provider_breaker.record_success()
+        else:
+            provider_breaker.record_failure()
+        for (ticker, expdate), error in e.errors.items():
+            print(f"Could not fetch option chain for {ticker} with expiration date {expdate}: {error}")
+    except BaseException:
+        provider_breaker.record_failure()
+        raise
+    for key, chain in chains.items():
+        chain_cache.set(key, chain)
+    chains.update((key, error) for key, error in errors.items() if not isinstance(error, ValueError))
+    return chains
+
+
+def get_option_chains(keys, max_stale=None):
+    """
+    get_option_chains returns the option chains for several (ticker, expdate) keys, downloading
+    all cache misses concurrently. Chains that fail to download are served from the cache if they
+    expired at most max_stale seconds ago (QUOTE_MAX_STALE_VALUATION by default).
+    Returns: dict mapping key to indexed OptionChain, or the exception of a chain with no fallback
+    """
+    if max_stale is None:
+        max_stale = QUOTE_MAX_STALE_VALUATION
+    chains = {}
+    missing = []
+    for key in set((str(ticker), expdate) for ticker, expdate in keys):
+        chain = chain_cache.get(key)
+        if chain is None:
+            missing.append(key)
+        else:
+            chains[key] = chain
+    if missing:
+        results = chain_cache.flight.do_many(sorted(missing), _fetch_option_chains)
+        failed = {key: error for key, error in results.items() if isinstance(error, Exception)}
+        for key, error in failed.items():
+            chain, _ = chain_cache.get_stale(key, max_stale, count=False)
+            if chain is None:
+                # Pricing its contracts at nothing would pass for a loss
+                raise error
+            results[key] = chain
+        if failed:
+            names = ", ".join(f"{ticker} {expdate}" for ticker, expdate in failed)
+            print(f"Serving last known option chains for {names}: {next(iter(failed.values()))}")
+        chains.update((key, chain) for key, chain in results.items() if chain is not None)
+    return chains
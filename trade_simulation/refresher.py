@@ -0,0 +1,105 @@
+from threading import Event, Thread
+from django.conf import settings
+from django.db import close_old_connections
+from .models import Holding, Option, live_options
+from .quotes import refresh_quotes, refresh_option_chains
+from .standings import refresh_standings
+from .history import roll_up_history
+from .orderbook import order_book
+
+DEFAULT_QUOTE_REFRESH_INTERVAL = 30
+
+
+def held_tickers():
+    """
+    held_tickers finds every distinct ticker held by any portfolio
+    Returns: list of tickers
+    """
+    return list(Holding.objects.order_by().values_list("ticker", flat=True).distinct())
+
+
+def held_option_chains():
+    """
+    held_option_chains finds every distinct (underlying, expiration date) option chain
+    that a live held contract belongs to
+    Returns: sorted list of (ticker, YYYY-MM-DD) tuples
+    """
+    chains = (
+        live_options(Option.objects.filter(contract_type__in=('C', 'P')))
+        .order_by()
+        .values_list("underlying", "expiration_date")
+        .distinct()
+    )
+    return sorted((ticker, str(expiration)) for ticker, expiration in chains)
+
+
+class QuoteRefresher:
+    """
+    QuoteRefresher periodically re-prices every ticker and option chain currently held,
+    so that request handlers read warm prices from the shared caches, then re-ranks games
+    whose stored standings are stale
+    """
+
+    def __init__(self, interval=None):
+        if interval is None:
+            interval = getattr(settings, "QUOTE_REFRESH_INTERVAL", DEFAULT_QUOTE_REFRESH_INTERVAL)
+        self.interval = float(interval)
+        self._stop = Event()
+        self._thread = None
+
+    def refresh_once(self):
+        """
+        refresh_once fetches all held tickers and tickers with resting orders in one batch, fills the
+        resting orders the new prices trigger, and downloads each held option chain once, concurrently
+        Returns: tuple of (number of tickers refreshed, number of chains refreshed)
+        """
+        order_book.sync()
+        # Tickers with resting orders are priced too, so that orders trigger on fresh prices
+        tickers = sorted(set(held_tickers()) | set(order_book.tickers()))
+        if tickers:
+            # A ticker the provider fails on only holds back its own orders
+            filled, rejected = order_book.match(refresh_quotes(tickers, skip_failed=True))
+            if filled or rejected:
+                print(f"Filled {filled} resting orders and rejected {rejected}.")
+        chains = refresh_option_chains(held_option_chains())
+        return len(tickers), len(chains)
+
+    def run(self):
+        """
+        run refreshes prices every interval seconds until stop() is called
+        Returns: N/A
+        """
+        while not self._stop.is_set():
+            try:
+                # Drops a connection the database closed, which would otherwise fail every later cycle
+                close_old_connections()
+                tickers, chains = self.refresh_once()
+                print(f"Refreshed {tickers} tickers and {chains} option chains.")
+                # Prices are warm now, so stale standings are cheap to recompute
+                games = refresh_standings()
+                if games:
+                    print(f"Ranked {games} games.")
+                roll_up_history()
+            except Exception as e:
+                # A failed cycle must not kill the worker; the next cycle retries
+                print(f"Error occurs when refreshing quotes: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """
+        start runs the refresher in a background daemon thread
+        Returns: N/A
+        """
+        self._stop.clear()
+        self._thread = Thread(target=self.run, name="quote-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        stop asks the refresher to exit after the current cycle
+        Returns: N/A
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,112 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import (
+    Option,
+    Portfolio,
+    Transaction,
+    OPTION_TYPE_CALL,
+    OPTION_TYPE_PUT,
+    REGULAR_SHARES,
+    CENTS,
+)
+from .quotes import get_quotes
+
+TRANSACTION_TYPE_SETTLE = "SETTLE"
+# Rows deleted or inserted per statement when settling expired options
+SETTLEMENT_BATCH_SIZE = 500
+
+
+def quote_settlement_price(stock_info):
+    """
+    quote_settlement_price reads the price expired options on a stock settle against
+    Returns: price of stock or None if not traded
+    """
+    price = stock_info.get("regularMarketPrice")
+    if price is None:
+        price = stock_info.get("bid")
+    return price
+
+
+def intrinsic_value(option_type, strike, price):
+    """
+    intrinsic_value computes what one share of an option is worth when exercised at price
+    Returns: Decimal value per share, 0 for out of the money or unknown option types
+    """
+    if option_type == 'C':
+        return max(Decimal(0), price - strike)
+    if option_type == 'P':
+        return max(Decimal(0), strike - price)
+    return Decimal(0)
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def settle_expired_options(as_of=None, batch_size=SETTLEMENT_BATCH_SIZE):
+    """
+    settle_expired_options cash-settles every option that expired before as_of (today by default).
+    In-the-money contracts pay their intrinsic value against one snapshot of underlying prices into
+    the cash balance of their portfolio; all settled contracts are deleted and recorded as SETTLE
+    transactions. Calls and puts whose underlying has no price are left for a later sweep.
+    Returns: tuple of (number of in-the-money contracts, number of worthless contracts, number left unsettled)
+    """
+    if as_of is None:
+        as_of = timezone.localdate()
+    expired = Option.objects.filter(expiration_date__lt=as_of).order_by()
+    underlyings = list(
+        expired.filter(contract_type__in=('C', 'P')).values_list("underlying", flat=True).distinct()
+    )
+    # Fetched before locking any rows so no lock is held while waiting on the provider. Underlyings
+    # the provider fails on are left out, so only their options wait for a later sweep.
+    prices = {}
+    for ticker, info in get_quotes(underlyings, skip_failed=True).items():
+        price = quote_settlement_price(info)
+        if price is not None:
+            prices[ticker] = Decimal(str(price))
+
+    in_the_money = worthless = unpriced = 0
+    with transaction.atomic():
+        settled = []
+        credits = defaultdict(Decimal)
+        transactions = []
+        options = expired.select_for_update().values_list(
+            "uid", "portfolio_id", "contract", "underlying", "contract_type", "strike", "quantity"
+        )
+        for uid, portfolio_id, contract, underlying, option_type, strike, quantity in options:
+            quantity = quantity or Decimal(0)
+            value = Decimal(0)
+            if option_type in ('C', 'P'):
+                if underlying not in prices or strike is None:
+                    unpriced += 1
+                    continue
+                value = intrinsic_value(option_type, strike, prices[underlying])
+            # Price of one contract, like the prices recorded when options are bought and sold
+            contract_price = (value * Decimal(REGULAR_SHARES)).quantize(CENTS)
+            if contract_price > 0:
+                in_the_money += 1
+                if portfolio_id is not None:
+                    credits[portfolio_id] += contract_price * quantity
+            else:
+                worthless += 1
+            settled.append(uid)
+            suffix = {'C': OPTION_TYPE_CALL, 'P': OPTION_TYPE_PUT}.get(option_type, "")
+            transactions.append(Transaction(
+                portfolio_id=portfolio_id,
+                ticker=contract,
+                trade_type=TRANSACTION_TYPE_SETTLE + suffix,
+                shares=quantity,
+                bought_price=contract_price,
+            ))
+        for uids in _chunks(settled, batch_size):
+            Option.objects.filter(uid__in=uids).delete()
+        for portfolio_id, credit in credits.items():
+            Portfolio.objects.filter(pk=portfolio_id).update(
+                cash_balance=F("cash_balance") + credit.quantize(CENTS)
+            )
+        Transaction.objects.bulk_create(transactions, batch_size=batch_size)
+    return in_the_money, worthless, unpriced
@@ -0,0 +1,74 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from .broker import get_broker, publish_standings
+from .history import record_snapshots, snapshot_values
+from .leaderboard import leaderboards
+from .models import Game, Portfolio
+
+DEFAULT_GAME_STANDINGS_MAX_AGE = 60
+
+
+def standings_max_age():
+    """
+    standings_max_age reads how old stored standings may be before reads recompute them
+    Returns: seconds
+    """
+    return getattr(settings, "GAME_STANDINGS_MAX_AGE", DEFAULT_GAME_STANDINGS_MAX_AGE)
+
+
+def stale_games(games=None, max_age=None):
+    """
+    stale_games narrows games (all games by default) to those never ranked or ranked more than
+    max_age seconds ago (GAME_STANDINGS_MAX_AGE by default)
+    Returns: QuerySet of games
+    """
+    if games is None:
+        games = Game.objects.all()
+    if max_age is None:
+        max_age = standings_max_age()
+    cutoff = timezone.now() - timedelta(seconds=max_age)
+    return games.filter(Q(ranked_on__isnull=True) | Q(ranked_on__lt=cutoff))
+
+
+def refresh_standings(games=None, max_age=None):
+    """
+    refresh_standings recomputes the stored values and ranks of every game whose standings are stale,
+    then records a value snapshot of each of them with one bulk insert; max_age=0 recomputes all of them
+    Returns: number of games ranked
+    """
+    snapshots = []
+    for game in stale_games(games, max_age):
+        try:
+            snapshots.append(snapshot_values(game, game.rank_portfolios()))
+        except Exception as e:
+            # A game that cannot be priced keeps its standings until the next refresh, without holding back the others
+            print(f"Error occurs when ranking game {game.title}: {e}")
+    record_snapshots(snapshots)
+    return len(snapshots)
+
+
+def publish_trade(portfolio, previous, value):
+    """
+    publish_trade tells clients streaming the standings of portfolio's game about a trade that moved
+    its total value from previous to value. Only the portfolios worth between the two values changed
+    rank, the traded one and those it overtook or fell behind, so only they are published, with their
+    rank and value read from the in-memory leaderboard rather than by re-ranking the whole game.
+    Returns: N/A
+    """
+    game = portfolio.game
+    if game is None or not get_broker().has_subscribers(game.title):
+        return
+    try:
+        low, high = sorted((float(previous), float(value)))
+        moved = {uid: (total_value, rank) for uid, total_value, rank in leaderboards.get(game).between(low, high)}
+        if not moved:
+            return
+        portfolios = list(Portfolio.objects.filter(pk__in=list(moved)))
+        for moved_portfolio in portfolios:
+            moved_portfolio.total_value, moved_portfolio.game_rank = moved[str(moved_portfolio.pk)]
+        publish_standings(game, sorted(portfolios, key=lambda p: (p.game_rank, str(p.pk))))
+    except Exception as e:
+        # The trade itself already succeeded; the next refresh will publish the standings
+        print(f"Error occurs when publishing standings of game {game.title}: {e}")
@@ -1,8 +1,48 @@
-from datetime import datetime
-from django.test import TestCase
+from datetime import date, datetime, timedelta, timezone
+import json
+import struct
+from decimal import Decimal
+import tempfile
+import threading
+import time
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 import unittest.mock as mock
 from unittest.mock import PropertyMock
-from .models import Game, Portfolio, Holding, Option, Transaction
+from .models import (
+    Game, Portfolio, Holding, Option, Transaction, QuoteSnapshot, ValueSnapshot, RestingOrder, QueuedTrade,
+    parse_contract,
+)
+from .cache import TTLCache, SingleFlight
+from .chains import OptionChain
+from .providers import get_provider, MarketDataProvider, ReplayProvider, YFinanceProvider
+from .fetching import fetch_concurrently, FetchError, CircuitBreaker, CircuitOpenError
+from .refresher import QuoteRefresher, held_tickers, held_option_chains
+from .settlement import settle_expired_options
+from .orders import Order, execute_orders
+from .orderbook import OrderBook, order_book
+from .journal import journal
+from .tradequeue import (
+    TradeWorker, claim_trade, claim_trades, enqueue_trade, parse_trade, process_trade, requeue_stale_trades,
+    run_workers,
+)
+from .workerprocess import run_worker_process
+from .broker import LeaderboardBroker, LocalBroker, get_broker
+from .checks import check_stream_broker
+from .leaderboard import IndexableSkipList, GameLeaderboard, leaderboards
+from .history import (
+    VALUE_FORMAT, VALUE_SIZE, bucket_start, pack_values, record_snapshots, roll_up_history, snapshot_values,
+    value_series,
+)
+from .standings import refresh_standings, stale_games
+from .valuation import PortfolioValuation
+from .quotes import (
+    quote_cache, chain_cache, provider_breaker, get_quote, get_quotes, refresh_quotes, get_option_chain,
+    refresh_option_chains,
+)
 from django.contrib.auth.models import User
 from pandas import DataFrame
 from types import SimpleNamespace
@@ -14,6 +54,8 @@ TEST_PORTFOLIO_TITLE = "Test Portfolio"
 
 class GameTestCase(TestCase):
     def setUp(self):
+        quote_cache.clear()
+        provider_breaker.reset()
         # Create game
         Game.objects.create(
             title=TEST_GAME_TITLE, starting_balance=5000, rules=TEST_RULES
@@ -70,9 +112,59 @@ class GameTestCase(TestCase):
         assert leaderboard[1].game_rank == 2
         assert leaderboard[2].game_rank == 3
 
+    def test_rank_portfolios_single_update(self):
+        """
+        Test that ranking writes all changed portfolios with one UPDATE and skips unchanged ones
+        """
+        # GIVEN
+        game = Game.objects.all()[0]
+        for i in range(10):
+            Portfolio.objects.create(title=f"{TEST_PORTFOLIO_TITLE} {i}", game=game, cash_balance=i)
+        # WHEN
+        with CaptureQueriesContext(connection) as first:
+            game.rank_portfolios()
+        with CaptureQueriesContext(connection) as second:
+            leaderboard = game.rank_portfolios()
+        # THEN
+
+        def portfolio_updates(queries):
+            return [q for q in queries if q["sql"].startswith('UPDATE "trade_simulation_portfolio"')]
+        self.assertEqual(len(portfolio_updates(first.captured_queries)), 1)
+        self.assertFalse(portfolio_updates(second.captured_queries))
+        self.assertEqual([p.game_rank for p in leaderboard], list(range(1, 11)))
+        self.assertEqual(Portfolio.objects.get(title=f"{TEST_PORTFOLIO_TITLE} 9").game_rank, 1)
+
+    @mock.patch("trade_simulation.quotes.fetch_quotes")
+    def test_rank_portfolios_batched_quotes(self, mock_fetch_quotes):
+        """
+        Test that ranking a game prices all of its holdings with one batched quote fetch
+        """
+        # GIVEN
+        mock_fetch_quotes.return_value = {
+            "AAPL": {"bid": 100.0},
+            "TSLA": {"bid": 0, "regularMarketPrice": 50.0},
+        }
+        game = Game.objects.all()[0]
+        for i in range(3):
+            portfolio = Portfolio.objects.create(
+                title=f"{TEST_PORTFOLIO_TITLE} {i}", game=game, cash_balance=1000
+            )
+            Holding.objects.create(ticker="AAPL", shares=i, portfolio=portfolio)
+            Holding.objects.create(ticker="TSLA", shares=1, portfolio=portfolio)
+        # WHEN
+        leaderboard = game.rank_portfolios()
+        # THEN
+        mock_fetch_quotes.assert_called_once_with(["AAPL", "TSLA"])
+        self.assertEqual([p.title for p in leaderboard],
+                         [f"{TEST_PORTFOLIO_TITLE} {i}" for i in (2, 1, 0)])
+        self.assertEqual([float(p.total_value) for p in leaderboard], [1250.0, 1150.0, 1050.0])
+        self.assertEqual([p.game_rank for p in leaderboard], [1, 2, 3])
+
 
 class PortfolioTestCase(TestCase):
     def setUp(self):
+        quote_cache.clear()
+        provider_breaker.reset()
         # Create game
         Game.objects.create(title=TEST_GAME_TITLE, rules=TEST_RULES)
         game = Game.objects.all()[0]
@@ -88,8 +180,8 @@ class PortfolioTestCase(TestCase):
         # WHEN / THEN
         assert p.__str__() == TEST_PORTFOLIO_TITLE
 
-    @mock.patch("trade_simulation.models.Holding.bid_price", return_value=200)
-    def test_equity_value_success(self, mock_bid_price):
+    @mock.patch("trade_simulation.quotes.fetch_quotes", return_value={"AAPL": {"bid": 200}})
+    def test_equity_value_success(self, mock_fetch_quotes):
         """
         Test that equity_value is computed correctly for a portfolio
         """
@@ -161,6 +253,18 @@ class PortfolioTestCase(TestCase):
         # THEN
         assert expected == actual
 
+    def test_compute_total_value_keeps_concurrent_trade(self):
+        """
+        Test that compute_total_value does not write back a cash balance changed by a trade meanwhile
+        """
+        # GIVEN
+        portfolio = Portfolio.objects.all()[0]
+        Portfolio.objects.filter(pk=portfolio.pk).update(cash_balance=5000)
+        # WHEN
+        portfolio.compute_total_value()
+        # THEN
+        self.assertEqual(Portfolio.objects.get(pk=portfolio.pk).cash_balance, Decimal("5000.00"))
+
     def test_add_transaction(self):
         """
         Test that transaction is successfully created
@@ -223,6 +327,54 @@ class PortfolioTestCase(TestCase):
         assert float(t.bought_price) == mock_ask_price.return_value
         assert t.trade_type == "BUY"
 
+    @mock.patch("trade_simulation.models.Holding.ask_price", return_value=200)
+    def test_buy_existing_holding_queries(self, mock_ask_price):
+        """
+        Test that buying a held stock locks the portfolio and writes each row with one statement
+        """
+        # GIVEN
+        portfolio = Portfolio.objects.all()[0]
+        Holding.objects.create(ticker="AAPL", shares=2, portfolio=portfolio)
+        # WHEN
+        with CaptureQueriesContext(connection) as queries:
+            portfolio.buy_holding("AAPL", 1)
+        # THEN
+        statements = [q["sql"] for q in queries.captured_queries if "SAVEPOINT" not in q["sql"]]
+        self.assertEqual([sql.split()[0] for sql in statements], ["SELECT", "UPDATE", "UPDATE", "INSERT"])
+        self.assertEqual(portfolio.cash_balance, Decimal("9800.00"))
+
+    @mock.patch("trade_simulation.models.Holding.ask_price", return_value=200)
+    def test_trades_on_stale_instances_keep_both_updates(self, mock_ask_price):
+        """
+        Test that trades through two copies of the same portfolio both count, instead of the last write winning
+        """
+        # GIVEN
+        first = Portfolio.objects.all()[0]
+        second = Portfolio.objects.get(pk=first.pk)
+        # WHEN
+        first.buy_holding("AAPL", 1)
+        second.buy_holding("AAPL", 2)
+        # THEN
+        self.assertEqual(Portfolio.objects.get(pk=first.pk).cash_balance, Decimal("9400.00"))
+        self.assertEqual(second.cash_balance, Decimal("9400.00"))
+        self.assertEqual(Holding.objects.get(portfolio=first).shares, 3)
+
+    @mock.patch("trade_simulation.models.Option.bid_price", return_value=5200)
+    @mock.patch("trade_simulation.models.Holding.ask_price", return_value=200)
+    def test_failed_buy_writes_nothing(self, mock_ask_price, mock_option_bid_price):
+        """
+        Test that a buy failing after the lock is taken leaves no holding, cash change or transaction behind
+        """
+        # GIVEN
+        portfolio = Portfolio.objects.all()[0]
+        Option.objects.create(contract="AAPL301223C00148000", quantity=1, portfolio=portfolio)
+        # WHEN
+        self.assertRaises(ValueError, portfolio.buy_holding, "AAPL", 200, exercise="AAPL301223C00148000")
+        # THEN
+        self.assertFalse(Holding.objects.filter(portfolio=portfolio).exists())
+        self.assertFalse(Transaction.objects.filter(portfolio=portfolio).exists())
+        self.assertEqual(Portfolio.objects.get(pk=portfolio.pk).cash_balance, 10000)
+
     @mock.patch("trade_simulation.models.Holding.ask_price", return_value=200)
     def test_buy_new_holding_with_option_success(self, mock_ask_price):
         """
@@ -736,6 +888,9 @@ class PortfolioTestCase(TestCase):
 
 class HoldingTestCase(TestCase):
     def setUp(self):
+        # Start every test with a cold quote cache
+        quote_cache.clear()
+        provider_breaker.reset()
         # Create game
         Game.objects.create(title=TEST_GAME_TITLE, rules="test rules")
         game = Game.objects.all()[0]
@@ -860,6 +1015,8 @@ class HoldingTestCase(TestCase):
 
 class OptionTestCase(TestCase):
     def setUp(self):
+        # Start every test with a cold option chain cache
+        chain_cache.clear()
         # Create game
         Game.objects.create(title=TEST_GAME_TITLE, rules="test rules")
         game = Game.objects.all()[0]
@@ -883,6 +1040,32 @@ class OptionTestCase(TestCase):
         # WHEN / THEN
         self.assertEqual(opt.__str__(), "AAPL211223C00148000")
 
+    def test_contract_fields_stored(self):
+        """
+        Test that the parts of the contract symbol are stored on save and can be filtered on
+        """
+        # GIVEN
+        opt = Option.objects.get(contract="TSLA211231P01115000")
+        # WHEN / THEN
+        self.assertEqual(opt.underlying, "TSLA")
+        self.assertEqual(opt.expiration_date, date(2021, 12, 31))
+        self.assertEqual(opt.contract_type, "P")
+        self.assertEqual(opt.strike, Decimal("1115"))
+        self.assertEqual(
+            list(Option.objects.filter(underlying="AAPL").values_list("contract", flat=True)),
+            ["AAPL211223C00148000"],
+        )
+
+    def test_parse_contract_malformed(self):
+        """
+        Test that malformed contract symbols parse without an expiration date
+        """
+        # WHEN
+        actual = parse_contract("AAPL2X122BC00148000")
+        # THEN
+        self.assertEqual(actual[0], "AAPL")
+        self.assertIsNone(actual[1])
+
     def test_ticker(self):
         """
         Test finding stock ticker from contract symbol
@@ -1017,6 +1200,30 @@ class OptionTestCase(TestCase):
         self.assertIsNone(info1)
         self.assertIsNone(info2)
 
+    @mock.patch("yfinance.Ticker.option_chain")
+    def test_get_info_shares_chain_download(self, mock_chain):
+        """
+        Test that contracts on the same underlying and expiration resolve from one chain download
+        """
+        # GIVEN
+        calls = DataFrame({"contractSymbol": ["AAPL211223C00148000", "AAPL211223C00150000"],
+                           "bid": [14.90, 13.10],
+                           "ask": [15.40, 13.50]})
+        puts = DataFrame({"contractSymbol": ["AAPL211223P00148000"],
+                          "bid": [1.10],
+                          "ask": [1.20]})
+        mock_chain.return_value = SimpleNamespace(calls=calls, puts=puts)
+        portfolio = Portfolio.objects.get(title=TEST_PORTFOLIO_TITLE)
+        Option.objects.create(portfolio=portfolio, contract="AAPL211223C00150000", quantity=1)
+        Option.objects.create(portfolio=portfolio, contract="AAPL211223P00148000", quantity=1)
+        # WHEN
+        infos = [Option.objects.get(contract=contract).get_info()
+                 for contract in ("AAPL211223C00148000", "AAPL211223C00150000", "AAPL211223P00148000")]
+        # THEN
+        mock_chain.assert_called_once_with(date="2021-12-23")
+        self.assertEqual([info["bid"] for info in infos], [14.90, 13.10, 1.10])
+        self.assertEqual(chain_cache.stats()["hits"], 2)
+
     @mock.patch("trade_simulation.models.Option.get_info", return_value={"ask": 15.40})
     def test_askprice_calloption_success(self, mock_info):
         """
@@ -1140,18 +1347,1717 @@ class OptionTestCase(TestCase):
         self.assertIsNone(actual)
 
 
-class TransactionTestCase(TestCase):
+class QuoteCacheTestCase(TestCase):
     def setUp(self):
-        # Create transaction
-        Transaction.objects.create(
-            ticker="AAPL", trade_type="BUY", shares=1, bought_price=122.34
+        quote_cache.clear()
+        provider_breaker.reset()
+
+    def test_cache_hit_and_miss(self):
+        """
+        Test that the cache counts hits and misses
+        """
+        # GIVEN
+        cache = TTLCache(ttl=60, maxsize=10)
+        cache.set("AAPL", {"bid": 1.0})
+        # WHEN
+        hit = cache.get("AAPL")
+        miss = cache.get("TSLA")
+        # THEN
+        self.assertEqual(hit, {"bid": 1.0})
+        self.assertIsNone(miss)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+
+    @mock.patch("trade_simulation.cache.time.monotonic")
+    def test_cache_expires_after_ttl(self, mock_time):
+        """
+        Test that entries are dropped once their TTL has passed
+        """
+        # GIVEN
+        cache = TTLCache(ttl=60, maxsize=10)
+        mock_time.return_value = 100.0
+        cache.set("AAPL", {"bid": 1.0})
+        # WHEN
+        mock_time.return_value = 161.0
+        actual = cache.get("AAPL")
+        # THEN
+        self.assertIsNone(actual)
+        self.assertEqual(len(cache), 0)
+
+    @mock.patch("trade_simulation.cache.time.monotonic")
+    def test_cache_serves_stale_within_bound(self, mock_time):
+        """
+        Test that expired entries are only served to readers accepting that much staleness
+        """
+        # GIVEN
+        cache = TTLCache(ttl=60, maxsize=10, stale_ttl=300)
+        mock_time.return_value = 100.0
+        cache.set("AAPL", {"bid": 1.0})
+        # WHEN
+        mock_time.return_value = 200.0
+        # THEN
+        self.assertIsNone(cache.get("AAPL"))
+        self.assertEqual(cache.get_stale("AAPL", max_stale=10), (None, False))
+        self.assertEqual(cache.get_stale("AAPL", max_stale=100), ({"bid": 1.0}, False))
+        self.assertEqual(cache.stale_hits, 1)
+        mock_time.return_value = 500.0
+        self.assertEqual(cache.get_stale("AAPL", max_stale=1000), (None, False))
+        self.assertEqual(len(cache), 0)
+
+    def test_cache_evicts_least_recently_used(self):
+        """
+        Test that the least recently used entry is evicted when the cache is full
+        """
+        # GIVEN
+        cache = TTLCache(ttl=60, maxsize=2)
+        cache.set("AAPL", 1)
+        cache.set("TSLA", 2)
+        cache.get("AAPL")
+        # WHEN
+        cache.set("MSFT", 3)
+        # THEN
+        self.assertEqual(cache.get("AAPL"), 1)
+        self.assertIsNone(cache.get("TSLA"))
+        self.assertEqual(cache.get("MSFT"), 3)
+
+    @mock.patch("yfinance.Ticker.info", new_callable=PropertyMock)
+    def test_get_quote_fetches_once(self, mock_info):
+        """
+        Test that repeated price lookups for one ticker make a single upstream call
+        """
+        # GIVEN
+        mock_info.return_value = {"bid": 10.0, "ask": 11.0}
+        game = Game.objects.create(title=TEST_GAME_TITLE)
+        for i in range(5):
+            portfolio = Portfolio.objects.create(title=f"{TEST_PORTFOLIO_TITLE} {i}", game=game)
+            Holding.objects.create(portfolio=portfolio, ticker="AAPL", shares=1)
+        # WHEN
+        for holding in Holding.objects.all():
+            holding.bid_price()
+            holding.ask_price()
+        # THEN
+        self.assertEqual(mock_info.call_count, 1)
+        self.assertEqual(get_quote("AAPL"), {"bid": 10.0, "ask": 11.0})
+        self.assertEqual(quote_cache.stats()["misses"], 1)
+
+    @mock.patch("trade_simulation.quotes.fetch_quotes")
+    def test_get_quotes_fetches_only_misses(self, mock_fetch_quotes):
+        """
+        Test that get_quotes serves cached tickers and batches the rest into one fetch
+        """
+        # GIVEN
+        quote_cache.set("AAPL", {"bid": 10.0})
+        mock_fetch_quotes.return_value = {"TSLA": {"bid": 20.0}}
+        # WHEN
+        actual = get_quotes(["AAPL", "TSLA", "ZZZZ"])
+        # THEN
+        mock_fetch_quotes.assert_called_once_with(["TSLA", "ZZZZ"])
+        self.assertEqual(actual, {"AAPL": {"bid": 10.0}, "TSLA": {"bid": 20.0}, "ZZZZ": {}})
+
+    @mock.patch("trade_simulation.quotes.fetch_quotes")
+    def test_get_quotes_empty(self, mock_fetch_quotes):
+        """
+        Test that get_quotes makes no upstream call when there is nothing to price
+        """
+        # WHEN
+        actual = get_quotes([])
+        # THEN
+        self.assertEqual(actual, {})
+        mock_fetch_quotes.assert_not_called()
+
+
+class OptionChainTestCase(TestCase):
+    def setUp(self):
+        calls = DataFrame({"contractSymbol": ["AAPL211223C00148000", "AAPL211223C00150000"],
+                           "currency": ["USD", "USD"],
+                           "strike": [148.0, 150.0],
+                           "bid": [14.90, 13.10],
+                           "ask": [15.40, 13.50],
+                           "lastPrice": [15.00, 13.30]})
+        puts = DataFrame({"contractSymbol": ["AAPL211223P00148000"],
+                          "currency": ["USD"],
+                          "strike": [148.0],
+                          "bid": [1.10],
+                          "ask": [1.20],
+                          "lastPrice": [1.15]})
+        self.chain = OptionChain.from_yfinance(SimpleNamespace(calls=calls, puts=puts))
+
+    def test_get_contract(self):
+        """
+        Test that a contract's row is read from the indexed chain
+        """
+        # WHEN
+        info = self.chain.get("AAPL211223C00150000", 'C')
+        # THEN
+        self.assertEqual(info, {"strike": 150.0, "bid": 13.10, "ask": 13.50, "lastPrice": 13.30})
+
+    def test_get_contract_wrong_side(self):
+        """
+        Test that a call contract is not found among the puts
+        """
+        # WHEN / THEN
+        self.assertIsNone(self.chain.get("AAPL211223C00150000", 'P'))
+        self.assertIsNone(self.chain.get("AAPL211223C00150000", 'Q'))
+
+    def test_chain_index(self):
+        """
+        Test that each side of the chain indexes all of its contracts
+        """
+        # WHEN / THEN
+        self.assertEqual(len(self.chain.calls), 2)
+        self.assertEqual(len(self.chain.puts), 1)
+        self.assertIn("AAPL211223P00148000", self.chain.puts)
+        self.assertNotIn("currency", self.chain.calls.columns)
+
+
+class QuoteSnapshotTestCase(TestCase):
+    def setUp(self):
+        quote_cache.clear()
+        provider_breaker.reset()
+
+    def test_bulk_upsert(self):
+        """
+        Test that bulk_upsert inserts new symbols and updates existing ones in place
+        """
+        # GIVEN
+        QuoteSnapshot.bulk_upsert({"AAPL": {"bid": 1.0, "ask": 1.5}, "TSLA": {}})
+        # WHEN
+        QuoteSnapshot.bulk_upsert({"AAPL": {"bid": 2.0, "ask": 2.5, "regularMarketPrice": 2.25}})
+        # THEN
+        self.assertEqual(QuoteSnapshot.objects.count(), 2)
+        self.assertEqual(QuoteSnapshot.objects.get(symbol="AAPL").to_info(),
+                         {"bid": 2.0, "ask": 2.5, "regularMarketPrice": 2.25})
+        self.assertEqual(QuoteSnapshot.objects.get(symbol="TSLA").to_info(), {})
+
+    @mock.patch("yfinance.Ticker.info", new_callable=PropertyMock)
+    def test_get_quote_reads_fresh_snapshot(self, mock_info):
+        """
+        Test that a fresh snapshot written by another process is served without calling the provider
+        """
+        # GIVEN
+        QuoteSnapshot.bulk_upsert({"AAPL": {"bid": 3.0}})
+        # WHEN
+        actual = get_quote("AAPL")
+        # THEN
+        self.assertEqual(actual, {"bid": 3.0})
+        mock_info.assert_not_called()
+
+    @mock.patch("trade_simulation.quotes._revalidate")
+    @mock.patch("trade_simulation.quotes.fetch_quotes", side_effect=ConnectionError)
+    def test_get_quotes_serves_stale_snapshot(self, mock_fetch_quotes, mock_revalidate):
+        """
+        Test that a stale snapshot within the valuation bound is served right away and revalidated
+        in the background, while a ticker with no snapshot waits on the provider
+        """
+        # GIVEN
+        QuoteSnapshot.bulk_upsert({"AAPL": {"bid": 4.0}},
+                                  fetched_on=datetime.now(timezone.utc) - timedelta(minutes=5))
+        # WHEN
+        actual = get_quotes(["AAPL"])
+        # THEN
+        self.assertEqual(actual, {"AAPL": {"bid": 4.0}})
+        mock_fetch_quotes.assert_not_called()
+        self.assertEqual(mock_revalidate.call_args[0][0], ["AAPL"])
+        with self.assertRaises(ConnectionError):
+            get_quotes(["TSLA"])
+
+    @mock.patch("trade_simulation.quotes._revalidate")
+    @mock.patch("trade_simulation.quotes.fetch_quotes", return_value={"AAPL": {"bid": 6.0}})
+    def test_stale_bounds(self, mock_fetch_quotes, mock_revalidate):
+        """
+        Test that snapshots beyond the staleness bound are not served, so trades (tighter bound)
+        wait for a fresh price while valuations accept the same snapshot
+        """
+        # GIVEN
+        QuoteSnapshot.bulk_upsert({"AAPL": {"bid": 4.0}},
+                                  fetched_on=datetime.now(timezone.utc) - timedelta(minutes=5))
+        # WHEN
+        valued = get_quotes(["AAPL"])
+        traded = get_quotes(["AAPL"], max_stale=15)
+        # THEN
+        self.assertEqual(valued, {"AAPL": {"bid": 4.0}})
+        self.assertEqual(traded, {"AAPL": {"bid": 6.0}})
+        mock_fetch_quotes.assert_called_once_with(["AAPL"])
+
+    @mock.patch("trade_simulation.quotes.fetch_quotes", return_value={"AAPL": {"bid": 5.0}})
+    def test_get_quotes_writes_snapshots(self, mock_fetch_quotes):
+        """
+        Test that fetched quotes are stored as snapshots
+        """
+        # WHEN
+        get_quotes(["AAPL"])
+        # THEN
+        self.assertEqual(QuoteSnapshot.objects.get(symbol="AAPL").to_info(), {"bid": 5.0})
+
+
+class FetchConcurrentlyTestCase(TestCase):
+    def test_fetches_run_in_parallel(self):
+        """
+        Test that fetches overlap, so a batch takes about as long as its slowest fetch
+        """
+        # GIVEN
+        def fetch(key):
+            time.sleep(0.2)
+            return key.lower()
+        # WHEN
+        start = time.monotonic()
+        actual = fetch_concurrently(fetch, ["AAPL", "TSLA", "MSFT", "AMZN"], concurrency=4, timeout=5)
+        elapsed = time.monotonic() - start
+        # THEN
+        self.assertEqual(actual, {"AAPL": "aapl", "TSLA": "tsla", "MSFT": "msft", "AMZN": "amzn"})
+        self.assertLess(elapsed, 0.6)
+
+    def test_failures_and_timeouts_are_reported(self):
+        """
+        Test that failed and timed out fetches raise FetchError carrying the successful results
+        """
+        # GIVEN
+        def fetch(key):
+            if key == "BAD":
+                raise ValueError(key)
+            if key == "SLOW":
+                time.sleep(1)
+            return key
+        # WHEN
+        with self.assertRaises(FetchError) as context:
+            fetch_concurrently(fetch, ["AAPL", "BAD", "SLOW"], concurrency=3, timeout=0.3)
+        # THEN
+        self.assertEqual(context.exception.results, {"AAPL": "AAPL"})
+        self.assertIsInstance(context.exception.errors["BAD"], ValueError)
+        self.assertIsInstance(context.exception.errors["SLOW"], TimeoutError)
+
+    @mock.patch("trade_simulation.quotes.fetch_quotes")
+    def test_partial_failure_uses_snapshot(self, mock_fetch_quotes):
+        """
+        Test that quotes which fail to fetch fall back to snapshots while the rest are fetched
+        """
+        # GIVEN
+        quote_cache.clear()
+        provider_breaker.reset()
+        QuoteSnapshot.bulk_upsert({"TSLA": {"bid": 7.0}},
+                                  fetched_on=datetime.now(timezone.utc) - timedelta(minutes=5))
+        mock_fetch_quotes.side_effect = FetchError({"TSLA": TimeoutError()}, {"AAPL": {"bid": 1.0}})
+        # WHEN
+        actual = refresh_quotes(["AAPL", "TSLA"])
+        # THEN
+        self.assertEqual(actual, {"AAPL": {"bid": 1.0}, "TSLA": {"bid": 7.0}})
+        self.assertEqual(QuoteSnapshot.objects.get(symbol="AAPL").to_info(), {"bid": 1.0})
+
+
+class CircuitBreakerTestCase(TestCase):
+    def setUp(self):
+        quote_cache.clear()
+        provider_breaker.reset()
+
+    def tearDown(self):
+        provider_breaker.reset()
+
+    @mock.patch("trade_simulation.fetching.time.monotonic")
+    def test_opens_and_recovers(self, mock_time):
+        """
+        Test that the breaker opens after consecutive failures, fails fast while open and closes
+        again after a successful trial call
+        """
+        # GIVEN
+        mock_time.return_value = 100.0
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        fail = mock.Mock(side_effect=ConnectionError)
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                breaker.call(fail)
+        # WHEN / THEN
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.call(fail)
+        self.assertEqual(fail.call_count, 2)
+        mock_time.return_value = 131.0
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertEqual(breaker.call(lambda: "ok"), "ok")
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_ignored_errors_do_not_count(self):
+        """
+        Test that errors meaning the provider answered (e.g. a missing option chain) keep the circuit closed
+        """
+        # GIVEN
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        # WHEN
+        with self.assertRaises(ValueError):
+            breaker.call(mock.Mock(side_effect=ValueError), ignore=(ValueError,))
+        # THEN
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    @mock.patch("trade_simulation.quotes.fetch_quotes", side_effect=ConnectionError)
+    def test_failing_provider_is_not_called(self, mock_fetch_quotes):
+        """
+        Test that once the provider keeps failing, quote lookups fail fast without calling it
+        """
+        # GIVEN
+        for _ in range(provider_breaker.failure_threshold):
+            with self.assertRaises(ConnectionError):
+                get_quotes(["AAPL"])
+        # WHEN
+        with self.assertRaises(CircuitOpenError):
+            get_quotes(["AAPL"])
+        # THEN
+        self.assertEqual(mock_fetch_quotes.call_count, provider_breaker.failure_threshold)
+
+
+class SingleFlightTestCase(TestCase):
+    def _run_concurrently(self, target, count):
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_concurrent_fetches_coalesce(self):
+        """
+        Test that concurrent fetches of the same key share one call and its result
+        """
+        # GIVEN
+        flight = SingleFlight()
+        calls = []
+        results = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.2)
+            return {"bid": 1.0}
+        # WHEN
+        self._run_concurrently(lambda: results.append(flight.do("AAPL", fetch)), 10)
+        # THEN
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"bid": 1.0}] * 10)
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_errors_are_shared(self):
+        """
+        Test that every waiter sees the error raised by the shared fetch
+        """
+        # GIVEN
+        flight = SingleFlight()
+        errors = []
+
+        def fetch():
+            time.sleep(0.2)
+            raise ValueError("No contract")
+
+        def lookup():
+            try:
+                flight.do("AAPL", fetch)
+            except ValueError as e:
+                errors.append(e)
+        # WHEN
+        self._run_concurrently(lookup, 5)
+        # THEN
+        self.assertEqual(len(errors), 5)
+        self.assertEqual(flight.in_flight(), 0)
+
+    @mock.patch("trade_simulation.providers.YFinanceProvider.get_option_chain")
+    def test_concurrent_chain_downloads_coalesce(self, mock_chain):
+        """
+        Test that threads asking for overlapping option chains download each chain once
+        """
+        # GIVEN
+        chain_cache.clear()
+
+        def download(ticker, expdate):
+            time.sleep(0.2)
+            return OptionChain(DataFrame({"contractSymbol": []}), DataFrame({"contractSymbol": []}))
+        mock_chain.side_effect = download
+        keys = [("SPY", "2021-12-23"), ("SPY", "2021-12-31")]
+        # WHEN
+        self._run_concurrently(lambda: refresh_option_chains(keys), 8)
+        # THEN
+        self.assertEqual(mock_chain.call_count, 2)
+        self.assertEqual(len(chain_cache), 2)
+
+    @override_settings(QUOTE_FETCH_TIMEOUT=0.1)
+    @mock.patch("trade_simulation.providers.YFinanceProvider.get_option_chain")
+    def test_single_chain_download_times_out(self, mock_chain):
+        """
+        Test that a contract lookup gives up on a hanging chain download after QUOTE_FETCH_TIMEOUT
+        """
+        # GIVEN
+        chain_cache.clear()
+        provider_breaker.reset()
+        mock_chain.side_effect = lambda ticker, expdate: time.sleep(1)
+        started = time.monotonic()
+        # WHEN
+        with self.assertRaises(TimeoutError):
+            get_option_chain("SPY", "2030-12-23")
+        # THEN
+        self.assertLess(time.monotonic() - started, 0.5)
+
+
+class ProviderTestCase(TestCase):
+    def setUp(self):
+        quote_cache.clear()
+        provider_breaker.reset()
+        chain_cache.clear()
+        self.recording = tempfile.TemporaryDirectory()
+        recorder = ReplayProvider(self.recording.name)
+        recorder.record_quotes({"AAPL": {"bid": 149.5, "ask": 150.0}})
+        recorder.record_option_chain(
+            "AAPL", "2021-12-23",
+            calls=DataFrame({"contractSymbol": ["AAPL211223C00148000"], "bid": [14.90], "ask": [15.40]}),
+            puts=DataFrame({"contractSymbol": [], "bid": [], "ask": []}),
         )
+        Game.objects.create(title=TEST_GAME_TITLE)
+        Portfolio.objects.create(title=TEST_PORTFOLIO_TITLE, game=Game.objects.all()[0])
 
-    def test_str(self):
+    def tearDown(self):
+        self.recording.cleanup()
+
+    def test_default_provider(self):
         """
-        Test __str__() returns ticker
+        Test that yfinance is the default market data provider
+        """
+        # WHEN / THEN
+        self.assertIsInstance(get_provider(), YFinanceProvider)
+
+    def test_incomplete_provider_cannot_be_instantiated(self):
+        """
+        Test that a provider missing part of the interface fails when it is created, not on first use
         """
         # GIVEN
-        t = Transaction.objects.all()[0]
+        class QuoteOnlyProvider(MarketDataProvider):
+            def get_quote(self, ticker):
+                return {}
+
         # WHEN / THEN
-        assert t.__str__() == "AAPL"
+        with self.assertRaises(TypeError):
+            QuoteOnlyProvider()
+
+    def test_replay_provider(self):
+        """
+        Test that recorded quotes and chains are replayed
+        """
+        # GIVEN
+        provider = ReplayProvider(self.recording.name)
+        # WHEN
+        quote = provider.get_quote("AAPL")
+        missing = provider.get_quote("TSLA")
+        chain = provider.get_option_chain("AAPL", "2021-12-23")
+        # THEN
+        self.assertEqual(quote, {"bid": 149.5, "ask": 150.0})
+        self.assertEqual(missing, {})
+        self.assertEqual(chain.get("AAPL211223C00148000", 'C'), {"bid": 14.90, "ask": 15.40})
+        with self.assertRaises(ValueError):
+            provider.get_option_chain("AAPL", "2021-12-31")
+
+    def test_trade_with_replay_provider(self):
+        """
+        Test that stocks and options trade from a replay provider selected in settings
+        """
+        # GIVEN
+        portfolio = Portfolio.objects.get(title=TEST_PORTFOLIO_TITLE)
+        # WHEN
+        with override_settings(MARKET_DATA_PROVIDER="trade_simulation.providers.ReplayProvider",
+                               MARKET_DATA_PROVIDER_OPTIONS={"path": self.recording.name}):
+            self.assertIsInstance(get_provider(), ReplayProvider)
+            portfolio.buy_holding("AAPL", 10)
+            portfolio.buy_option("AAPL211223C00148000", 1)
+        # THEN
+        self.assertAlmostEqual(float(portfolio.cash_balance), 10000 - 1500 - 1540)
+        self.assertIsInstance(get_provider(), YFinanceProvider)
+
+
+class QuoteRefresherTestCase(TestCase):
+    def setUp(self):
+        quote_cache.clear()
+        provider_breaker.reset()
+        chain_cache.clear()
+        game = Game.objects.create(title=TEST_GAME_TITLE)
+        for i in range(2):
+            portfolio = Portfolio.objects.create(title=f"{TEST_PORTFOLIO_TITLE} {i}", game=game)
+            Holding.objects.create(portfolio=portfolio, ticker="AAPL", shares=1)
+            Holding.objects.create(portfolio=portfolio, ticker=f"T{i}", shares=1)
+            Option.objects.create(portfolio=portfolio, contract="AAPL301223C00148000", quantity=1)
+            Option.objects.create(portfolio=portfolio, contract="AAPL301223P00150000", quantity=1)
+            Option.objects.create(portfolio=portfolio, contract="TSLA301231P01115000", quantity=1)
+            # Neither an expired contract nor an emptied position needs its chain
+            Option.objects.create(portfolio=portfolio, contract="MSFT211223C00100000", quantity=1)
+            Option.objects.create(portfolio=portfolio, contract="NVDA301223C00100000", quantity=0)
+
+    def test_held_symbols(self):
+        """
+        Test that each held ticker and live option chain is listed once
+        """
+        # WHEN / THEN
+        self.assertEqual(sorted(held_tickers()), ["AAPL", "T0", "T1"])
+        self.assertEqual(held_option_chains(), [("AAPL", "2030-12-23"), ("TSLA", "2030-12-31")])
+
+    @mock.patch("trade_simulation.refresher.refresh_option_chains", return_value={})
+    @mock.patch("trade_simulation.quotes.fetch_quotes")
+    def test_refresh_once_skips_failed_tickers(self, mock_fetch_quotes, mock_chains):
+        """
+        Test that a ticker the provider fails on only holds back its own resting orders
+        """
+        # GIVEN
+        mock_fetch_quotes.side_effect = FetchError(
+            {"T0": TimeoutError("timed out")}, {"AAPL": {"bid": 10.0}, "T1": {"bid": 2.0}}
+        )
+        with mock.patch.object(order_book, "sync"), \
+                mock.patch.object(order_book, "tickers", return_value=["AAPL"]), \
+                mock.patch.object(order_book, "match", return_value=(1, 0)) as mock_match:
+            # WHEN
+            actual = QuoteRefresher(interval=1).refresh_once()
+        # THEN
+        self.assertEqual(actual, (3, 0))
+        self.assertEqual(set(mock_match.call_args[0][0]), {"AAPL", "T1"})
+
+    @mock.patch("trade_simulation.providers.YFinanceProvider.get_option_chain")
+    @mock.patch("trade_simulation.quotes.fetch_quotes")
+    def test_refresh_once(self, mock_fetch_quotes, mock_refresh_chain):
+        """
+        Test that one refresh prices all held tickers in a single batch and each chain once
+        """
+        # GIVEN
+        mock_fetch_quotes.return_value = {"AAPL": {"bid": 10.0}, "T0": {"bid": 1.0}, "T1": {"bid": 2.0}}
+        # WHEN
+        actual = QuoteRefresher(interval=1).refresh_once()
+        # THEN
+        self.assertEqual(actual, (3, 2))
+        mock_fetch_quotes.assert_called_once_with(["AAPL", "T0", "T1"])
+        self.assertEqual(mock_refresh_chain.call_count, 2)
+        self.assertEqual(quote_cache.get("AAPL"), {"bid": 10.0})
+
+    @mock.patch("trade_simulation.refresher.close_old_connections")
+    def test_refresher_drops_dead_connections_every_cycle(self, mock_close_old_connections):
+        """
+        Test that the refresher drops unusable database connections before every cycle
+        """
+        # GIVEN
+        refresher = QuoteRefresher(interval=0)
+        cycles = []
+
+        def refresh_once():
+            cycles.append(mock_close_old_connections.call_count)
+            if len(cycles) == 2:
+                refresher.stop()
+            raise RuntimeError("connection already closed")
+        refresher.refresh_once = refresh_once
+        # WHEN
+        refresher.run()
+        # THEN
+        self.assertEqual(cycles, [1, 2])
+
+    @mock.patch("trade_simulation.providers.YFinanceProvider.get_option_chain", side_effect=ValueError)
+    @mock.patch("trade_simulation.quotes.fetch_quotes", return_value={})
+    def test_refresh_quotes_command_once(self, mock_fetch_quotes, mock_refresh_chain):
+        """
+        Test that the refresh_quotes command can run a single refresh
+        """
+        # GIVEN
+        out = StringIO()
+        # WHEN
+        call_command("refresh_quotes", "--once", stdout=out)
+        # THEN
+        self.assertIn("Refreshed 3 tickers and 0 option chains.", out.getvalue())
+
+
+class PortfolioValuationTestCase(TestCase):
+    def test_total_values(self):
+        """
+        Test that every portfolio is valued from flat positions, including portfolios without holdings
+        """
+        # GIVEN
+        portfolios = [SimpleNamespace(pk=i, cash_balance=Decimal(100 * i)) for i in range(3)]
+        positions = [
+            (0, "AAPL", Decimal("2")),
+            (0, "TSLA", Decimal("1.5")),
+            (2, "AAPL", None),
+            (2, "TSLA", Decimal("4")),
+            (9, "AAPL", Decimal("100")),
+        ]
+        valuation = PortfolioValuation(portfolios, positions)
+        # WHEN
+        actual = valuation.total_values({"AAPL": 10.0, "TSLA": 20.0})
+        # THEN
+        self.assertEqual(list(valuation.tickers), ["AAPL", "TSLA"])
+        self.assertEqual(actual.tolist(), [50.0, 100.0, 280.0])
+
+    def test_unpriced_tickers_are_worth_nothing(self):
+        """
+        Test that positions in tickers without a price do not add value
+        """
+        # GIVEN
+        valuation = PortfolioValuation([SimpleNamespace(pk=1, cash_balance=5)], [(1, "ZZZZ", 3)])
+        # WHEN / THEN
+        self.assertEqual(valuation.equity_values({"ZZZZ": None}).tolist(), [0.0])
+
+    def test_option_values(self):
+        """
+        Test that option positions are priced per chain side, with the last price used when there is no bid
+        """
+        # GIVEN
+        portfolios = [SimpleNamespace(pk=i, cash_balance=0) for i in range(2)]
+        options = [
+            (0, "AAPL301223C00148000", "AAPL", date(2030, 12, 23), "C", Decimal("2")),
+            (1, "AAPL301223C00148000", "AAPL", date(2030, 12, 23), "C", Decimal("1")),
+            (1, "AAPL301223P00100000", "AAPL", date(2030, 12, 23), "P", Decimal("1")),
+            (1, "TSLA301223C01000000", "TSLA", date(2030, 12, 23), "C", Decimal("5")),
+        ]
+        chain = OptionChain(
+            DataFrame({"contractSymbol": ["AAPL301223C00148000"], "bid": [1.5], "lastPrice": [1.0]}),
+            DataFrame({"contractSymbol": ["AAPL301223P00100000"], "bid": [0.0], "lastPrice": [0.25]}),
+        )
+        valuation = PortfolioValuation(portfolios, [], options, contract_size=100)
+        # WHEN
+        actual = valuation.total_values({}, {("AAPL", "2030-12-23"): chain})
+        # THEN
+        self.assertEqual(valuation.chain_keys(), {("AAPL", "2030-12-23"), ("TSLA", "2030-12-23")})
+        self.assertEqual(actual.tolist(), [300.0, 175.0])
+
+    @mock.patch("trade_simulation.models.get_option_chains")
+    def test_rank_portfolios_values_options(self, mock_chains):
+        """
+        Test that ranking a game counts option positions, fetching each chain once and skipping expired options
+        """
+        # GIVEN
+        game = Game.objects.create(title=TEST_GAME_TITLE)
+        holder = Portfolio.objects.create(title=f"{TEST_PORTFOLIO_TITLE} 0", game=game, cash_balance=10000)
+        other = Portfolio.objects.create(title=f"{TEST_PORTFOLIO_TITLE} 1", game=game, cash_balance=10100)
+        Option.objects.create(contract="AAPL301223C00148000", quantity=2, portfolio=holder)
+        Option.objects.create(contract="AAPL211223C00148000", quantity=2, portfolio=other)
+        mock_chains.return_value = {
+            ("AAPL", "2030-12-23"): OptionChain(
+                DataFrame({"contractSymbol": ["AAPL301223C00148000"], "bid": [1.0], "lastPrice": [0.5]}),
+                DataFrame({"contractSymbol": []}),
+            )
+        }
+        # WHEN
+        leaderboard = game.rank_portfolios()
+        # THEN
+        mock_chains.assert_called_once_with({("AAPL", "2030-12-23")})
+        self.assertEqual([p.pk for p in leaderboard], [holder.pk, other.pk])
+        self.assertEqual(float(Portfolio.objects.get(pk=holder.pk).total_value), 10200.0)
+
+    @mock.patch("trade_simulation.providers.YFinanceProvider.get_option_chain", side_effect=ConnectionError("down"))
+    def test_rank_portfolios_serves_stale_chain(self, mock_chain):
+        """
+        Test that a chain failing to download is served from the cache once expired
+        """
+        # GIVEN
+        chain_cache.clear()
+        provider_breaker.reset()
+        game = Game.objects.create(title=TEST_GAME_TITLE)
+        holder = Portfolio.objects.create(title=TEST_PORTFOLIO_TITLE, game=game, cash_balance=10000)
+        Option.objects.create(contract="AAPL301223C00148000", quantity=2, portfolio=holder)
+        chain = OptionChain(
+            DataFrame({"contractSymbol": ["AAPL301223C00148000"], "bid": [1.0], "lastPrice": [0.5]}),
+            DataFrame({"contractSymbol": []}),
+        )
+        chain_cache.set(("AAPL", "2030-12-23"), chain, age=chain_cache.ttl + 1)
+        # WHEN
+        game.rank_portfolios()
+        # THEN
+        mock_chain.assert_called_once_with("AAPL", "2030-12-23")
+        self.assertEqual(float(Portfolio.objects.get(pk=holder.pk).total_value), 10200.0)
+
+    @mock.patch("trade_simulation.providers.YFinanceProvider.get_option_chain", side_effect=ConnectionError("down"))
+    def test_rank_portfolios_keeps_value_of_unpriced_options(self, mock_chain):
+        """
+        Test that a game is not ranked with options priced at nothing when their chain cannot be downloaded
+        """
+        # GIVEN
+        chain_cache.clear()
+        provider_breaker.reset()
+        game = Game.objects.create(title=TEST_GAME_TITLE)
+        holder = Portfolio.objects.create(title=TEST_PORTFOLIO_TITLE, game=game, cash_balance=10000, total_value=10200)
+        Option.objects.create(contract="AAPL301223C00148000", quantity=2, portfolio=holder)
+        # WHEN
+        with self.assertRaises(ConnectionError):
+            game.rank_portfolios()
+        # THEN
+        self.assertEqual(float(Portfolio.objects.get(pk=holder.pk).total_value), 10200.0)
+        self.assertIsNone(Game.objects.get(pk=game.pk).ranked_on)
+
+
+class StandingsTestCase(TestCase):
+    def setUp(self):
+        quote_cache.clear()
+        provider_breaker.reset()
+        self.fresh = Game.objects.create(title=f"{TEST_GAME_TITLE} fresh")
+        self.stale = Game.objects.create(title=f"{TEST_GAME_TITLE} stale")
+        self.fresh.rank_portfolios()
+
+    def test_rank_portfolios_records_time(self):
+        """
+        Test that ranking a game records when its standings were computed
+        """
+        # WHEN / THEN
+        self.assertIsNotNone(Game.objects.get(pk=self.fresh.pk).ranked_on)
+        self.assertFalse(self.fresh.standings_are_stale(60))
+        self.assertTrue(self.stale.standings_are_stale(60))
+
+    def test_refresh_standings_only_stale(self):
+        """
+        Test that only games never ranked or ranked too long ago are revalued, unless max_age is 0
+        """
+        # GIVEN
+        Game.objects.filter(pk=self.fresh.pk).update(ranked_on=datetime.now(timezone.utc) - timedelta(hours=1))
+        # WHEN / THEN
+        self.assertEqual(list(stale_games(max_age=7200)), [self.stale])
+        self.assertEqual(refresh_standings(max_age=7200), 1)
+        self.assertEqual(refresh_standings(max_age=7200), 0)
+        self.assertEqual(refresh_standings(max_age=0), 2)
+
+    @mock.patch("trade_simulation.quotes.fetch_quotes", side_effect=ConnectionError("provider down"))
+    def test_refresh_standings_skips_unpriced_game(self, mock_fetch_quotes):
+        """
+        Test that a game whose holdings cannot be priced keeps its standings without holding back other games
+        """
+        # GIVEN
+        unpriced = Game.objects.create(title=f"{TEST_GAME_TITLE} unpriced")
+        portfolio = Portfolio.objects.create(title=TEST_PORTFOLIO_TITLE, game=unpriced)
+        Holding.objects.create(portfolio=portfolio, ticker="AAPL", shares=1)
+        # WHEN
+        ranked = refresh_standings(max_age=7200)
+        # THEN
+        self.assertEqual(ranked, 1)
+        self.assertIsNone(Game.objects.get(pk=unpriced.pk).ranked_on)
+        self.assertIsNotNone(Game.objects.get(pk=self.stale.pk).ranked_on)
+
+    def test_rank_games_command(self):
+        """
+        Test that the rank_games command ranks stale games
+        """
+        # GIVEN
+        out = StringIO()
+        # WHEN
+        call_command("rank_games", stdout=out)
+        # THEN
+        self.assertIn("Ranked 1 games.", out.getvalue())
+
+
+class BrokerTestCase(TestCase):
+    def setUp(self):
+        quote_cache.clear()
+        provider_breaker.reset()
+
+    def test_incomplete_broker_cannot_be_instantiated(self):
+        """
+        Test that a broker missing part of the interface fails when it is created, not on first use
+        """
+        # GIVEN
+        class PublishOnlyBroker(LeaderboardBroker):
+            def publish(self, key, message):
+                pass
+
+        # WHEN / THEN
+        with self.assertRaises(TypeError):
+            PublishOnlyBroker()
+
+    def test_check_stream_broker(self):
+        """
+        Test that deploy checks warn when LocalBroker streams cannot receive refresher updates
+        """
+        # WHEN / THEN
+        with override_settings(LEADERBOARD_BROKER="trade_simulation.broker.LocalBroker", QUOTE_REFRESHER_IN_PROCESS=False):
+            self.assertEqual([w.id for w in check_stream_broker(None)], ["trade_simulation.W001"])
+        with override_settings(LEADERBOARD_BROKER="trade_simulation.broker.LocalBroker", QUOTE_REFRESHER_IN_PROCESS=True):
+            self.assertEqual(check_stream_broker(None), [])
+
+    def test_local_broker(self):
+        """
+        Test that messages reach current subscribers of a key only
+        """
+        # GIVEN
+        broker = LocalBroker()
+        received = []
+        unsubscribe = broker.subscribe("game", received.append)
+        broker.subscribe("other", mock.Mock(side_effect=AssertionError))
+        # WHEN
+        broker.publish("game", "first")
+        unsubscribe()
+        broker.publish("game", "second")
+        # THEN
+        self.assertEqual(received, ["first"])
+        self.assertFalse(broker.has_subscribers("game"))
+        self.assertTrue(broker.has_subscribers("other"))
+
+    def test_rank_portfolios_publishes_changes(self):
+        """
+        Test that ranking a watched game publishes only the portfolios whose rank or value changed
+        """
+        # GIVEN
+        game = Game.objects.create(title=TEST_GAME_TITLE)
+        for i in range(2):
+            Portfolio.objects.create(title=f"{TEST_PORTFOLIO_TITLE} {i}", game=game, cash_balance=10000 + i)
+        game.rank_portfolios()
+        Portfolio.objects.filter(title=f"{TEST_PORTFOLIO_TITLE} 0").update(cash_balance=20000)
+        received = []
+        unsubscribe = get_broker().subscribe(game.title, received.append)
+        # WHEN
+        try:
+            game.rank_portfolios()
+        finally:
+            unsubscribe()
+        # THEN
+        self.assertEqual(len(received), 1)
+        message = json.loads(received[0])
+        self.assertEqual(message["game"], TEST_GAME_TITLE)
+        self.assertEqual(
+            sorted((c["title"], c["game_rank"], c["total_value"]) for c in message["changes"]),
+            [(f"{TEST_PORTFOLIO_TITLE} 0", 1, 20000.0), (f"{TEST_PORTFOLIO_TITLE} 1", 2, 10001.0)],
+        )
+
+    def test_trade_publishes_crossed_ranks(self):
+        """
+        Test that a trade changing a portfolio's value publishes it and the portfolios it overtook, read
+        from the leaderboard without re-ranking the game, while a trade at market price publishes nothing
+        """
+        # GIVEN
+        game = Game.objects.create(title=TEST_GAME_TITLE)
+        portfolios = [
+            Portfolio.objects.create(title=f"{TEST_PORTFOLIO_TITLE} {i}", game=game, total_value=100 + i)
+            for i in range(4)
+        ]
+        leaderboards.rebuild(game)
+        traded = portfolios[0]
+        received = []
+        unsubscribe = get_broker().subscribe(game.title, received.append)
+        # WHEN
+        try:
+            with mock.patch("trade_simulation.models.Game.rank_portfolios") as mock_rank_portfolios:
+                with self.captureOnCommitCallbacks(execute=True):
+                    with transaction.atomic():
+                        traded.apply_trade(traded.lock(), -10, 0)
+                with self.captureOnCommitCallbacks(execute=True):
+                    with transaction.atomic():
+                        traded.apply_trade(traded.lock(), 0, Decimal("1.5"))
+        finally:
+            unsubscribe()
+        # THEN
+        mock_rank_portfolios.assert_not_called()
+        self.assertEqual(len(received), 1)
+        changes = json.loads(received[0])["changes"]
+        self.assertEqual([(c["title"], c["game_rank"], c["total_value"]) for c in changes], [
+            (f"{TEST_PORTFOLIO_TITLE} 0", 3, 101.5),
+            (f"{TEST_PORTFOLIO_TITLE} 1", 4, 101.0),
+        ])
+
+
+class SettlementTestCase(TestCase):
+    def setUp(self):
+        quote_cache.clear()
+        provider_breaker.reset()
+        game = Game.objects.create(title=TEST_GAME_TITLE)
+        self.portfolio = Portfolio.objects.create(title=TEST_PORTFOLIO_TITLE, game=game, cash_balance=1000)
+        Option.objects.create(portfolio=self.portfolio, contract="AAPL211223C00148000", quantity=2)
+        Option.objects.create(portfolio=self.portfolio, contract="TSLA211231P01115000", quantity=1)
+        Option.objects.create(portfolio=self.portfolio, contract="MSFT211223C00100000", quantity=1)
+        Option.objects.create(portfolio=self.portfolio, contract="AAPL991223C00148000", quantity=1)
+
+    @mock.patch("trade_simulation.quotes.fetch_quotes")
+    def test_settle_expired_options(self, mock_fetch_quotes):
+        """
+        Test that expired in-the-money options pay out, worthless ones are removed and both are recorded
+        """
+        # GIVEN
+        mock_fetch_quotes.return_value = {
+            "AAPL": {"bid": 149.0, "regularMarketPrice": 150.0},
+            "TSLA": {"bid": 1200.0},
+        }
+        # WHEN
+        actual = settle_expired_options(as_of=date(2022, 1, 1))
+        # THEN
+        self.assertEqual(actual, (1, 1, 1))
+        mock_fetch_quotes.assert_called_once_with(["AAPL", "MSFT", "TSLA"])
+        self.portfolio.refresh_from_db()
+        self.assertEqual(self.portfolio.cash_balance, Decimal("1400.00"))
+        self.assertEqual(
+            sorted(Option.objects.values_list("contract", flat=True)),
+            ["AAPL991223C00148000", "MSFT211223C00100000"],
+        )
+        settlements = {t.ticker: t for t in Transaction.objects.filter(portfolio=self.portfolio)}
+        self.assertEqual(settlements["AAPL211223C00148000"].trade_type, "SETTLE CALL")
+        self.assertEqual(settlements["AAPL211223C00148000"].bought_price, Decimal("200.00"))
+        self.assertEqual(settlements["TSLA211231P01115000"].bought_price, Decimal("0.00"))
+        self.assertNotIn("MSFT211223C00100000", settlements)
+
+    @mock.patch("trade_simulation.quotes.fetch_quotes")
+    def test_settle_expired_options_skips_failed_underlyings(self, mock_fetch_quotes):
+        """
+        Test that an underlying the provider fails on only leaves its own options unsettled
+        """
+        # GIVEN
+        mock_fetch_quotes.side_effect = FetchError(
+            {"TSLA": TimeoutError("timed out")},
+            {"AAPL": {"regularMarketPrice": 150.0}, "MSFT": {"bid": 90.0}},
+        )
+        # WHEN
+        actual = settle_expired_options(as_of=date(2022, 1, 1))
+        # THEN
+        self.assertEqual(actual, (1, 1, 1))
+        self.portfolio.refresh_from_db()
+        self.assertEqual(self.portfolio.cash_balance, Decimal("1400.00"))
+        self.assertEqual(
+            sorted(Option.objects.values_list("contract", flat=True)),
+            ["AAPL991223C00148000", "TSLA211231P01115000"],
+        )
+
+    @mock.patch("trade_simulation.quotes.fetch_quotes", return_value={})
+    def test_settle_options_command(self, mock_fetch_quotes):
+        """
+        Test that the settle_options command reports what it settled
+        """
+        # GIVEN
+        out = StringIO()
+        # WHEN
+        call_command("settle_options", "--date", "2022-01-01", stdout=out)
+        # THEN
+        self.assertIn("Settled 0 in-the-money and 0 worthless options.", out.getvalue())
+        self.assertIn("Left 3 options unsettled", out.getvalue())
+
+
+class TransactionTestCase(TestCase):
+    def setUp(self):
+        # Create transaction
+        Transaction.objects.create(
+            ticker="AAPL", trade_type="BUY", shares=1, bought_price=122.34
+        )
+
+    def test_str(self):
+        """
+        Test __str__() returns ticker
+        """
+        # GIVEN
+        t = Transaction.objects.all()[0]
+        # WHEN / THEN
+        assert t.__str__() == "AAPL"
+
+
+class LeaderboardTestCase(TestCase):
+    def setUp(self):
+        quote_cache.clear()
+        provider_breaker.reset()
+        leaderboards.clear()
+
+    def test_skip_list(self):
+        """
+        Test that the skip list stays sorted and answers positional and rank queries
+        """
+        # GIVEN
+        skip_list = IndexableSkipList()
+        keys = list(range(200))
+        # WHEN
+        for key in reversed(keys):
+            skip_list.insert(key)
+        for key in keys[::3]:
+            skip_list.remove(key)
+        # THEN
+        expected = [key for key in keys if key % 3]
+        self.assertEqual(len(skip_list), len(expected))
+        self.assertEqual(list(skip_list.islice(0, len(skip_list))), expected)
+        self.assertEqual(skip_list[10], expected[10])
+        self.assertEqual(skip_list[-1], expected[-1])
+        self.assertEqual(skip_list.bisect_left(100), expected.index(100))
+        self.assertRaises(KeyError, skip_list.remove, 0)
+
+    def test_game_leaderboard(self):
+        """
+        Test that ties share a rank and that updates move portfolios up and down
+        """
+        # GIVEN
+        board = GameLeaderboard([("a", 100), ("b", 300), ("c", 300), ("d", 50)])
+        # WHEN
+        board.update("d", 400)
+        board.remove("a")
+        # THEN
+        self.assertEqual(board.rank("d"), 1)
+        self.assertEqual(board.rank("b"), 2)
+        self.assertEqual(board.rank("c"), 2)
+        self.assertIsNone(board.rank("a"))
+        self.assertEqual(board.top(2), [("d", 400.0, 1), ("b", 300.0, 2)])
+        self.assertEqual(board.range(2, 10), [("c", 300.0, 2)])
+        self.assertEqual(board.between(300, 350), [("b", 300.0, 2), ("c", 300.0, 2)])
+        self.assertEqual(board.between(10, 20), [])
+
+    def test_leaderboard_rebuilt_from_table(self):
+        """
+        Test that a game's leaderboard is built from stored values and rebuilt after another process ranks it
+        """
+        # GIVEN
+        game = Game.objects.create(title=TEST_GAME_TITLE)
+        low = Portfolio.objects.create(title=f"{TEST_PORTFOLIO_TITLE} 0", game=game, total_value=100)
+        high = Portfolio.objects.create(title=f"{TEST_PORTFOLIO_TITLE} 1", game=game, total_value=200)
+        board = leaderboards.get(game)
+        # WHEN
+        Portfolio.objects.filter(pk=low.pk).update(total_value=300)
+        Game.objects.filter(pk=game.pk).update(ranked_on=datetime.now(timezone.utc))
+        game.refresh_from_db()
+        rebuilt = leaderboards.get(game)
+        # THEN
+        self.assertEqual(board.rank(high.pk), 1)
+        self.assertIsNot(rebuilt, board)
+        self.assertEqual(rebuilt.rank(low.pk), 1)
+        self.assertIs(leaderboards.get(game), rebuilt)
+
+    def test_leaderboard_follows_saves(self):
+        """
+        Test that saving, ranking and deleting portfolios update a loaded leaderboard without a rebuild
+        """
+        # GIVEN
+        game = Game.objects.create(title=TEST_GAME_TITLE)
+        first = Portfolio.objects.create(title=f"{TEST_PORTFOLIO_TITLE} 0", game=game, cash_balance=10000)
+        second = Portfolio.objects.create(title=f"{TEST_PORTFOLIO_TITLE} 1", game=game, cash_balance=10000)
+        game.rank_portfolios()
+        board = leaderboards.get(game)
+        # WHEN
+        second.total_value = 20000
+        second.save()
+        rank_after_save = second.current_rank()
+        first.delete()
+        # THEN
+        self.assertEqual(rank_after_save, 1)
+        self.assertEqual(first.current_rank(), None)
+        self.assertEqual(len(board), 1)
+        self.assertIs(leaderboards.get(game), board)
+
+    def _cache_chain(self, calls=(), puts=()):
+        chain_cache.clear()
+        chain_cache.set(("AAPL", "2030-12-23"), OptionChain(
+            DataFrame({"contractSymbol": [c for c, _ in calls], "bid": [b for _, b in calls],
+                       "lastPrice": [b for _, b in calls]}),
+            DataFrame({"contractSymbol": [c for c, _ in puts], "bid": [b for _, b in puts],
+                       "lastPrice": [b for _, b in puts]}),
+        ))
+
+    @mock.patch("trade_simulation.quotes.fetch_quotes", return_value={"AAPL": {"bid": 200}})
+    @mock.patch("trade_simulation.models.Holding.ask_price", return_value=200)
+    def test_exercise_call_keeps_total_value(self, mock_ask_price, mock_fetch_quotes):
+        """
+        Test that exercising a call trades the value of its contracts for the shares, leaving the
+        portfolio's value on the leaderboard unchanged
+        """
+        # GIVEN
+        self._cache_chain(calls=[("AAPL301223C00148000", 52.0)])
+        game = Game.objects.create(title=TEST_GAME_TITLE)
+        portfolio = Portfolio.objects.create(title=TEST_PORTFOLIO_TITLE, game=game, cash_balance=20000)
+        other = Portfolio.objects.create(title=f"{TEST_PORTFOLIO_TITLE} 1", game=game, cash_balance=25100)
+        Option.objects.create(contract="AAPL301223C00148000", quantity=1, portfolio=portfolio)
+        game.rank_portfolios()
+        portfolio.refresh_from_db()
+        # WHEN
+        with self.captureOnCommitCallbacks(execute=True):
+            portfolio.buy_holding("AAPL", 100, exercise="AAPL301223C00148000")
+        # THEN
+        self.assertAlmostEqual(leaderboards.get(game).value(portfolio.pk), 25200.0)
+        self.assertAlmostEqual(float(Portfolio.objects.get(pk=portfolio.pk).total_value), 25200.0)
+        self.assertEqual(portfolio.current_rank(), 1)
+        self.assertEqual(other.current_rank(), 2)
+        game.rank_portfolios()
+        self.assertAlmostEqual(float(Portfolio.objects.get(pk=portfolio.pk).total_value), 25200.0)
+
+    @mock.patch("trade_simulation.quotes.fetch_quotes", return_value={"AAPL": {"bid": 200}})
+    @mock.patch("trade_simulation.models.Holding.bid_price", return_value=200)
+    def test_exercise_put_keeps_total_value(self, mock_bid_price, mock_fetch_quotes):
+        """
+        Test that exercising a put trades the value of its contracts for the sale above market
+        """
+        # GIVEN
+        self._cache_chain(puts=[("AAPL301223P00250000", 50.0)])
+        game = Game.objects.create(title=TEST_GAME_TITLE)
+        portfolio = Portfolio.objects.create(title=TEST_PORTFOLIO_TITLE, game=game, cash_balance=10000)
+        Holding.objects.create(portfolio=portfolio, ticker="AAPL", shares=100)
+        Option.objects.create(contract="AAPL301223P00250000", quantity=1, portfolio=portfolio)
+        game.rank_portfolios()
+        portfolio.refresh_from_db()
+        # WHEN
+        with self.captureOnCommitCallbacks(execute=True):
+            portfolio.sell_holding("AAPL", 100, exercise="AAPL301223P00250000")
+        # THEN
+        portfolio.refresh_from_db()
+        self.assertAlmostEqual(float(portfolio.cash_balance), 35000.0)
+        self.assertAlmostEqual(float(portfolio.total_value), 35000.0)
+        self.assertAlmostEqual(leaderboards.get(game).value(portfolio.pk), 35000.0)
+
+    def test_trade_updates_leaderboard_once_committed(self):
+        """
+        Test that a trade changes the shared leaderboard only when it commits, not when it rolls back
+        """
+        # GIVEN
+        game = Game.objects.create(title=TEST_GAME_TITLE)
+        portfolio = Portfolio.objects.create(title=TEST_PORTFOLIO_TITLE, game=game, cash_balance=100, total_value=100)
+        board = leaderboards.get(game)
+        # WHEN
+        with self.assertRaises(RuntimeError):
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    portfolio.apply_trade(portfolio, 0, 50)
+                    raise RuntimeError("rolled back")
+        rolled_back = board.value(portfolio.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                portfolio.apply_trade(Portfolio.objects.get(pk=portfolio.pk), 0, 50)
+        # THEN
+        self.assertEqual(rolled_back, 100)
+        self.assertEqual(board.value(portfolio.pk), 150)
+
+
+@override_settings(VALUE_HISTORY_TIERS=[(60, 3600), (3600, 86400), (86400, None)])
+class ValueHistoryTestCase(TestCase):
+    def setUp(self):
+        quote_cache.clear()
+        provider_breaker.reset()
+        self.game = Game.objects.create(title=TEST_GAME_TITLE)
+        self.first = Portfolio.objects.create(title=f"{TEST_PORTFOLIO_TITLE} 0", game=self.game, cash_balance=100)
+        self.second = Portfolio.objects.create(title=f"{TEST_PORTFOLIO_TITLE} 1", game=self.game, cash_balance=200)
+        self.start = datetime(2030, 1, 1, tzinfo=timezone.utc)
+
+    def _record(self, minutes, values):
+        # Records one snapshot of the game per minute offset, with the given values of the first portfolio
+        for minute, value in zip(minutes, values):
+            Portfolio.objects.filter(pk=self.first.pk).update(total_value=value)
+            portfolios = list(Portfolio.objects.filter(game=self.game))
+            record_snapshots([snapshot_values(self.game, portfolios, self.start + timedelta(minutes=minute))])
+
+    def test_pack_values(self):
+        """
+        Test that values are packed as 8 bytes each and read back exactly
+        """
+        # GIVEN
+        values = [0.1, 12345678.91, -3.0]
+        # WHEN
+        packed = pack_values(values)
+        # THEN
+        self.assertEqual(len(packed), 24)
+        self.assertEqual(
+            [struct.unpack_from(VALUE_FORMAT, packed, i * VALUE_SIZE)[0] for i in range(len(values))], values
+        )
+        self.assertEqual(bucket_start(self.start + timedelta(seconds=90), 60), self.start + timedelta(minutes=1))
+
+    def test_refresh_standings_records_one_row_per_game(self):
+        """
+        Test that ranking games records one snapshot row per game, sharing the roster while it is unchanged
+        """
+        # WHEN
+        refresh_standings(max_age=0)
+        ValueSnapshot.objects.update(taken_on=self.start)
+        refresh_standings(max_age=0)
+        # THEN
+        snapshots = ValueSnapshot.objects.filter(game=self.game)
+        self.assertEqual(snapshots.count(), 2)
+        self.assertEqual(len({s.roster_id for s in snapshots}), 1)
+        self.assertEqual([v for _, v in value_series(self.second)], [200.0, 200.0])
+
+    def test_roll_up_history(self):
+        """
+        Test that snapshots past their retention are replaced by the last snapshot of each coarser bucket
+        """
+        # GIVEN
+        self._record([0, 30, 59, 60, 61, 150], [1, 2, 3, 4, 5, 6])
+        now = self.start + timedelta(minutes=200)
+        # WHEN
+        removed = roll_up_history(now)
+        # THEN
+        self.assertEqual(removed, 5)
+        series = value_series(self.first)
+        self.assertEqual([v for _, v in series], [3.0, 5.0, 6.0])
+        self.assertEqual(
+            list(ValueSnapshot.objects.values_list("resolution", flat=True)), [3600, 3600, 60]
+        )
+
+    def test_value_series_downsampled(self):
+        """
+        Test that a long history is downsampled to the last value of each time bucket within the range
+        """
+        # GIVEN
+        self._record(range(10), range(10))
+        # WHEN
+        actual = value_series(self.first, points=5)
+        ranged = value_series(self.first, start=self.start + timedelta(minutes=8))
+        # THEN
+        self.assertEqual([v for _, v in actual], [1.0, 3.0, 5.0, 7.0, 9.0])
+        self.assertEqual([v for _, v in ranged], [8.0, 9.0])
+
+    def test_value_series_new_portfolio(self):
+        """
+        Test that snapshots taken before a portfolio joined the game are left out of its history
+        """
+        # GIVEN
+        self._record([0], [1])
+        late = Portfolio.objects.create(title=f"{TEST_PORTFOLIO_TITLE} 2", game=self.game, total_value=300)
+        self._record([1], [2])
+        # WHEN / THEN
+        self.assertEqual([v for _, v in value_series(late)], [300.0])
+        self.assertEqual([v for _, v in value_series(self.first)], [1.0, 2.0])
+
+
+class OrdersTestCase(TestCase):
+    def setUp(self):
+        quote_cache.clear()
+        provider_breaker.reset()
+        self.portfolio = Portfolio.objects.create(title=TEST_PORTFOLIO_TITLE, cash_balance=10000)
+        Holding.objects.create(ticker="AAPL", shares=10, portfolio=self.portfolio)
+        self.quotes = {
+            "AAPL": {"bid": 100.0, "ask": 101.0},
+            "TSLA": {"bid": 99.0, "ask": 100.0},
+        }
+        self.chains = {
+            ("AAPL", "2030-12-23"): OptionChain(
+                DataFrame({"contractSymbol": ["AAPL301223C00148000"], "bid": [1.0], "ask": [2.0], "lastPrice": [1.5]}),
+                DataFrame({"contractSymbol": []}),
+            )
+        }
+
+    def _execute(self, orders, all_or_nothing=True):
+        with mock.patch("trade_simulation.orders.get_quotes", return_value=self.quotes) as mock_quotes, \
+                mock.patch("trade_simulation.orders.get_option_chains", return_value=self.chains) as mock_chains:
+            orders = execute_orders(self.portfolio, orders, all_or_nothing)
+        self.assertLessEqual(mock_quotes.call_count, 1)
+        self.assertLessEqual(mock_chains.call_count, 1)
+        return [order.status for order in orders]
+
+    def test_mixed_batch_best_effort(self):
+        """
+        Test that a best-effort batch executes the stock and option orders it can and rejects the others
+        """
+        # GIVEN
+        orders = [
+            Order("stock", "TSLA", 5),
+            Order("option", "AAPL301223C00148000", 2),
+            Order("stock", "AAPL", -4),
+            Order("stock", "TSLA", 1000),
+            Order("stock", "MSFT", 1),
+        ]
+        # WHEN
+        statuses = self._execute(orders, all_or_nothing=False)
+        # THEN
+        self.assertEqual(statuses, ["filled", "filled", "filled", "rejected", "rejected"])
+        self.assertEqual(Portfolio.objects.get(pk=self.portfolio.pk).cash_balance, Decimal("9500.00"))
+        self.assertEqual(self.portfolio.cash_balance, Decimal("9500.00"))
+        self.assertEqual(Holding.objects.get(portfolio=self.portfolio, ticker="AAPL").shares, 6)
+        self.assertEqual(Holding.objects.get(portfolio=self.portfolio, ticker="TSLA").shares, 5)
+        option = Option.objects.get(portfolio=self.portfolio)
+        self.assertEqual((option.quantity, option.underlying), (2, "AAPL"))
+        self.assertEqual(
+            sorted(Transaction.objects.filter(portfolio=self.portfolio).values_list("trade_type", flat=True)),
+            ["BUY", "BUY CALL", "SELL"],
+        )
+
+    def test_all_or_nothing_batch_rejected(self):
+        """
+        Test that one rejected order cancels an all-or-nothing batch without writing anything
+        """
+        # GIVEN
+        orders = [Order("stock", "TSLA", 5), Order("stock", "AAPL", -11)]
+        # WHEN
+        statuses = self._execute(orders)
+        # THEN
+        self.assertEqual(statuses, ["cancelled", "rejected"])
+        self.assertEqual(Portfolio.objects.get(pk=self.portfolio.pk).cash_balance, 10000)
+        self.assertFalse(Holding.objects.filter(ticker="TSLA").exists())
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_sells_fund_buys(self):
+        """
+        Test that cash is checked across the batch, with sells applied first, and emptied positions deleted
+        """
+        # GIVEN
+        orders = [Order("stock", "TSLA", 105), Order("stock", "AAPL", -10)]
+        # WHEN
+        with CaptureQueriesContext(connection) as queries:
+            statuses = self._execute(orders)
+        # THEN
+        self.assertEqual(statuses, ["filled", "filled"])
+        self.assertEqual(Portfolio.objects.get(pk=self.portfolio.pk).cash_balance, Decimal("500.00"))
+        self.assertEqual(list(Holding.objects.values_list("ticker", flat=True)), ["TSLA"])
+        statements = [q["sql"] for q in queries.captured_queries if "SAVEPOINT" not in q["sql"]]
+        # Lock, two position reads, delete, insert, portfolio update and one transaction insert
+        self.assertEqual(len(statements), 7)
+
+
+class OrderBookTestCase(TestCase):
+    def setUp(self):
+        quote_cache.clear()
+        provider_breaker.reset()
+        self.portfolio = Portfolio.objects.create(title=TEST_PORTFOLIO_TITLE, cash_balance=1000)
+        Holding.objects.create(ticker="TSLA", shares=5, portfolio=self.portfolio)
+
+    def _order(self, ticker, shares, order_type, trigger_price):
+        return RestingOrder.objects.create(
+            portfolio=self.portfolio, ticker=ticker, shares=shares, order_type=order_type, trigger_price=trigger_price
+        )
+
+    def test_crossed(self):
+        """
+        Test that a quote takes out exactly the limit and stop orders it crosses, comparing buys with the ask
+        and sells with the bid
+        """
+        # GIVEN
+        book = OrderBook()
+        book.add("buy-limit-hit", "AAPL", True, "LIMIT", 101)
+        book.add("buy-limit-miss", "AAPL", True, "LIMIT", 100.5)
+        book.add("sell-limit-hit", "AAPL", False, "LIMIT", 100)
+        book.add("sell-limit-miss", "AAPL", False, "LIMIT", 100.5)
+        book.add("buy-stop-hit", "AAPL", True, "STOP", 90)
+        book.add("buy-stop-miss", "AAPL", True, "STOP", 102)
+        book.add("sell-stop-hit", "AAPL", False, "STOP", 110)
+        book.add("sell-stop-miss", "AAPL", False, "STOP", 99)
+        book.add("other-ticker", "TSLA", True, "LIMIT", 1000)
+        # WHEN
+        crossed = [order_id for order_id, _, _ in book.crossed("AAPL", bid=100, ask=101)]
+        # THEN
+        self.assertEqual(sorted(crossed), ["buy-limit-hit", "buy-stop-hit", "sell-limit-hit", "sell-stop-hit"])
+        self.assertEqual(len(book), 5)
+        self.assertEqual(book.crossed("AAPL", bid=100, ask=101), [])
+        self.assertEqual(book.tickers(), ["AAPL", "TSLA"])
+
+    def test_crossed_touches_only_crossed_orders(self):
+        """
+        Test that a small price move among many open orders takes out only the orders it crosses
+        """
+        # GIVEN
+        book = OrderBook()
+        for i in range(20000):
+            book.add(f"buy-{i}", "AAPL", True, "LIMIT", 50 + i / 1000)
+        book.remove("buy-19999")
+        # WHEN
+        crossed = book.crossed("AAPL", bid=69.99, ask=69.995)
+        # THEN
+        self.assertEqual(len(crossed), 4)
+        self.assertEqual(len(book), 19995)
+
+    def test_match_fills_in_bulk(self):
+        """
+        Test that matching fills triggered orders at market, rejects those that cannot be covered and
+        skips orders cancelled since they were loaded
+        """
+        # GIVEN
+        buy = self._order("AAPL", 5, "LIMIT", 100)
+        stop = self._order("TSLA", -5, "STOP", 200)
+        unaffordable = self._order("AAPL", 50, "LIMIT", 100)
+        cancelled = self._order("AAPL", 1, "LIMIT", 100)
+        untouched = self._order("AAPL", 1, "LIMIT", 50)
+        book = OrderBook()
+        book.sync()
+        RestingOrder.objects.filter(pk=cancelled.pk).update(status=RestingOrder.STATUS_CANCELLED)
+        quotes = {"AAPL": {"bid": 98.0, "ask": 99.0}, "TSLA": {"bid": 150.0, "ask": 151.0}}
+        # WHEN
+        actual = book.match(quotes)
+        # THEN
+        self.assertEqual(actual, (2, 1))
+        statuses = dict(RestingOrder.objects.values_list("uid", "status"))
+        self.assertEqual(statuses[buy.uid], "FILLED")
+        self.assertEqual(statuses[stop.uid], "FILLED")
+        self.assertEqual(statuses[unaffordable.uid], "REJECTED")
+        self.assertEqual(statuses[cancelled.uid], "CANCELLED")
+        self.assertEqual(statuses[untouched.uid], "OPEN")
+        self.assertEqual(RestingOrder.objects.get(pk=buy.pk).fill_price, Decimal("99.00"))
+        # 1000 - 5 * 99 + 5 * 150
+        self.assertEqual(Portfolio.objects.get(pk=self.portfolio.pk).cash_balance, Decimal("1255.00"))
+        self.assertEqual(list(Holding.objects.values_list("ticker", "shares")), [("AAPL", 5)])
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.assertEqual(len(book), 1)
+
+    def test_match_restores_orders_of_failed_fill(self):
+        """
+        Test that orders whose fill fails are put back in the book and fill on the next quotes
+        """
+        # GIVEN
+        book = OrderBook()
+        buy = self._order("AAPL", 1, "LIMIT", 100)
+        book.sync()
+        quotes = {"AAPL": {"bid": 98, "ask": 99}}
+        # WHEN
+        with mock.patch("trade_simulation.orderbook.fill_resting_orders", side_effect=RuntimeError("db down")):
+            failed = book.match(quotes)
+        # THEN
+        self.assertEqual(failed, (0, 0))
+        self.assertEqual(len(book), 1)
+        self.assertEqual(book.match(quotes), (1, 0))
+        self.assertEqual(RestingOrder.objects.get(pk=buy.pk).status, "FILLED")
+
+    def test_sync_adds_new_orders_once(self):
+        """
+        Test that syncing picks up orders placed since the last sync without adding any twice
+        """
+        # GIVEN
+        book = OrderBook()
+        self._order("AAPL", 1, "LIMIT", 100)
+        book.sync()
+        self._order("AAPL", 1, "STOP", 120)
+        # WHEN / THEN
+        self.assertEqual(book.sync(), 1)
+        self.assertEqual(book.sync(), 0)
+        self.assertEqual(len(book), 2)
+
+
+class TradeQueueTestCase(TestCase):
+    def setUp(self):
+        quote_cache.clear()
+        provider_breaker.reset()
+        self.portfolio = Portfolio.objects.create(title=TEST_PORTFOLIO_TITLE, cash_balance=1000)
+        self.other = Portfolio.objects.create(title="Other Portfolio", cash_balance=1000)
+
+    def _queue(self, portfolio, shares, ticker="AAPL", key=None):
+        queued, _ = enqueue_trade(
+            portfolio, parse_trade({"securityType": "stock", "ticker": ticker, "shares": shares}), key
+        )
+        return queued
+
+    def test_parse_trade(self):
+        """
+        Test that parse_trade keeps the fields of a trade and refuses trades that can never execute
+        """
+        # WHEN
+        actual = parse_trade({"securityType": "option", "contract": "AAPL301223C00148000", "quantity": "-2"})
+        # THEN
+        self.assertEqual(actual, {"securityType": "option", "contract": "AAPL301223C00148000", "quantity": -2.0})
+        with self.assertRaises(ValueError):
+            parse_trade({"securityType": "stock", "ticker": "AAPL", "shares": 0})
+        with self.assertRaises(ValueError):
+            parse_trade({"securityType": "bond", "ticker": "AAPL", "shares": 1})
+
+    def test_enqueue_trade_idempotency_key(self):
+        """
+        Test that an order sent again with its idempotency key is queued once, and that a key cannot be
+        reused for another order
+        """
+        # GIVEN
+        first = self._queue(self.portfolio, 5, key="retry-1")
+        order = parse_trade({"securityType": "stock", "ticker": "AAPL", "shares": 5})
+        # WHEN
+        again, created = enqueue_trade(self.portfolio, order, "retry-1")
+        # THEN
+        self.assertFalse(created)
+        self.assertEqual(again.pk, first.pk)
+        self.assertEqual(QueuedTrade.objects.count(), 1)
+        with self.assertRaises(ValueError):
+            enqueue_trade(self.portfolio, parse_trade({"securityType": "stock", "ticker": "AAPL", "shares": 6}), "retry-1")
+        # The same key is free in another portfolio
+        self.assertTrue(enqueue_trade(self.other, order, "retry-1")[1])
+
+    def test_claim_trade_one_at_a_time_per_portfolio(self):
+        """
+        Test that trades of different portfolios are claimed in parallel, but a portfolio's next trade
+        only once its earlier trade finished
+        """
+        # GIVEN
+        first = self._queue(self.portfolio, 5)
+        second = self._queue(self.portfolio, -5)
+        other = self._queue(self.other, 1)
+        # WHEN
+        claimed = [claim_trade(), claim_trade(), claim_trade()]
+        # THEN
+        self.assertEqual(claimed, [first.pk, other.pk, None])
+        QueuedTrade.objects.filter(pk=first.pk).update(status=QueuedTrade.STATUS_DONE)
+        self.assertEqual(claim_trade(), second.pk)
+        self.assertEqual(QueuedTrade.objects.get(pk=second.pk).attempts, 1)
+
+    def test_claim_trades_past_busy_portfolio(self):
+        """
+        Test that a portfolio with many queued trades does not keep other portfolios' trades from being claimed
+        """
+        # GIVEN
+        busy = [self._queue(self.portfolio, 1) for _ in range(25)]
+        other = self._queue(self.other, 1)
+        # WHEN
+        with CaptureQueriesContext(connection) as queries:
+            claimed = claim_trades(10)
+        # THEN
+        self.assertEqual(claimed, [busy[0].pk, other.pk])
+        self.assertEqual(sum(query["sql"].startswith("SELECT") for query in queries.captured_queries), 1)
+        self.assertEqual(claim_trade(), None)
+
+    @mock.patch("trade_simulation.quotes.fetch_quotes", return_value={"AAPL": {"ask": 100, "bid": 99}})
+    def test_worker_executes_trades_in_order(self, mock_fetch_quotes):
+        """
+        Test that a worker executes queued trades in the order they were queued, recording the outcome
+        of each, including refused trades
+        """
+        # GIVEN
+        buy = self._queue(self.portfolio, 5)
+        sell = self._queue(self.portfolio, -3)
+        oversell = self._queue(self.portfolio, -10)
+        # WHEN
+        processed = TradeWorker(poll_interval=0).run_once()
+        # THEN
+        self.assertEqual(processed, 3)
+        statuses = dict(QueuedTrade.objects.values_list("uid", "status"))
+        self.assertEqual(statuses[buy.uid], "DONE")
+        self.assertEqual(statuses[sell.uid], "DONE")
+        self.assertEqual(statuses[oversell.uid], "FAILED")
+        self.assertIn("AAPL", QueuedTrade.objects.get(pk=oversell.pk).error)
+        self.assertEqual(Holding.objects.get(portfolio=self.portfolio).shares, 2)
+        # 1000 - 5 * 100 + 3 * 99
+        self.assertEqual(Portfolio.objects.get(pk=self.portfolio.pk).cash_balance, Decimal("797.00"))
+
+    @mock.patch("trade_simulation.tradequeue.multiprocessing.Process")
+    def test_run_workers_uses_default_start_method(self, mock_process):
+        """
+        Test that the worker pool starts its processes with the platform's default start method, through an
+        entry point that sets Django up in spawned processes
+        """
+        # WHEN
+        run_workers(workers=2, poll_interval=0.5)
+        # THEN
+        self.assertEqual(mock_process.call_count, 2)
+        self.assertIs(mock_process.call_args.kwargs["target"], run_worker_process)
+        self.assertEqual(mock_process.call_args.kwargs["args"], (0.5,))
+        self.assertEqual(mock_process.return_value.start.call_count, 2)
+
+    @mock.patch("trade_simulation.tradequeue.close_old_connections")
+    def test_worker_drops_dead_connections_every_poll(self, mock_close_old_connections):
+        """
+        Test that a worker drops unusable database connections before every poll, so that it recovers
+        once the database is back
+        """
+        # GIVEN
+        worker = TradeWorker(poll_interval=0)
+        polls = []
+
+        def run_once():
+            polls.append(mock_close_old_connections.call_count)
+            if len(polls) == 2:
+                worker.stop()
+            raise RuntimeError("connection already closed")
+        worker.run_once = run_once
+        # WHEN
+        worker.run()
+        # THEN
+        self.assertEqual(polls, [1, 2])
+
+    @mock.patch("trade_simulation.tradequeue.price_orders", side_effect=ConnectionError("provider down"))
+    def test_provider_error_queues_trade_again(self, mock_price_orders):
+        """
+        Test that a trade hit by a provider error is queued again until it runs out of attempts
+        """
+        # GIVEN
+        queued = self._queue(self.portfolio, 5)
+        # WHEN
+        with override_settings(TRADE_QUEUE_MAX_ATTEMPTS=2):
+            first = process_trade(claim_trade())
+            second = process_trade(claim_trade())
+        # THEN
+        self.assertEqual(first.status, QueuedTrade.STATUS_PENDING)
+        self.assertEqual(first.error, "provider down")
+        self.assertEqual(second.pk, queued.pk)
+        self.assertEqual(second.status, QueuedTrade.STATUS_FAILED)
+        self.assertIsNotNone(second.finished_on)
+
+    def test_requeue_stale_trades(self):
+        """
+        Test that trades left running longer than the timeout are queued again
+        """
+        # GIVEN
+        stale = self._queue(self.portfolio, 5)
+        fresh = self._queue(self.other, 5)
+        now = datetime.now(timezone.utc)
+        QueuedTrade.objects.filter(pk=stale.pk).update(status="RUNNING", started_on=now - timedelta(seconds=600))
+        QueuedTrade.objects.filter(pk=fresh.pk).update(status="RUNNING", started_on=now)
+        # WHEN
+        actual = requeue_stale_trades(timeout=300)
+        # THEN
+        self.assertEqual(actual, 1)
+        self.assertEqual(QueuedTrade.objects.get(pk=stale.pk).status, "PENDING")
+        self.assertEqual(QueuedTrade.objects.get(pk=fresh.pk).status, "RUNNING")
+
+
+class JournalTestCase(TestCase):
+    def setUp(self):
+        quote_cache.clear()
+        provider_breaker.reset()
+        self.portfolio = Portfolio.objects.create(title=TEST_PORTFOLIO_TITLE, cash_balance=1000)
+
+    def _transaction(self, ticker="AAPL"):
+        return Transaction(portfolio=self.portfolio, ticker=ticker, trade_type="BUY", shares=1, bought_price=10)
+
+    def _inserts(self, queries):
+        return [q for q in queries if q["sql"].startswith('INSERT INTO "trade_simulation_transaction"')]
+
+    def test_record_outside_batch(self):
+        """
+        Test that records appended outside a batch are written right away
+        """
+        # WHEN
+        journal.record([self._transaction(), self._transaction("TSLA")])
+        # THEN
+        self.assertEqual(Transaction.objects.count(), 2)
+
+    def test_batch_writes_before_commit(self):
+        """
+        Test that a batch buffers its records and writes them with one insert when it closes
+        """
+        # GIVEN
+        with CaptureQueriesContext(connection) as queries:
+            # WHEN
+            with journal.batch():
+                for _ in range(3):
+                    journal.record([self._transaction()])
+                buffered = Transaction.objects.count()
+        # THEN
+        self.assertEqual(buffered, 0)
+        self.assertEqual(Transaction.objects.count(), 3)
+        self.assertEqual(len(self._inserts(queries.captured_queries)), 1)
+
+    @override_settings(JOURNAL_BATCH_SIZE=2)
+    def test_batch_flushes_when_full(self):
+        """
+        Test that a batch writes its buffer early once it holds JOURNAL_BATCH_SIZE records
+        """
+        # WHEN
+        with journal.batch() as batch:
+            journal.record([self._transaction() for _ in range(3)])
+            written = Transaction.objects.count()
+            due = batch.due()
+        # THEN
+        self.assertEqual(written, 3)
+        self.assertTrue(due)
+
+    @override_settings(JOURNAL_BATCH_SIZE=2)
+    def test_failed_block_records_dropped(self):
+        """
+        Test that the records of a failed block are dropped with its savepoint, whether still buffered
+        or already written, while the rest of the batch commits
+        """
+        # WHEN
+        with journal.batch():
+            journal.record([self._transaction("KEEP")])
+            with self.assertRaises(ValueError):
+                with journal.atomic():
+                    journal.record([self._transaction("DROP") for _ in range(2)])
+                    journal.record([self._transaction("DROP")])
+                    raise ValueError("refused")
+        # THEN
+        self.assertEqual(list(Transaction.objects.values_list("ticker", flat=True)), ["KEEP"])
+
+    def test_failed_batch_writes_nothing(self):
+        """
+        Test that a batch rolled back by an error writes none of its records
+        """
+        # WHEN
+        with self.assertRaises(ValueError):
+            with journal.batch():
+                journal.record([self._transaction()])
+                raise ValueError("failed")
+        # THEN
+        self.assertEqual(Transaction.objects.count(), 0)
+        journal.record([self._transaction()])
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    @mock.patch("trade_simulation.quotes.fetch_quotes", return_value={"AAPL": {"ask": 10, "bid": 9}})
+    def test_worker_commits_trades_in_batches(self, mock_fetch_quotes):
+        """
+        Test that a trade worker writes the transactions of the trades it batches with one insert
+        """
+        # GIVEN
+        for i in range(3):
+            portfolio = Portfolio.objects.create(title=f"Portfolio {i}", cash_balance=1000)
+            enqueue_trade(portfolio, parse_trade({"securityType": "stock", "ticker": "AAPL", "shares": 1}))
+        # WHEN
+        with override_settings(JOURNAL_MAX_DELAY=60):
+            with CaptureQueriesContext(connection) as queries:
+                processed = TradeWorker(poll_interval=0).run_once()
+        # THEN
+        self.assertEqual(processed, 3)
+        self.assertEqual(Transaction.objects.count(), 3)
+        self.assertEqual(len(self._inserts(queries.captured_queries)), 1)
+        self.assertEqual(set(QueuedTrade.objects.values_list("status", flat=True)), {"DONE"})
+        # Priced together, before the batch
+        mock_fetch_quotes.assert_called_once()
@@ -0,0 +1,314 @@
+import multiprocessing
+from datetime import timedelta
+from threading import Event
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, connections, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+from .journal import journal
+from .models import QueuedTrade
+from .orders import ORDER_REJECTED, SECURITY_TYPE_OPTION, SECURITY_TYPE_STOCK, Order, _check, price_orders
+from .workerprocess import run_worker_process
+
+DEFAULT_TRADE_QUEUE_WORKERS = 4
+DEFAULT_TRADE_QUEUE_POLL_INTERVAL = 1
+# Seconds after which a trade still running is assumed to belong to a dead worker and is queued again
+DEFAULT_TRADE_QUEUE_RUNNING_TIMEOUT = 300
+# Attempts at a trade failing on price provider errors before it is given up
+DEFAULT_TRADE_QUEUE_MAX_ATTEMPTS = 5
+# Trades a worker claims and prices together before executing them in journal batches
+TRADE_QUEUE_CLAIM_BATCH = 50
+UNFINISHED = (QueuedTrade.STATUS_PENDING, QueuedTrade.STATUS_RUNNING)
+
+
+def parse_trade(data):
+    """
+    parse_trade checks a trade request, without pricing it, and keeps only the fields it needs
+    Returns: dict with the order or ValueError
+    """
+    security_type = data.get("securityType")
+    if security_type == SECURITY_TYPE_STOCK:
+        symbol_field, quantity_field = "ticker", "shares"
+    elif security_type == SECURITY_TYPE_OPTION:
+        symbol_field, quantity_field = "contract", "quantity"
+    else:
+        error = f"Option type {security_type} is not supported."
+        print(error)
+        raise ValueError(error)
+    symbol = data.get(symbol_field)
+    try:
+        quantity = float(data.get(quantity_field))
+    except (TypeError, ValueError):
+        quantity = 0
+    if not symbol or quantity == 0:
+        error = f"A {security_type} trade needs a {symbol_field} and a nonzero number of {quantity_field}."
+        print(error)
+        raise ValueError(error)
+    order = {"securityType": security_type, symbol_field: str(symbol), quantity_field: quantity}
+    if security_type == SECURITY_TYPE_STOCK:
+        order["exercise"] = data.get("exercise") or None
+    return order
+
+
+def enqueue_trade(portfolio, order, idempotency_key=None):
+    """
+    enqueue_trade stores a checked order in the trade queue of portfolio. An order sent again with
+    the same idempotency key is not queued twice: the trade queued the first time is returned.
+    Returns: tuple of (QueuedTrade, whether it was queued by this call) or ValueError when the key
+    was used for a different order
+    """
+    if idempotency_key:
+        queued = QueuedTrade.objects.filter(portfolio=portfolio, idempotency_key=idempotency_key).first()
+        if queued is not None:
+            return _same_order(queued, order), False
+    try:
+        with transaction.atomic():
+            queued = QueuedTrade.objects.create(
+                portfolio=portfolio, idempotency_key=idempotency_key or None, order=order
+            )
+    except IntegrityError:
+        # A concurrent retry queued the order first
+        queued = QueuedTrade.objects.get(portfolio=portfolio, idempotency_key=idempotency_key)
+        return _same_order(queued, order), False
+    return queued, True
+
+
+def _same_order(queued, order):
+    if queued.order != order:
+        error = f"Idempotency key {queued.idempotency_key} was already used for another trade."
+        print(error)
+        raise ValueError(error)
+    return queued
+
+
+def claim_trades(limit=1):
+    """
+    claim_trades marks up to limit of the oldest pending trades that may run now as running. A trade
+    may run when its portfolio has no earlier unfinished trade, so that each portfolio's trades run
+    one at a time in the order they were queued, while trades of different portfolios run in parallel.
+    The trades are chosen with one query, which picks the oldest pending trade of each portfolio.
+    Returns: list of uids of the claimed trades, oldest first
+    """
+    # An earlier trade claimed but not yet committed by another worker still reads as pending
+    earlier = QueuedTrade.objects.filter(
+        Q(created_on__lt=OuterRef("created_on")) | Q(created_on=OuterRef("created_on"), uid__lt=OuterRef("uid")),
+        portfolio_id=OuterRef("portfolio_id"),
+        status__in=UNFINISHED,
+    )
+    # Committed on its own, so that the rows claimed are not kept locked from other workers
+    with transaction.atomic(durable=True):
+        uids = list(
+            QueuedTrade.objects.select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)
+            .filter(~Exists(earlier), status=QueuedTrade.STATUS_PENDING)
+            .order_by("created_on", "uid")
+            .values_list("uid", flat=True)[:limit]
+        )
+        if uids:
+            QueuedTrade.objects.filter(pk__in=uids).update(
+                status=QueuedTrade.STATUS_RUNNING, started_on=timezone.now(), attempts=F("attempts") + 1
+            )
+    return uids
+
+
+def claim_trade():
+    """
+    claim_trade marks the oldest pending trade that may run now as running
+    Returns: uid of the claimed trade or None if none may run
+    """
+    uids = claim_trades()
+    return uids[0] if uids else None
+
+
+def price_trades(trades):
+    """
+    price_trades prices queued trades at their execution price (ask to buy, bid to sell) before any
+    lock is taken, with one batched lookup of quotes and option chains. When the batch fails, each
+    trade is priced on its own so that one failing symbol only holds back its own trades.
+    Returns: list of (price, error) tuples, error being the ValueError refusing the trade or the
+    exception that kept it from being priced
+    """
+    orders = []
+    for queued in trades:
+        order = queued.order
+        if order["securityType"] == SECURITY_TYPE_STOCK:
+            orders.append(Order(SECURITY_TYPE_STOCK, order["ticker"], order["shares"]))
+        else:
+            orders.append(Order(SECURITY_TYPE_OPTION, order["contract"], order["quantity"]))
+        _check(orders[-1])
+    failures = {}
+    try:
+        price_orders(orders)
+    except Exception:
+        for order in orders:
+            try:
+                price_orders([order])
+            except Exception as e:
+                failures[order] = e
+    priced = []
+    for order in orders:
+        if order in failures:
+            priced.append((None, failures[order]))
+        elif order.status == ORDER_REJECTED:
+            priced.append((None, ValueError(order.error)))
+        else:
+            priced.append((order.price, None))
+    return priced
+
+
+def execute_trade(portfolio, order, price=None):
+    """
+    execute_trade buys or sells the stock or option of a queued order, at price when already known
+    Returns: N/A or ValueError when the trade is refused
+    """
+    if order["securityType"] == SECURITY_TYPE_STOCK:
+        ticker, shares, exercise = order["ticker"], order["shares"], order.get("exercise")
+        if shares > 0:
+            portfolio.buy_holding(ticker, shares, exercise=exercise, price=price)
+        else:
+            portfolio.sell_holding(ticker, -shares, exercise=exercise, price=price)
+    else:
+        contract, quantity = order["contract"], order["quantity"]
+        if quantity > 0:
+            portfolio.buy_option(contract, quantity, price=price)
+        else:
+            portfolio.sell_option(contract, -quantity, price=price)
+
+
+def process_trade(uid, priced=None):
+    """
+    process_trade executes a claimed trade and records its outcome in the same database transaction,
+    so that a worker dying halfway leaves neither a half-recorded trade nor one executed twice.
+    priced is the (price, error) of the trade from price_trades; the trade is priced first, outside
+    the transaction, when not given. Refused trades fail; trades hit by price provider errors are
+    queued again, up to the attempt limit.
+    Returns: QueuedTrade
+    """
+    max_attempts = getattr(settings, "TRADE_QUEUE_MAX_ATTEMPTS", DEFAULT_TRADE_QUEUE_MAX_ATTEMPTS)
+    if priced is None:
+        (priced,) = price_trades([QueuedTrade.objects.get(pk=uid)])
+    price, error = priced
+    with transaction.atomic():
+        queued = QueuedTrade.objects.select_for_update().select_related("portfolio__game").get(pk=uid)
+        if queued.status != QueuedTrade.STATUS_RUNNING:
+            # Finished, or given up on as stale and queued again, in the meantime
+            return queued
+        try:
+            if error is not None:
+                raise error
+            with journal.atomic():
+                execute_trade(queued.portfolio, queued.order, price)
+            queued.status = QueuedTrade.STATUS_DONE
+            queued.error = ""
+        except ValueError as e:
+            queued.status = QueuedTrade.STATUS_FAILED
+            queued.error = str(e)
+        except Exception as e:
+            print(f"Error occurs when executing trade {uid}: {e}")
+            queued.error = str(e)
+            queued.status = (
+                QueuedTrade.STATUS_FAILED if queued.attempts >= max_attempts else QueuedTrade.STATUS_PENDING
+            )
+        if queued.status != QueuedTrade.STATUS_PENDING:
+            queued.finished_on = timezone.now()
+        queued.save(update_fields=["status", "error", "finished_on"])
+    return queued
+
+
+def requeue_stale_trades(timeout=None):
+    """
+    requeue_stale_trades queues again the trades left running by workers that died. Their trade was
+    rolled back with the worker's transaction, so running them again cannot execute them twice.
+    Returns: number of trades queued again
+    """
+    if timeout is None:
+        timeout = getattr(settings, "TRADE_QUEUE_RUNNING_TIMEOUT", DEFAULT_TRADE_QUEUE_RUNNING_TIMEOUT)
+    return QueuedTrade.objects.filter(
+        status=QueuedTrade.STATUS_RUNNING, started_on__lt=timezone.now() - timedelta(seconds=timeout)
+    ).update(status=QueuedTrade.STATUS_PENDING)
+
+
+class TradeWorker:
+    """
+    TradeWorker drains the trade queue: it claims trades that may run, prices them together and
+    executes them in journal batches, waiting poll_interval seconds whenever the queue is empty
+    """
+
+    def __init__(self, poll_interval=None):
+        if poll_interval is None:
+            poll_interval = getattr(settings, "TRADE_QUEUE_POLL_INTERVAL", DEFAULT_TRADE_QUEUE_POLL_INTERVAL)
+        self.poll_interval = float(poll_interval)
+        self._stop = Event()
+
+    def run_once(self):
+        """
+        run_once executes trades until none may run, or until one is queued again after a provider
+        error, so that it is retried after a poll interval rather than right away. Claims commit on
+        their own and trades are priced before any batch opens; a journal batch then only groups the
+        lock, update and journal steps of priced trades into one commit, until the batch is due.
+        Returns: number of trades processed
+        """
+        requeue_stale_trades()
+        processed = 0
+        while not self._stop.is_set():
+            uids = claim_trades(TRADE_QUEUE_CLAIM_BATCH)
+            if not uids:
+                break
+            trades = sorted(QueuedTrade.objects.filter(pk__in=uids), key=lambda t: uids.index(t.pk))
+            pending = list(zip(trades, price_trades(trades)))
+            retry = False
+            while pending:
+                with journal.batch() as batch:
+                    while pending:
+                        queued, priced = pending.pop(0)
+                        retry |= process_trade(queued.pk, priced).status == QueuedTrade.STATUS_PENDING
+                        processed += 1
+                        if batch.due():
+                            break
+            if retry:
+                break
+        return processed
+
+    def run(self):
+        """
+        run drains the queue until stop() is called
+        Returns: N/A
+        """
+        while not self._stop.is_set():
+            try:
+                # Drops a connection the database closed, which would otherwise fail every later poll
+                close_old_connections()
+                self.run_once()
+            except Exception as e:
+                # A failed poll must not kill the worker; the next poll retries
+                print(f"Error occurs when processing trades: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def stop(self):
+        """
+        stop asks the worker to exit after the current trade
+        Returns: N/A
+        """
+        self._stop.set()
+
+
+def run_workers(workers=None, poll_interval=None):
+    """
+    run_workers drains the trade queue with a pool of worker processes until they are interrupted
+    Returns: N/A
+    """
+    if workers is None:
+        workers = getattr(settings, "TRADE_QUEUE_WORKERS", DEFAULT_TRADE_QUEUE_WORKERS)
+    connections.close_all()
+    # The platform's default start method: fork on Linux, spawn on Windows and macOS
+    processes = [
+        multiprocessing.Process(target=run_worker_process, args=(poll_interval,), name=f"trade-worker-{i}")
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
@@ -0,0 +1,108 @@
+import numpy as np
+
+
+class PortfolioValuation:
+    """
+    PortfolioValuation values many portfolios at once. Positions are held as flat NumPy arrays
+    (portfolio index, ticker index, shares), so valuing every portfolio against a set of prices
+    is one gather and one segment sum instead of a Python loop over ORM instances.
+    """
+
+    def __init__(self, portfolios, positions, options=(), contract_size=1.0):
+        """
+        portfolios are Portfolio instances; positions are (portfolio id, ticker, shares) rows and
+        options are (portfolio id, contract, underlying, expiration date, option type, quantity) rows,
+        typically each from a single values_list query. One contract covers contract_size shares.
+        Positions and options of other portfolios are ignored.
+        """
+        self.portfolios = list(portfolios)
+        index = {portfolio.pk: i for i, portfolio in enumerate(self.portfolios)}
+        self.cash = np.array([float(p.cash_balance) for p in self.portfolios], dtype=np.float64)
+        owners, tickers, shares = [], [], []
+        for portfolio_id, ticker, quantity in positions:
+            i = index.get(portfolio_id)
+            if i is not None:
+                owners.append(i)
+                tickers.append(str(ticker))
+                shares.append(0.0 if quantity is None else quantity)
+        self.position_portfolio = np.array(owners, dtype=np.intp)
+        self.shares = np.array(shares, dtype=np.float64)
+        # Distinct tickers, and for every position the index of its ticker among them
+        self.tickers, self.position_ticker = np.unique(np.array(tickers, dtype=str), return_inverse=True)
+        self._init_options(index, options, contract_size)
+
+    def _init_options(self, index, options, contract_size):
+        owners, contracts, quantities = [], [], []
+        chain_of = {}
+        for portfolio_id, contract, underlying, expiration_date, option_type, quantity in options:
+            i = index.get(portfolio_id)
+            if i is None or expiration_date is None:
+                continue
+            owners.append(i)
+            contracts.append(contract)
+            quantities.append(0.0 if quantity is None else float(quantity) * contract_size)
+            chain_of[contract] = ((str(underlying), str(expiration_date)), option_type)
+        self.option_portfolio = np.array(owners, dtype=np.intp)
+        self.option_shares = np.array(quantities, dtype=np.float64)
+        # Distinct contracts, and for every option position the index of its contract among them
+        self.contracts, self.option_contract = np.unique(np.array(contracts, dtype=str), return_inverse=True)
+        # Distinct contracts grouped by chain and side, so each chain is read once
+        self.chain_groups = {}
+        for position, contract in enumerate(self.contracts.tolist()):
+            self.chain_groups.setdefault(chain_of[contract], []).append(position)
+
+    def __len__(self):
+        return len(self.portfolios)
+
+    def price_vector(self, prices):
+        """
+        price_vector lines up prices with the distinct tickers of the positions
+        Returns: NumPy array of prices, 0 for tickers without a price
+        """
+        return np.array([prices.get(ticker) or 0.0 for ticker in self.tickers], dtype=np.float64)
+
+    def equity_values(self, prices):
+        """
+        equity_values computes the combined market value of the positions of every portfolio
+        Returns: NumPy array of values, in the order of the portfolios
+        """
+        values = self.shares * self.price_vector(prices)[self.position_ticker]
+        return np.bincount(self.position_portfolio, weights=values, minlength=len(self.portfolios))
+
+    def chain_keys(self):
+        """
+        chain_keys lists the option chains needed to price every option position
+        Returns: set of (underlying, expiration date as YYYY-MM-DD) keys
+        """
+        return {key for key, _ in self.chain_groups}
+
+    def contract_price_vector(self, chains):
+        """
+        contract_price_vector prices the distinct contracts, one vectorized lookup per chain side
+        Returns: NumPy array of per-share prices, 0 for contracts whose chain or row is missing
+        """
+        prices = np.zeros(len(self.contracts), dtype=np.float64)
+        for (key, option_type), positions in self.chain_groups.items():
+            chain = chains.get(key)
+            if chain is not None:
+                prices[positions] = chain.bid_prices(self.contracts[positions].tolist(), option_type)
+        return prices
+
+    def option_values(self, chains):
+        """
+        option_values computes the combined market value of the option positions of every portfolio
+        Returns: NumPy array of values, in the order of the portfolios
+        """
+        values = self.option_shares * self.contract_price_vector(chains)[self.option_contract]
+        return np.bincount(self.option_portfolio, weights=values, minlength=len(self.portfolios))
+
+    def total_values(self, prices, chains=None):
+        """
+        total_values computes the total value (cash + equities + options) of every portfolio;
+        options are left out when no chains are given
+        Returns: NumPy array of values, in the order of the portfolios
+        """
+        values = self.cash + self.equity_values(prices)
+        if chains is not None:
+            values += self.option_values(chains)
+        return values
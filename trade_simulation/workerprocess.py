@@ -0,0 +1,19 @@
+import django
+from django.db import connections
+
+
+def run_worker_process(poll_interval):
+    """
+    run_worker_process runs a trade worker in a process of the pool. Processes started with spawn, the
+    default on Windows and macOS, begin in a fresh interpreter, so Django is set up before the trade
+    queue and its models are imported.
+    Returns: N/A
+    """
+    django.setup()
+    # Forked children must not share the parent's database connections
+    connections.close_all()
+    from .tradequeue import TradeWorker
+    try:
+        TradeWorker(poll_interval=poll_interval).run()
+    except KeyboardInterrupt:
+        pass
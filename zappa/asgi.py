@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "zappa.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up; serves /api/game/<title>/stream (Server-Sent Events)
+from api.streams import with_streams  # noqa: E402
+
+application = with_streams(django_application)
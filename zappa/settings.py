@@ -137,6 +137,77 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 TEST_OUTPUT_DIR = "test-reports"
 
+# Market data
+# Class that prices stocks and options; set to "trade_simulation.providers.ReplayProvider"
+# with {"path": <recording directory>} in MARKET_DATA_PROVIDER_OPTIONS to run offline
+MARKET_DATA_PROVIDER = os.environ.get(
+    "MARKET_DATA_PROVIDER", "trade_simulation.providers.YFinanceProvider"
+)
+MARKET_DATA_PROVIDER_OPTIONS = {}
+if os.environ.get("MARKET_DATA_REPLAY_DIR"):
+    MARKET_DATA_PROVIDER_OPTIONS = {"path": os.environ["MARKET_DATA_REPLAY_DIR"]}
+
+# Seconds a stock quote is served from the shared cache before the provider is called again
+QUOTE_CACHE_TTL = 60
+# Maximum number of tickers kept in the shared quote cache
+QUOTE_CACHE_SIZE = 2048
+# Seconds past QUOTE_CACHE_TTL (OPTION_CHAIN_CACHE_TTL for chains) a quote or option chain may still be used
+# to value portfolios while it is refreshed, or when refreshing it fails
+QUOTE_MAX_STALE_VALUATION = 900
+# Seconds past QUOTE_CACHE_TTL (OPTION_CHAIN_CACHE_TTL for chains) a quote or option chain may still be used
+# to execute a trade
+QUOTE_MAX_STALE_TRADE = 15
+# Seconds a downloaded option chain is reused for every contract on it
+OPTION_CHAIN_CACHE_TTL = 300
+# Maximum number of (underlying, expiration) option chains kept in memory
+OPTION_CHAIN_CACHE_SIZE = 128
+# Threads shared by all concurrent quote and option chain fetches of a process
+QUOTE_FETCH_MAX_WORKERS = 16
+# Maximum fetches a single request keeps in flight at once
+QUOTE_FETCH_CONCURRENCY = 8
+# Seconds a request waits for its concurrent fetches before giving up on them
+QUOTE_FETCH_TIMEOUT = 10
+# Consecutive provider failures after which the provider is no longer called
+QUOTE_BREAKER_FAILURE_THRESHOLD = 5
+# Seconds before a provider that kept failing is tried again
+QUOTE_BREAKER_RESET_TIMEOUT = 30
+# Seconds between bulk refreshes of every held ticker and option chain (manage.py refresh_quotes)
+QUOTE_REFRESH_INTERVAL = 30
+# Run the quote refresher in a background thread of the web process instead of a separate worker.
+# Required with LocalBroker for standings streams to receive refreshes (set by the Procfile)
+QUOTE_REFRESHER_IN_PROCESS = os.environ.get("QUOTE_REFRESHER_IN_PROCESS") == "1"
+# Seconds stored game standings are served before a read recomputes them (manage.py rank_games
+# and the quote refresher keep them fresh in the background)
+GAME_STANDINGS_MAX_AGE = 60
+# Default and maximum number of rows per page of the paginated game list and leaderboard
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+# Most orders accepted by one batch trade request
+TRADE_BATCH_MAX_ORDERS = 100
+# Worker processes executing queued trades (manage.py process_trades) and seconds between
+# their polls of an empty queue
+TRADE_QUEUE_WORKERS = 4
+TRADE_QUEUE_POLL_INTERVAL = 1
+# Seconds after which a queued trade still running is queued again, its worker presumed dead
+TRADE_QUEUE_RUNNING_TIMEOUT = 300
+# Attempts at a queued trade failing on price provider errors before it is marked failed
+TRADE_QUEUE_MAX_ATTEMPTS = 5
+# Transaction records written per bulk INSERT by the journal, and seconds a journal batch of queued
+# trades stays open before it commits
+JOURNAL_BATCH_SIZE = 500
+JOURNAL_MAX_DELAY = 0.2
+# Resolution and retention (seconds) of portfolio value history tiers, finest first; older
+# snapshots are rolled up into the next tier and the last tier is kept forever
+VALUE_HISTORY_TIERS = [(300, 2 * 86400), (3600, 60 * 86400), (86400, None)]
+# Class fanning out standings changes to streaming clients; LocalBroker only reaches clients
+# connected to the same process, so the web process must serve zappa.asgi with
+# QUOTE_REFRESHER_IN_PROCESS and a single worker
+LEADERBOARD_BROKER = "trade_simulation.broker.LocalBroker"
+# Seconds between keepalive comments on idle standings streams (served by zappa.asgi)
+STREAM_HEARTBEAT = 15
+# Standings changes buffered per streaming client before it is asked to resync
+STREAM_QUEUE_SIZE = 100
+
 CORS_ORIGIN_ALLOW_ALL = True
 
 if os.getcwd() == "/app":